@@ -11,6 +11,10 @@ from routes.enrollments import enrollments_bp
 from routes.progress import progress_bp
 from routes.upload import upload_bp
 from routes.admin import admin_bp
+from routes.students import students_bp
+from utils.auth import admin_required
+from utils import hashing, metrics
+from utils.compression import init_compression
 
 
 def create_app(config_name=None):
@@ -29,9 +33,15 @@ def create_app(config_name=None):
     else:
         print(f"{message}")
 
+    # pick the bcrypt cost now so the first login doesnt pay for the calibration
+    hashing.get_rounds()
+
     # enable cors for frontend
     CORS(app, origins=app.config["CORS_ORIGINS"], supports_credentials=True)
 
+    # gzip / brotli for large json responses
+    init_compression(app)
+
     # register all the routes
     app.register_blueprint(auth_bp, url_prefix="/api/auth")
     app.register_blueprint(users_bp, url_prefix="/api/users")
@@ -41,11 +51,18 @@ def create_app(config_name=None):
     app.register_blueprint(progress_bp, url_prefix="/api/progress")
     app.register_blueprint(upload_bp, url_prefix="/api/upload")
     app.register_blueprint(admin_bp, url_prefix="/api/admin")
+    app.register_blueprint(students_bp, url_prefix="/api/students")
 
     @app.route("/api/health", methods=["GET"])
     def health_check():
         return jsonify({"status": "healthy", "message": "LMS API is running"}), 200
 
+    @app.route("/api/metrics", methods=["GET"])
+    @admin_required
+    def get_metrics():
+        # counters for this worker process only
+        return jsonify({"pid": os.getpid(), **metrics.snapshot()}), 200
+
     @app.errorhandler(500)
     def internal_error(_error):
         return jsonify({"error": "Internal server error"}), 500
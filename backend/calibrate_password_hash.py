@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+# run this file on the instance type you deploy on to pick a bcrypt cost
+# python calibrate_password_hash.py
+# then set PASSWORD_HASH_ROUNDS so every gunicorn worker uses the same cost, or let
+# python calibrate_password_hash.py --write
+# save it to backend/.env, which config.py loads on startup
+
+import os
+import sys
+from config import Config
+from utils.hashing import calibrate_rounds
+
+ENV_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.env')
+
+
+def write_rounds(rounds, path=ENV_FILE):
+    # sets PASSWORD_HASH_ROUNDS in the .env file, keeping every other line
+    lines = []
+    if os.path.exists(path):
+        with open(path) as f:
+            lines = [line for line in f.read().splitlines() if not line.startswith('PASSWORD_HASH_ROUNDS=')]
+    lines.append(f'PASSWORD_HASH_ROUNDS={rounds}')
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+if __name__ == '__main__':
+    rounds = calibrate_rounds()
+    print(f"Target hash time: {Config.PASSWORD_HASH_TARGET_MS}ms")
+    print(f"PASSWORD_HASH_ROUNDS={rounds}")
+    if '--write' in sys.argv[1:]:
+        write_rounds(rounds)
+        print(f"Saved to {ENV_FILE}, restart the workers to use it")
@@ -30,8 +30,25 @@ class Config:
     DYNAMODB_COURSES_TABLE = 'lms-courses'
     DYNAMODB_MODULES_TABLE = 'lms-modules'
     DYNAMODB_ENROLLMENTS_TABLE = 'lms-enrollments'
-    DYNAMODB_PROGRESS_TABLE = 'lms-progress'
+    DYNAMODB_PROGRESS_TABLE = 'lms-progress-v2'  # studentId + courseId#moduleId
+    DYNAMODB_LEGACY_PROGRESS_TABLE = 'lms-progress'  # old progressId layout, copied by aws_setup
     DYNAMODB_SPECIALIZATIONS_TABLE = 'lms-specializations'
+    DYNAMODB_USER_EMAILS_TABLE = 'lms-user-emails'  # email -> userId, keeps emails unique
+    DYNAMODB_INSTRUCTOR_COURSES_TABLE = 'lms-instructor-courses'  # instructorId -> courseId
+    DYNAMODB_IMPORT_JOBS_TABLE = 'lms-import-jobs'  # background bulk imports and their results
+    DYNAMODB_MIGRATIONS_TABLE = 'lms-migrations'  # progress of the one-off migrations in aws_setup
+
+    # shared dynamodb connection settings (one pool per gunicorn worker)
+    DYNAMODB_MAX_POOL_CONNECTIONS = int(os.getenv('DYNAMODB_MAX_POOL_CONNECTIONS', '25'))
+    DYNAMODB_TCP_KEEPALIVE = os.getenv('DYNAMODB_TCP_KEEPALIVE', 'True').lower() == 'true'
+    DYNAMODB_CONNECT_TIMEOUT = int(os.getenv('DYNAMODB_CONNECT_TIMEOUT', '5'))
+    DYNAMODB_READ_TIMEOUT = int(os.getenv('DYNAMODB_READ_TIMEOUT', '10'))
+    DYNAMODB_RETRY_MODE = os.getenv('DYNAMODB_RETRY_MODE', 'adaptive')
+    DYNAMODB_MAX_ATTEMPTS = int(os.getenv('DYNAMODB_MAX_ATTEMPTS', '5'))
+    # segments (and threads) used for parallel full table scans on admin pages
+    DYNAMODB_SCAN_SEGMENTS = int(os.getenv('DYNAMODB_SCAN_SEGMENTS', '4'))
+    # threads used to send BatchWriteItem chunks (seeding, bulk imports)
+    DYNAMODB_BATCH_WRITE_WORKERS = int(os.getenv('DYNAMODB_BATCH_WRITE_WORKERS', '4'))
 
     # admin login details
     ADMIN_EMAIL = _ADMIN_CONFIG['email']
@@ -54,6 +71,61 @@ class Config:
     MAX_UPLOAD_SIZE = 10 * 1024 * 1024  # 10MB
     ALLOWED_EXTENSIONS = {'pdf', 'doc', 'docx', 'txt', 'jpg', 'jpeg', 'png', 'mp4', 'mp3'}
 
+    # bcrypt pool per worker process, extra requests wait in the queue and past that get a 503
+    # gunicorn runs 8 threads per worker (Procfile/Dockerfile), workers + queue limit stays below
+    # that so a login burst always leaves threads free for the rest of the api
+    PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', '2'))
+    PASSWORD_HASH_QUEUE_LIMIT = int(os.getenv('PASSWORD_HASH_QUEUE_LIMIT', '4'))
+    PASSWORD_HASH_TIMEOUT = int(os.getenv('PASSWORD_HASH_TIMEOUT', '10'))  # seconds
+    # bcrypt cost factor, set it in production (python calibrate_password_hash.py --write saves it
+    # to .env). stored hashes are moved to this cost on login. when it is not set every worker
+    # calibrates its own cost on startup to the highest one that hashes within
+    # PASSWORD_HASH_TARGET_MS (and warns), and stored hashes keep the cost they have
+    PASSWORD_HASH_ROUNDS = int(os.getenv('PASSWORD_HASH_ROUNDS')) if os.getenv('PASSWORD_HASH_ROUNDS') else None
+    PASSWORD_HASH_TARGET_MS = int(os.getenv('PASSWORD_HASH_TARGET_MS', '250'))
+    PASSWORD_HASH_MIN_ROUNDS = int(os.getenv('PASSWORD_HASH_MIN_ROUNDS', '10'))
+    PASSWORD_HASH_MAX_ROUNDS = int(os.getenv('PASSWORD_HASH_MAX_ROUNDS', '16'))
+
+    # per-process read-through cache for courses, modules and specializations
+    CATALOG_CACHE_ENABLED = os.getenv('CATALOG_CACHE_ENABLED', 'True').lower() == 'true'
+    CATALOG_CACHE_TTL = int(os.getenv('CATALOG_CACHE_TTL', '60'))  # seconds
+    CATALOG_CACHE_MAX_ENTRIES = int(os.getenv('CATALOG_CACHE_MAX_ENTRIES', '2048'))
+    # share the catalog cache between all workers on a host (sqlite file on /dev/shm)
+    CATALOG_SHARED_CACHE_ENABLED = os.getenv('CATALOG_SHARED_CACHE_ENABLED', 'False').lower() == 'true'
+    CATALOG_SHARED_CACHE_PATH = os.getenv('CATALOG_SHARED_CACHE_PATH')  # default /dev/shm/lms-catalog-cache-<uid>/catalog.sqlite3
+    CATALOG_SHARED_CACHE_MMAP_MB = int(os.getenv('CATALOG_SHARED_CACHE_MMAP_MB', '64'))
+
+    # response compression, gzip always and brotli when the brotli package is installed
+    COMPRESSION_ENABLED = os.getenv('COMPRESSION_ENABLED', 'True').lower() == 'true'
+    COMPRESSION_MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE', '1024'))  # bytes, smaller bodies are sent as they are
+    COMPRESSION_GZIP_LEVEL = int(os.getenv('COMPRESSION_GZIP_LEVEL', '6'))
+    COMPRESSION_BROTLI_QUALITY = int(os.getenv('COMPRESSION_BROTLI_QUALITY', '4'))
+    COMPRESSION_MIMETYPES = {'application/json', 'text/html', 'text/plain', 'text/css', 'application/javascript'}
+
+    # cursor pagination on list endpoints (?limit=&cursor=)
+    PAGE_SIZE_DEFAULT = int(os.getenv('PAGE_SIZE_DEFAULT', '50'))
+    PAGE_SIZE_MAX = int(os.getenv('PAGE_SIZE_MAX', '200'))
+    # filtered pages give up after reading this many times the page size
+    PAGE_SCAN_FACTOR = int(os.getenv('PAGE_SCAN_FACTOR', '10'))
+
+    # threads per worker process for reads one request issues at the same time
+    REQUEST_FANOUT_WORKERS = int(os.getenv('REQUEST_FANOUT_WORKERS', '16'))
+
+    # threads per worker process for background event subscribers (utils/events.py)
+    EVENT_BACKGROUND_WORKERS = int(os.getenv('EVENT_BACKGROUND_WORKERS', '2'))
+
+    # per-course analytics (GET /api/courses/<id>/analytics) are cached this long
+    COURSE_ANALYTICS_CACHE_TTL = int(os.getenv('COURSE_ANALYTICS_CACHE_TTL', '300'))  # seconds
+
+    # bulk student import (csv / ndjson), runs as a background job in the worker that took the upload
+    BULK_IMPORT_HASH_WORKERS = int(os.getenv('BULK_IMPORT_HASH_WORKERS', str(os.cpu_count() or 2)))
+    BULK_IMPORT_BATCH_SIZE = int(os.getenv('BULK_IMPORT_BATCH_SIZE', '500'))
+    BULK_IMPORT_JOB_WORKERS = int(os.getenv('BULK_IMPORT_JOB_WORKERS', '1'))  # imports run at once per worker
+    # a queued or running job is marked alive this often, and reported as failed when it hasnt
+    # been for BULK_IMPORT_JOB_TIMEOUT (the worker running it was restarted or killed)
+    BULK_IMPORT_HEARTBEAT_INTERVAL = int(os.getenv('BULK_IMPORT_HEARTBEAT_INTERVAL', '30'))  # seconds
+    BULK_IMPORT_JOB_TIMEOUT = int(os.getenv('BULK_IMPORT_JOB_TIMEOUT', '300'))  # seconds
+
 
 class DevelopmentConfig(Config):
     DEBUG = True
@@ -1,69 +1,197 @@
-import boto3
 import uuid
 from datetime import datetime
 from botocore.exceptions import ClientError
 from config import Config
+from models.specialization import SpecializationModel
+from models.user import UserModel
+from utils import events
+from utils.cache import course_cache, project
+from utils.dynamodb import (
+    backoff,
+    batch_get_items,
+    batch_write_items,
+    get_dynamodb_resource,
+    iterate_items,
+    parallel_scan,
+    read_page,
+    with_projection,
+)
 
 
 class CourseModel:
     # handles all course stuff in dynamodb
+    CONFLICT = "Course was changed by another request, please try again"
+    UPDATE_ATTEMPTS = 5
 
     def __init__(self):
-        # setup dynamodb connection
-        if Config.AWS_ACCESS_KEY_ID and Config.AWS_SECRET_ACCESS_KEY:
-            client_kwargs = {
-                "region_name": Config.AWS_REGION,
-                "aws_access_key_id": Config.AWS_ACCESS_KEY_ID,
-                "aws_secret_access_key": Config.AWS_SECRET_ACCESS_KEY,
-            }
-            # add session token if we have it
-            if Config.AWS_SESSION_TOKEN:
-                client_kwargs["aws_session_token"] = Config.AWS_SESSION_TOKEN
-            self.dynamodb = boto3.resource("dynamodb", **client_kwargs)
+        # all models share one pooled dynamodb resource per process
+        self.dynamodb = get_dynamodb_resource()
+        self.table = self.dynamodb.Table(Config.DYNAMODB_COURSES_TABLE)
+        # instructorId -> courseId pairs so an instructors courses are one query
+        self.instructor_courses_table = self.dynamodb.Table(Config.DYNAMODB_INSTRUCTOR_COURSES_TABLE)
+        self.client = self.dynamodb.meta.client
+        # for the instructor and specialization names kept on each course
+        self.user_model = UserModel()
+        self.specialization_model = SpecializationModel()
+
+    @staticmethod
+    def get_instructor_ids(course):
+        # all instructors of a course, handles both instructorIds and the old single instructorId
+        instructor_ids = course.get("instructorIds", [])
+        if isinstance(instructor_ids, str):
+            instructor_ids = [instructor_ids]
+        instructor_ids = [i for i in instructor_ids if i]
+        if course.get("instructorId") and course["instructorId"] not in instructor_ids:
+            instructor_ids.append(course["instructorId"])
+        return instructor_ids
+
+    def add_summary_names(self, courses):
+        # sets instructorNames and specializationName on each course item from the users and
+        # specializations tables, one batch read each for all the courses
+        instructor_ids = {i for course in courses for i in self.get_instructor_ids(course)}
+        specialization_ids = {course["specializationId"] for course in courses if course.get("specializationId")}
+        users = self.user_model.get_many(instructor_ids, fields=["name"]) if instructor_ids else {}
+        specializations = (
+            self.specialization_model.get_many(specialization_ids, fields=["name"]) if specialization_ids else {}
+        )
+        for course in courses:
+            course["instructorNames"] = [
+                users[i]["name"] for i in self.get_instructor_ids(course) if users.get(i, {}).get("name")
+            ]
+            course["specializationName"] = specializations.get(course.get("specializationId"), {}).get("name")
+        return courses
+
+    def write_summary(self, course_id, summary):
+        # overwrites the summary attributes of a course, used by repair_course_summaries.py
+        # None values are removed. returns False if the course no longer exists
+        set_keys = [key for key, value in summary.items() if value is not None]
+        remove_keys = [key for key, value in summary.items() if value is None]
+        update_expression = "SET " + ", ".join(f"#{key} = :{key}" for key in set_keys)
+        if remove_keys:
+            update_expression += " REMOVE " + ", ".join(f"#{key}" for key in remove_keys)
+        try:
+            response = self.table.update_item(
+                Key={"courseId": course_id},
+                UpdateExpression=update_expression,
+                ConditionExpression="attribute_exists(courseId)",
+                ExpressionAttributeNames={f"#{key}": key for key in summary},
+                ExpressionAttributeValues={f":{key}": summary[key] for key in set_keys},
+                ReturnValues="ALL_NEW",
+            )
+        except ClientError as error:
+            if error.response["Error"]["Code"] == "ConditionalCheckFailedException":
+                return False
+            raise
+        events.publish(events.CourseChanged(events.UPDATED, {"courseId": course_id}, after=response.get("Attributes")))
+        return True
+
+    def refresh_summary_names(self, courses):
+        # rewrites instructorNames and specializationName where they no longer match the
+        # users and specializations tables, returns how many courses changed
+        rebuilt = self.add_summary_names([dict(course) for course in courses])
+        refreshed = 0
+        for course, summary_course in zip(courses, rebuilt):
+            names = {key: summary_course[key] for key in ("instructorNames", "specializationName")}
+            if any(course.get(key) != value for key, value in names.items()):
+                refreshed += self.write_summary(course["courseId"], names)
+        return refreshed
+
+    def _sync_instructor_courses(self, course_id, old_instructor_ids, new_instructor_ids):
+        # add/remove mapping items so they match the courses instructors
+        added = set(new_instructor_ids) - set(old_instructor_ids)
+        removed = set(old_instructor_ids) - set(new_instructor_ids)
+        if not added and not removed:
+            return
+        with self.instructor_courses_table.batch_writer() as batch:
+            for instructor_id in added:
+                batch.put_item(Item={"instructorId": instructor_id, "courseId": course_id})
+            for instructor_id in removed:
+                batch.delete_item(Key={"instructorId": instructor_id, "courseId": course_id})
+
+    @staticmethod
+    def build_course_item(
+        instructor_id, title, description, category=None, specialization_id=None, instructor_ids=None
+    ):
+        # builds a new course item with a fresh courseId
+        current_time = datetime.utcnow().isoformat()
+
+        course_data = {
+            "courseId": str(uuid.uuid4()),
+            "title": title,
+            "description": description,
+            "category": category or "General",
+            # denormalized summary, so the catalog list is a single read (see add_summary_names)
+            # the counters are kept up to date by ModuleModel and EnrollmentModel with atomic ADDs
+            "moduleCount": 0,
+            "enrollmentCount": 0,
+            "createdAt": current_time,
+            "updatedAt": current_time,
+        }
+
+        # support multiple instructors
+        if instructor_ids and isinstance(instructor_ids, list):
+            course_data["instructorIds"] = instructor_ids
+            # also set instructorId for backwards compatibility
+            if instructor_ids:
+                course_data["instructorId"] = instructor_ids[0]
         else:
-            self.dynamodb = boto3.resource("dynamodb", region_name=Config.AWS_REGION)
+            # single instructor
+            course_data["instructorId"] = instructor_id
+            course_data["instructorIds"] = [instructor_id] if instructor_id else []
 
-        self.table = self.dynamodb.Table(Config.DYNAMODB_COURSES_TABLE)
+        if specialization_id:
+            course_data["specializationId"] = specialization_id
+
+        return course_data
 
     def create_course(
         self, instructor_id, title, description, category=None, specialization_id=None, instructor_ids=None
     ):
         # create a new course
         try:
-            course_id = str(uuid.uuid4())
-            current_time = datetime.utcnow().isoformat()
-
-            course_data = {
-                "courseId": course_id,
-                "title": title,
-                "description": description,
-                "category": category or "General",
-                "createdAt": current_time,
-                "updatedAt": current_time,
-            }
-
-            # support multiple instructors
-            if instructor_ids and isinstance(instructor_ids, list):
-                course_data["instructorIds"] = instructor_ids
-                # also set instructorId for backwards compatibility
-                if instructor_ids:
-                    course_data["instructorId"] = instructor_ids[0]
-            else:
-                # single instructor
-                course_data["instructorId"] = instructor_id
-                course_data["instructorIds"] = [instructor_id] if instructor_id else []
-
-            if specialization_id:
-                course_data["specializationId"] = specialization_id
-
-            self.table.put_item(Item=course_data)
+            course_data = self.build_course_item(
+                instructor_id, title, description, category, specialization_id, instructor_ids
+            )
+            self.add_summary_names([course_data])
+            course_id = course_data["courseId"]
+
+            # write the course and its instructor mappings together
+            transact_items = [{"Put": {"TableName": Config.DYNAMODB_COURSES_TABLE, "Item": course_data}}]
+            for mapped_instructor_id in self.get_instructor_ids(course_data):
+                transact_items.append(
+                    {
+                        "Put": {
+                            "TableName": Config.DYNAMODB_INSTRUCTOR_COURSES_TABLE,
+                            "Item": {"instructorId": mapped_instructor_id, "courseId": course_id},
+                        }
+                    }
+                )
+            self.client.transact_write_items(TransactItems=transact_items)
+            events.publish(events.CourseChanged(events.CREATED, {"courseId": course_id}, after=course_data))
             return True, course_data
 
         except ClientError as error:
             return False, f"Error creating course: {str(error)}"
 
+    def put_courses_batch(self, course_items):
+        # bulk write of already built courses plus their instructor mappings with BatchWriteItem
+        self.add_summary_names(course_items)
+        batch_write_items(self.table, course_items)
+        mappings = [
+            {"instructorId": instructor_id, "courseId": course["courseId"]}
+            for course in course_items
+            for instructor_id in self.get_instructor_ids(course)
+        ]
+        batch_write_items(self.instructor_courses_table, mappings)
+        for course in course_items:
+            events.publish(events.CourseChanged(events.CREATED, {"courseId": course["courseId"]}, after=course))
+
     def get_course(self, course_id):
-        # get course by id
+        # get course by id, served from the catalog cache when possible
+        return course_cache.get_or_load(course_id, lambda: self._load_course(course_id))
+
+    def _load_course(self, course_id):
+        # reads the course straight from dynamodb, write paths use this so they never act on a stale copy
         try:
             response = self.table.get_item(Key={"courseId": course_id})
             return response.get("Item")
@@ -74,7 +202,7 @@ class CourseModel:
         # update course info, only if instructor owns it
         try:
             # check if course exists and instructor owns it
-            course = self.get_course(course_id)
+            course = self._load_course(course_id)
             if not course:
                 return False, "Course not found"
 
@@ -103,7 +231,7 @@ class CourseModel:
             expression_attribute_names["#updatedAt"] = "updatedAt"
             expression_attribute_values[":updatedAt"] = datetime.utcnow().isoformat()
 
-            self.table.update_item(
+            response = self.table.update_item(
                 Key={"courseId": course_id},
                 UpdateExpression=update_expression,
                 ExpressionAttributeNames=expression_attribute_names,
@@ -111,20 +239,35 @@ class CourseModel:
                 ReturnValues="ALL_NEW",
             )
 
-            updated_course = self.get_course(course_id)
+            updated_course = response.get("Attributes") or self._load_course(course_id)
+            self._sync_instructor_courses(
+                course_id, self.get_instructor_ids(course), self.get_instructor_ids(updated_course)
+            )
+            events.publish(
+                events.CourseChanged(events.UPDATED, {"courseId": course_id}, before=course, after=updated_course)
+            )
             return True, updated_course
 
         except ClientError as error:
             return False, f"Error updating course: {str(error)}"
 
-    def admin_update_course(self, course_id, **kwargs):
+    def admin_update_course(self, course_id, expected_course=None, **kwargs):
         # admin can update any course without checking ownership
+        # expected_course is a copy the caller just read: the update is then only made if the
+        # courses instructors are still the ones in it, otherwise it returns (False, CONFLICT)
         try:
             # check if course exists
-            course = self.get_course(course_id)
+            course = expected_course or self._load_course(course_id)
             if not course:
                 return False, "Course not found"
 
+            # instructor or specialization changes also change the names in the summary
+            if any(kwargs.get(key) is not None for key in ("instructorIds", "instructorId", "specializationId")):
+                updated = {**course, **{key: value for key, value in kwargs.items() if value is not None}}
+                self.add_summary_names([updated])
+                kwargs["instructorNames"] = updated["instructorNames"]
+                kwargs["specializationName"] = updated["specializationName"]
+
             # build update expression
             update_expression = "SET "
             expression_attribute_values = {}
@@ -141,25 +284,65 @@ class CourseModel:
             expression_attribute_names["#updatedAt"] = "updatedAt"
             expression_attribute_values[":updatedAt"] = datetime.utcnow().isoformat()
 
-            self.table.update_item(
+            condition = {}
+            if expected_course is not None:
+                expression_attribute_names["#instructorIds"] = "instructorIds"
+                if "instructorIds" in expected_course:
+                    condition["ConditionExpression"] = "#instructorIds = :expectedInstructorIds"
+                    expression_attribute_values[":expectedInstructorIds"] = expected_course["instructorIds"]
+                else:
+                    condition["ConditionExpression"] = "attribute_exists(courseId) AND attribute_not_exists(#instructorIds)"
+
+            response = self.table.update_item(
                 Key={"courseId": course_id},
                 UpdateExpression=update_expression,
                 ExpressionAttributeNames=expression_attribute_names,
                 ExpressionAttributeValues=expression_attribute_values,
                 ReturnValues="ALL_NEW",
+                **condition,
             )
 
-            updated_course = self.get_course(course_id)
+            updated_course = response.get("Attributes") or self._load_course(course_id)
+            self._sync_instructor_courses(
+                course_id, self.get_instructor_ids(course), self.get_instructor_ids(updated_course)
+            )
+            events.publish(
+                events.CourseChanged(events.UPDATED, {"courseId": course_id}, before=course, after=updated_course)
+            )
             return True, updated_course
 
         except ClientError as error:
+            if expected_course is not None and error.response["Error"]["Code"] == "ConditionalCheckFailedException":
+                return False, self.CONFLICT
             return False, f"Error updating course: {str(error)}"
 
+    def add_instructor(self, course_id, instructor_id):
+        # adds an instructor to a course. the course is read straight from dynamodb (not the cache,
+        # which can be behind other workers) and only written if its instructors havent changed
+        # since, so two admins assigning instructors at the same time dont drop each others change
+        for attempt in range(self.UPDATE_ATTEMPTS):
+            if attempt:
+                # another admin won the race, wait a random moment so the retries dont collide again
+                backoff(attempt, self.UPDATE_ATTEMPTS, "ConditionalCheckFailed", "UpdateItem")
+            course = self._load_course(course_id)
+            if not course:
+                return False, "Course not found"
+            instructor_ids = self.get_instructor_ids(course)
+            if instructor_id in instructor_ids:
+                return True, course
+            instructor_ids.append(instructor_id)
+            success, result = self.admin_update_course(
+                course_id, expected_course=course, instructorIds=instructor_ids, instructorId=instructor_ids[0]
+            )
+            if success or result != self.CONFLICT:
+                return success, result
+        return False, self.CONFLICT
+
     def delete_course(self, course_id, instructor_id):
         # delete course, only if instructor owns it
         try:
             # check if course exists and instructor owns it
-            course = self.get_course(course_id)
+            course = self._load_course(course_id)
             if not course:
                 return False, "Course not found"
 
@@ -174,6 +357,8 @@ class CourseModel:
                 return False, "Unauthorized to delete this course"
 
             self.table.delete_item(Key={"courseId": course_id})
+            self._sync_instructor_courses(course_id, self.get_instructor_ids(course), [])
+            events.publish(events.CourseChanged(events.DELETED, {"courseId": course_id}, before=course))
             return True, None
 
         except ClientError as error:
@@ -183,51 +368,138 @@ class CourseModel:
         # admin can delete any course
         try:
             # check if course exists
-            course = self.get_course(course_id)
+            course = self._load_course(course_id)
             if not course:
                 return False, "Course not found"
 
             self.table.delete_item(Key={"courseId": course_id})
+            self._sync_instructor_courses(course_id, self.get_instructor_ids(course), [])
+            events.publish(events.CourseChanged(events.DELETED, {"courseId": course_id}, before=course))
             return True, None
 
         except ClientError as error:
             return False, f"Error deleting course: {str(error)}"
 
-    def list_courses(self, instructor_id=None, category=None, specialization_id=None):
+    def list_courses(self, instructor_id=None, category=None, specialization_id=None, parallel=False, fields=None):
         # get all courses, can filter by instructor, category, or specialization
+        # parallel splits the scan into segments read at the same time (admin pages)
+        # fields limits the attributes read from dynamodb (ProjectionExpression)
         try:
+            fields = self._with_key(fields)
             if instructor_id:
-                # filter by instructor, need to check both instructorId and instructorIds
-                # dynamodb cant check array membership in filter, so scan all and filter in python
-                response = self.table.scan()
-                items = response.get("Items", [])
-                # filter courses where instructor matches
-                filtered_items = []
-                for item in items:
-                    # check single instructorId
-                    if item.get("instructorId") == instructor_id:
-                        filtered_items.append(item)
-                    # check instructorIds array
-                    elif "instructorIds" in item:
-                        instructor_ids = item.get("instructorIds", [])
-                        if isinstance(instructor_ids, str):
-                            instructor_ids = [instructor_ids]
-                        if instructor_id in instructor_ids:
-                            filtered_items.append(item)
-                return filtered_items
-            elif specialization_id:
-                response = self.table.scan(
-                    FilterExpression="#specializationId = :specializationId",
-                    ExpressionAttributeNames={"#specializationId": "specializationId"},
-                    ExpressionAttributeValues={":specializationId": specialization_id},
+                return self._list_courses_by_instructor(instructor_id, fields)
+
+            scan_kwargs = with_projection(self._scan_filter(category, specialization_id), fields)
+            if parallel:
+                return parallel_scan(self.table, **scan_kwargs)
+            return list(iterate_items(self.table.scan, **scan_kwargs))
+        except ClientError:
+            return []
+
+    def list_courses_page(
+        self, instructor_id=None, category=None, specialization_id=None, limit=50, start_key=None, fields=None
+    ):
+        # one page of courses for cursor pagination, same filters as list_courses
+        # returns (courses, last_key)
+        try:
+            fields = self._with_key(fields)
+            if instructor_id:
+                # page through the instructors mapping items, then read those courses by key
+                mappings, last_key = read_page(
+                    self.instructor_courses_table.query,
+                    limit,
+                    start_key,
+                    KeyConditionExpression="instructorId = :instructorId",
+                    ExpressionAttributeValues={":instructorId": instructor_id},
                 )
-            elif category:
-                response = self.table.scan(
-                    FilterExpression="category = :category", ExpressionAttributeValues={":category": category}
+                course_ids = [mapping["courseId"] for mapping in mappings]
+                courses = self.get_many(course_ids, fields=fields)
+                return [courses[course_id] for course_id in course_ids if course_id in courses], last_key
+
+            scan_kwargs = with_projection(self._scan_filter(category, specialization_id), fields)
+            return read_page(self.table.scan, limit, start_key, **scan_kwargs)
+        except ClientError:
+            return [], None
+
+    @staticmethod
+    def _with_key(fields):
+        # a projection always keeps courseId so clients can still tell the courses apart
+        if not fields or "courseId" in fields:
+            return fields
+        return ["courseId", *fields]
+
+    @staticmethod
+    def _scan_filter(category=None, specialization_id=None):
+        # scan kwargs for the specialization or category filter, specialization wins if both are set
+        if specialization_id:
+            return {
+                "FilterExpression": "#specializationId = :specializationId",
+                "ExpressionAttributeNames": {"#specializationId": "specializationId"},
+                "ExpressionAttributeValues": {":specializationId": specialization_id},
+            }
+        if category:
+            return {
+                "FilterExpression": "category = :category",
+                "ExpressionAttributeValues": {":category": category},
+            }
+        return {}
+
+    def _list_courses_by_instructor(self, instructor_id, fields=None):
+        # one query on the mapping table, then the courses themselves by key
+        try:
+            course_ids = [
+                item["courseId"]
+                for item in iterate_items(
+                    self.instructor_courses_table.query,
+                    KeyConditionExpression="instructorId = :instructorId",
+                    ExpressionAttributeValues={":instructorId": instructor_id},
                 )
-            else:
-                response = self.table.scan()
+            ]
+        except ClientError:
+            # mapping table not there yet, use the old scan and filter page by page
+            courses = [item for item in iterate_items(self.table.scan) if instructor_id in self.get_instructor_ids(item)]
+            return [project(course, fields) for course in courses]
 
-            return response.get("Items", [])
+        return list(self.get_many(course_ids, fields=fields).values())
+
+    def get_many(self, course_ids, fields=None):
+        # batch get courses by id, returns {courseId: course}; fields limits the attributes returned
+        # cached courses are used as they are, only the missing ones are read (in full, so they can be cached)
+        try:
+            if fields and "courseId" not in fields:
+                fields = ["courseId", *fields]
+            courses = course_cache.get_many_or_load(
+                [course_id for course_id in course_ids if course_id], self._load_many
+            )
+            return {course_id: project(course, fields) for course_id, course in courses.items()}
         except ClientError:
-            return []
+            return {}
+
+    def _load_many(self, course_ids):
+        # full course items for the ids that werent cached
+        keys = [{"courseId": course_id} for course_id in course_ids]
+        return {course["courseId"]: course for course in batch_get_items(self.table, keys)}
+
+
+# keeps the names in the course summaries in step with renamed (or deleted) instructors and
+# specializations. runs in the background, the rename itself doesnt wait for the courses
+
+
+def _on_instructor_changed(event):
+    if event.get("role") != "instructor" or not (event.action == events.DELETED or event.changed("name")):
+        return
+    course_model = CourseModel()
+    course_model.refresh_summary_names(course_model.list_courses(instructor_id=event.key["userId"]))
+
+
+def _on_specialization_changed(event):
+    if event.action == events.CREATED or not (event.action == events.DELETED or event.changed("name")):
+        return
+    course_model = CourseModel()
+    course_model.refresh_summary_names(
+        course_model.list_courses(specialization_id=event.key["specializationId"], parallel=True)
+    )
+
+
+events.subscribe(events.UserChanged, _on_instructor_changed, background=True)
+events.subscribe(events.SpecializationChanged, _on_specialization_changed, background=True)
@@ -1,26 +1,33 @@
-import boto3
 import uuid
 from datetime import datetime
 from botocore.exceptions import ClientError
 from config import Config
+from utils import events
+from utils.dynamodb import (
+    count_items,
+    counter_update,
+    ensure_counter,
+    first_item,
+    get_dynamodb_resource,
+    iterate_items,
+    read_page,
+    transact_with_retry,
+)
 
 
 class EnrollmentModel:
+    # gsis defined in setup/aws_setup.py
+    STUDENT_INDEX = "studentId-courseId-index"
+    COURSE_INDEX = "courseId-studentId-index"
+    TRANSACTION_ATTEMPTS = 3
 
     def __init__(self):
-        if Config.AWS_ACCESS_KEY_ID and Config.AWS_SECRET_ACCESS_KEY:
-            client_kwargs = {
-                "region_name": Config.AWS_REGION,
-                "aws_access_key_id": Config.AWS_ACCESS_KEY_ID,
-                "aws_secret_access_key": Config.AWS_SECRET_ACCESS_KEY,
-            }
-            if Config.AWS_SESSION_TOKEN:
-                client_kwargs["aws_session_token"] = Config.AWS_SESSION_TOKEN
-            self.dynamodb = boto3.resource("dynamodb", **client_kwargs)
-        else:
-            self.dynamodb = boto3.resource("dynamodb", region_name=Config.AWS_REGION)
-
+        # all models share one pooled dynamodb resource per process
+        self.dynamodb = get_dynamodb_resource()
         self.table = self.dynamodb.Table(Config.DYNAMODB_ENROLLMENTS_TABLE)
+        # the course item keeps an enrollmentCount counter that enrollment writes ADD to
+        self.courses_table = self.dynamodb.Table(Config.DYNAMODB_COURSES_TABLE)
+        self.client = self.dynamodb.meta.client
 
     def create_enrollment(self, student_id, course_id, status="active"):
         try:
@@ -39,12 +46,56 @@ class EnrollmentModel:
                 "enrolledAt": current_time,
             }
 
-            self.table.put_item(Item=enrollment_data)
+            if not self._ensure_enrollment_count(course_id):
+                return False, "Course not found"
+
+            # the enrollment and the courses enrollmentCount change together
+            self.client.transact_write_items(
+                TransactItems=[
+                    {"Put": {"TableName": Config.DYNAMODB_ENROLLMENTS_TABLE, "Item": enrollment_data}},
+                    {"Update": self._enrollment_count_update(course_id, 1)},
+                ]
+            )
+            events.publish(
+                events.EnrollmentChanged(
+                    events.CREATED, {"enrollmentId": enrollment_id, "studentId": student_id}, after=enrollment_data
+                )
+            )
             return True, enrollment_data
 
         except ClientError as e:
             return False, f"Error creating enrollment: {str(e)}"
 
+    def count_enrollments(self, course_id):
+        # number of students enrolled in a course, read from the index without returning them
+        try:
+            return count_items(
+                self.table.query,
+                IndexName=self.COURSE_INDEX,
+                KeyConditionExpression="courseId = :courseId",
+                ExpressionAttributeValues={":courseId": course_id},
+            )
+        except ClientError:
+            # index still building on an older table, count with the slow scan so enrolling
+            # keeps working in the meantime
+            return count_items(
+                self.table.scan,
+                FilterExpression="courseId = :courseId",
+                ExpressionAttributeValues={":courseId": course_id},
+            )
+
+    def _ensure_enrollment_count(self, course_id):
+        # courses from before the counter get enrollmentCount from a count of their enrollments
+        # returns False when the course doesnt exist
+        return ensure_counter(
+            self.courses_table, {"courseId": course_id}, "enrollmentCount", lambda: self.count_enrollments(course_id)
+        )
+
+    @staticmethod
+    def _enrollment_count_update(course_id, delta):
+        # atomic ADD to the courses enrollmentCount
+        return counter_update(Config.DYNAMODB_COURSES_TABLE, {"courseId": course_id}, "enrollmentCount", delta)
+
     def get_enrollment(self, enrollment_id, student_id):
         try:
             response = self.table.get_item(Key={"enrollmentId": enrollment_id, "studentId": student_id})
@@ -54,32 +105,84 @@ class EnrollmentModel:
 
     def get_enrollment_by_student_and_course(self, student_id, course_id):
         try:
-            response = self.table.scan(
-                FilterExpression="studentId = :studentId AND courseId = :courseId",
+            return first_item(
+                self.table.query,
+                IndexName=self.STUDENT_INDEX,
+                KeyConditionExpression="studentId = :studentId AND courseId = :courseId",
                 ExpressionAttributeValues={":studentId": student_id, ":courseId": course_id},
             )
-            items = response.get("Items", [])
-            return items[0] if items else None
         except ClientError:
-            return None
+            # index still building on an older table, fall back to the slow scan
+            try:
+                return first_item(
+                    self.table.scan,
+                    FilterExpression="studentId = :studentId AND courseId = :courseId",
+                    ExpressionAttributeValues={":studentId": student_id, ":courseId": course_id},
+                )
+            except ClientError:
+                return None
 
     def get_enrollments_by_student(self, student_id):
         try:
-            response = self.table.scan(
-                FilterExpression="studentId = :studentId", ExpressionAttributeValues={":studentId": student_id}
+            return list(
+                iterate_items(
+                    self.table.query,
+                    IndexName=self.STUDENT_INDEX,
+                    KeyConditionExpression="studentId = :studentId",
+                    ExpressionAttributeValues={":studentId": student_id},
+                )
             )
-            return response.get("Items", [])
         except ClientError:
-            return []
+            try:
+                return list(
+                    iterate_items(
+                        self.table.scan,
+                        FilterExpression="studentId = :studentId",
+                        ExpressionAttributeValues={":studentId": student_id},
+                    )
+                )
+            except ClientError:
+                return []
 
     def get_enrollments_by_course(self, course_id):
         try:
-            response = self.table.scan(
-                FilterExpression="courseId = :courseId", ExpressionAttributeValues={":courseId": course_id}
+            return list(
+                iterate_items(
+                    self.table.query,
+                    IndexName=self.COURSE_INDEX,
+                    KeyConditionExpression="courseId = :courseId",
+                    ExpressionAttributeValues={":courseId": course_id},
+                )
             )
-            return response.get("Items", [])
         except ClientError:
-            return []
+            try:
+                return list(
+                    iterate_items(
+                        self.table.scan,
+                        FilterExpression="courseId = :courseId",
+                        ExpressionAttributeValues={":courseId": course_id},
+                    )
+                )
+            except ClientError:
+                return []
+
+    def get_enrollments_page(self, limit=50, start_key=None, student_id=None, course_id=None):
+        # one page of a students (or a courses) enrollments from the gsi, returns (enrollments, last_key)
+        try:
+            if student_id:
+                index_name, key_condition, values = self.STUDENT_INDEX, "studentId = :id", {":id": student_id}
+            else:
+                index_name, key_condition, values = self.COURSE_INDEX, "courseId = :id", {":id": course_id}
+            return read_page(
+                self.table.query,
+                limit,
+                start_key,
+                IndexName=index_name,
+                KeyConditionExpression=key_condition,
+                ExpressionAttributeValues=values,
+            )
+        except ClientError:
+            return [], None
 
     def update_enrollment_status(self, enrollment_id, student_id, status):
         try:
@@ -92,6 +195,11 @@ class EnrollmentModel:
             )
 
             updated_enrollment = self.get_enrollment(enrollment_id, student_id)
+            events.publish(
+                events.EnrollmentChanged(
+                    events.UPDATED, {"enrollmentId": enrollment_id, "studentId": student_id}, after=updated_enrollment
+                )
+            )
             return True, updated_enrollment
 
         except ClientError as e:
@@ -99,7 +207,38 @@ class EnrollmentModel:
 
     def delete_enrollment(self, enrollment_id, student_id):
         try:
-            self.table.delete_item(Key={"enrollmentId": enrollment_id, "studentId": student_id})
+            key = {"enrollmentId": enrollment_id, "studentId": student_id}
+            enrollment = self.get_enrollment(enrollment_id, student_id)
+            if not enrollment:
+                return True, None
+
+            course_id = enrollment["courseId"]
+            if not self._ensure_enrollment_count(course_id):
+                # the course is gone, there is no counter to keep
+                self.table.delete_item(Key=key)
+                events.publish(events.EnrollmentChanged(events.DELETED, key, before=enrollment))
+                return True, None
+
+            if not self._delete_counted(key, course_id):
+                # deleted by another request in the meantime
+                return True, None
+            events.publish(events.EnrollmentChanged(events.DELETED, key, before=enrollment))
             return True, None
         except ClientError as e:
             return False, f"Error deleting enrollment: {str(e)}"
+
+    def _delete_counted(self, key, course_id):
+        # deletes the enrollment and takes it off enrollmentCount, only counted when the
+        # enrollment was really there. returns False when it wasnt, retries when another write
+        # to the course got in the way and raises anything else
+        transact_items = [
+            {
+                "Delete": {
+                    "TableName": Config.DYNAMODB_ENROLLMENTS_TABLE,
+                    "Key": key,
+                    "ConditionExpression": "attribute_exists(enrollmentId)",
+                }
+            },
+            {"Update": self._enrollment_count_update(course_id, -1)},
+        ]
+        return transact_with_retry(self.client, transact_items, self.TRANSACTION_ATTEMPTS)
@@ -0,0 +1,154 @@
+import json
+import uuid
+from datetime import datetime
+from botocore.exceptions import ClientError
+from config import Config
+from utils.dynamodb import get_dynamodb_resource, iterate_items
+
+
+class ImportJobModel:
+    # background bulk imports. each job is one "job" item with its status and counts, plus one
+    # "batch#000001" item per batch holding that batchs per row results as json, so a big
+    # import never runs into the 400KB item limit
+    JOB_PART = "job"
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STALE_ERROR = "Import stopped responding, the worker running it was probably restarted"
+
+    def __init__(self):
+        # all models share one pooled dynamodb resource per process
+        self.dynamodb = get_dynamodb_resource()
+        self.table = self.dynamodb.Table(Config.DYNAMODB_IMPORT_JOBS_TABLE)
+        self.client = self.dynamodb.meta.client
+
+    def create_job(self, kind, created_by, file_format):
+        try:
+            current_time = datetime.utcnow().isoformat()
+            job = {
+                "jobId": str(uuid.uuid4()),
+                "part": self.JOB_PART,
+                "kind": kind,
+                "status": self.QUEUED,
+                "format": file_format,
+                "createdBy": created_by,
+                "rows": 0,
+                "created": 0,
+                "failed": 0,
+                "createdAt": current_time,
+                "updatedAt": current_time,
+                "heartbeatAt": current_time,
+            }
+            self.table.put_item(Item=job)
+            return True, job
+        except ClientError as e:
+            return False, f"Error creating import job: {str(e)}"
+
+    def set_status(self, job_id, status, error=None):
+        # status changes are best effort, a job that cant be updated still runs
+        try:
+            update_expression = "SET #status = :status, updatedAt = :updatedAt, heartbeatAt = :updatedAt"
+            names = {"#status": "status"}
+            values = {":status": status, ":updatedAt": datetime.utcnow().isoformat()}
+            if error:
+                update_expression += ", #error = :error"
+                names["#error"] = "error"
+                values[":error"] = error
+            self.table.update_item(
+                Key={"jobId": job_id, "part": self.JOB_PART},
+                UpdateExpression=update_expression,
+                ExpressionAttributeNames=names,
+                ExpressionAttributeValues=values,
+            )
+            return True
+        except ClientError as e:
+            print(f"⚠ Could not update import job {job_id}: {str(e)}")
+            return False
+
+    def heartbeat(self, job_id):
+        # marks a queued or running job as still alive, a finished one is left alone
+        try:
+            self.table.update_item(
+                Key={"jobId": job_id, "part": self.JOB_PART},
+                UpdateExpression="SET heartbeatAt = :now",
+                ConditionExpression="#status IN (:queued, :running)",
+                ExpressionAttributeNames={"#status": "status"},
+                ExpressionAttributeValues={
+                    ":now": datetime.utcnow().isoformat(),
+                    ":queued": self.QUEUED,
+                    ":running": self.RUNNING,
+                },
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+
+    def save_batch(self, job_id, index, results):
+        # stores the results of one batch and adds them to the job counts in one transaction
+        created = sum(1 for result in results if result["status"] == "created")
+        self.client.transact_write_items(
+            TransactItems=[
+                {
+                    "Put": {
+                        "TableName": Config.DYNAMODB_IMPORT_JOBS_TABLE,
+                        "Item": {"jobId": job_id, "part": f"batch#{index:06d}", "results": json.dumps(results)},
+                    }
+                },
+                {
+                    "Update": {
+                        "TableName": Config.DYNAMODB_IMPORT_JOBS_TABLE,
+                        "Key": {"jobId": job_id, "part": self.JOB_PART},
+                        "UpdateExpression": (
+                            "SET updatedAt = :updatedAt, heartbeatAt = :updatedAt "
+                            "ADD #rows :rows, created :created, failed :failed"
+                        ),
+                        "ExpressionAttributeNames": {"#rows": "rows"},
+                        "ExpressionAttributeValues": {
+                            ":updatedAt": datetime.utcnow().isoformat(),
+                            ":rows": len(results),
+                            ":created": created,
+                            ":failed": len(results) - created,
+                        },
+                    }
+                },
+            ]
+        )
+
+    def get_job(self, job_id, include_results=True):
+        # the job with its counts, and the per row results of the batches done so far
+        try:
+            items = list(
+                iterate_items(
+                    self.table.query,
+                    KeyConditionExpression="jobId = :jobId",
+                    ExpressionAttributeValues={":jobId": job_id},
+                )
+            )
+        except ClientError:
+            return None
+
+        job = next((item for item in items if item["part"] == self.JOB_PART), None)
+        if not job:
+            return None
+        batches = sorted((item for item in items if item["part"] != self.JOB_PART), key=lambda item: item["part"])
+        job.pop("part")
+        for field in ("rows", "created", "failed"):
+            job[field] = int(job.get(field, 0))
+        if job["status"] in (self.QUEUED, self.RUNNING) and self._is_stale(job):
+            # no heartbeat for too long, the process that had the job is gone
+            job["status"] = self.FAILED
+            job["error"] = self.STALE_ERROR
+        if include_results:
+            job["results"] = [result for batch in batches for result in json.loads(batch["results"])]
+        return job
+
+    @staticmethod
+    def _is_stale(job):
+        # true when the job hasnt had a heartbeat for BULK_IMPORT_JOB_TIMEOUT seconds
+        # jobs from before heartbeats use their last update
+        last_beat = job.get("heartbeatAt") or job.get("updatedAt")
+        if not last_beat:
+            return False
+        idle = datetime.utcnow() - datetime.fromisoformat(last_beat)
+        return idle.total_seconds() > Config.BULK_IMPORT_JOB_TIMEOUT
@@ -1,48 +1,83 @@
-import boto3
 import uuid
+from collections import Counter
 from datetime import datetime
 from botocore.exceptions import ClientError
 from config import Config
+from utils.dynamodb import (
+    batch_write_items,
+    count_items,
+    counter_update,
+    ensure_counter,
+    get_dynamodb_resource,
+    iterate_items,
+    transact_with_retry,
+)
+from utils import events, metrics
+from utils.cache import module_cache
 
 
 class ModuleModel:
+    # gsi defined in setup/aws_setup.py, courseId hash + order range
+    COURSE_INDEX = "courseId-index"
+    TRANSACTION_ATTEMPTS = 3
+    _fallback_warned = False
 
     def __init__(self):
-        if Config.AWS_ACCESS_KEY_ID and Config.AWS_SECRET_ACCESS_KEY:
-            client_kwargs = {
-                "region_name": Config.AWS_REGION,
-                "aws_access_key_id": Config.AWS_ACCESS_KEY_ID,
-                "aws_secret_access_key": Config.AWS_SECRET_ACCESS_KEY,
-            }
-            if Config.AWS_SESSION_TOKEN:
-                client_kwargs["aws_session_token"] = Config.AWS_SESSION_TOKEN
-            self.dynamodb = boto3.resource("dynamodb", **client_kwargs)
-        else:
-            self.dynamodb = boto3.resource("dynamodb", region_name=Config.AWS_REGION)
-
+        # all models share one pooled dynamodb resource per process
+        self.dynamodb = get_dynamodb_resource()
         self.table = self.dynamodb.Table(Config.DYNAMODB_MODULES_TABLE)
+        # the course item keeps a moduleCount counter that module writes ADD to
+        self.courses_table = self.dynamodb.Table(Config.DYNAMODB_COURSES_TABLE)
+        self.client = self.dynamodb.meta.client
+
+    @staticmethod
+    def build_module_item(course_id, title, description, order, materials=None):
+        # builds a new module item with a fresh moduleId
+        return {
+            "moduleId": str(uuid.uuid4()),
+            "courseId": course_id,
+            "title": title,
+            "description": description,
+            "order": int(order),
+            "materials": materials or [],
+            "createdAt": datetime.utcnow().isoformat(),
+        }
+
+    @staticmethod
+    def _key(module):
+        return {"moduleId": module["moduleId"], "courseId": module["courseId"]}
 
     def create_module(self, course_id, title, description, order, materials=None):
         try:
-            module_id = str(uuid.uuid4())
-            current_time = datetime.utcnow().isoformat()
-
-            module_data = {
-                "moduleId": module_id,
-                "courseId": course_id,
-                "title": title,
-                "description": description,
-                "order": order,
-                "materials": materials or [],
-                "createdAt": current_time,
-            }
-
-            self.table.put_item(Item=module_data)
+            module_data = self.build_module_item(course_id, title, description, order, materials)
+
+            if not self._ensure_module_count(course_id):
+                return False, "Course not found"
+
+            # the module and the courses moduleCount change together
+            self.client.transact_write_items(
+                TransactItems=[
+                    {"Put": {"TableName": Config.DYNAMODB_MODULES_TABLE, "Item": module_data}},
+                    {"Update": self._module_count_update(course_id, 1)},
+                ]
+            )
+            events.publish(events.ModuleChanged(events.CREATED, self._key(module_data), after=module_data))
             return True, module_data
 
         except ClientError as e:
             return False, f"Error creating module: {str(e)}"
 
+    def put_modules_batch(self, module_items):
+        # bulk write of already built modules with BatchWriteItem, then one ADD per course
+        counts = Counter(module["courseId"] for module in module_items)
+        counted = {course_id for course_id in counts if self._ensure_module_count(course_id)}
+        batch_write_items(self.table, module_items)
+        for course_id, count in counts.items():
+            if course_id in counted:
+                self.client.update_item(**self._module_count_update(course_id, count))
+        for module in module_items:
+            events.publish(events.ModuleChanged(events.CREATED, self._key(module), after=module))
+
     def get_module(self, module_id, course_id):
         try:
             response = self.table.get_item(Key={"moduleId": module_id, "courseId": course_id})
@@ -51,28 +86,80 @@ class ModuleModel:
             return None
 
     def get_modules_by_course(self, course_id):
+        # modules of a course in order, served from the catalog cache when possible
+        # a failed read returns None, which is not cached
+        return module_cache.get_or_load(course_id, lambda: self._load_modules_by_course(course_id)) or []
+
+    def _load_modules_by_course(self, course_id):
         try:
-            response = self.table.query(
-                IndexName="courseId-index",
-                KeyConditionExpression="courseId = :courseId",
-                ExpressionAttributeValues={":courseId": course_id},
+            # the index sorts by order for us
+            return list(
+                iterate_items(
+                    self.table.query,
+                    IndexName=self.COURSE_INDEX,
+                    KeyConditionExpression="courseId = :courseId",
+                    ExpressionAttributeValues={":courseId": course_id},
+                )
             )
-            modules = response.get("Items", [])
-            modules.sort(key=lambda x: x.get("order", 0))
-            return modules
-        except ClientError:
+        except ClientError as e:
+            self._record_scan_fallback(e)
             try:
-                response = self.table.scan(
-                    FilterExpression="courseId = :courseId", ExpressionAttributeValues={":courseId": course_id}
+                modules = list(
+                    iterate_items(
+                        self.table.scan,
+                        FilterExpression="courseId = :courseId",
+                        ExpressionAttributeValues={":courseId": course_id},
+                    )
                 )
-                modules = response.get("Items", [])
                 modules.sort(key=lambda x: x.get("order", 0))
                 return modules
             except ClientError:
-                return []
+                return None
+
+    def count_modules(self, course_id):
+        # number of modules in a course, read from the index without returning them
+        try:
+            return count_items(
+                self.table.query,
+                IndexName=self.COURSE_INDEX,
+                KeyConditionExpression="courseId = :courseId",
+                ExpressionAttributeValues={":courseId": course_id},
+            )
+        except ClientError as e:
+            # same fallback as _load_modules_by_course, so module writes keep working while
+            # the index is still building
+            self._record_scan_fallback(e)
+            return count_items(
+                self.table.scan,
+                FilterExpression="courseId = :courseId",
+                ExpressionAttributeValues={":courseId": course_id},
+            )
+
+    def _ensure_module_count(self, course_id):
+        # courses from before the counter get moduleCount from a count of their modules
+        # returns False when the course doesnt exist
+        return ensure_counter(
+            self.courses_table, {"courseId": course_id}, "moduleCount", lambda: self.count_modules(course_id)
+        )
+
+    @staticmethod
+    def _module_count_update(course_id, delta):
+        # atomic ADD to the courses moduleCount
+        return counter_update(Config.DYNAMODB_COURSES_TABLE, {"courseId": course_id}, "moduleCount", delta)
+
+    def _record_scan_fallback(self, error):
+        # the index is missing or still building, count it and warn once per process
+        metrics.increment("modules.course_index_scan_fallback")
+        if not ModuleModel._fallback_warned:
+            ModuleModel._fallback_warned = True
+            print(f"⚠ '{self.COURSE_INDEX}' not usable on '{self.table.name}', scanning instead: {str(error)}")
 
     def update_module(self, module_id, course_id, **kwargs):
         try:
+            # order is the index sort key so it has to stay a number
+            if "order" in kwargs:
+                kwargs["order"] = int(kwargs["order"])
+
             update_expression = "SET "
             expression_attribute_values = {}
             expression_attribute_names = {}
@@ -84,7 +171,7 @@ class ModuleModel:
 
             update_expression = update_expression.rstrip(", ")
 
-            self.table.update_item(
+            response = self.table.update_item(
                 Key={"moduleId": module_id, "courseId": course_id},
                 UpdateExpression=update_expression,
                 ExpressionAttributeNames=expression_attribute_names,
@@ -92,7 +179,12 @@ class ModuleModel:
                 ReturnValues="ALL_NEW",
             )
 
-            updated_module = self.get_module(module_id, course_id)
+            updated_module = response.get("Attributes") or self.get_module(module_id, course_id)
+            events.publish(
+                events.ModuleChanged(
+                    events.UPDATED, {"moduleId": module_id, "courseId": course_id}, after=updated_module
+                )
+            )
             return True, updated_module
 
         except ClientError as e:
@@ -100,11 +192,33 @@ class ModuleModel:
 
     def delete_module(self, module_id, course_id):
         try:
-            self.table.delete_item(Key={"moduleId": module_id, "courseId": course_id})
+            if not self._ensure_module_count(course_id):
+                # the course is gone, there is no counter to keep
+                self.table.delete_item(Key={"moduleId": module_id, "courseId": course_id})
+            elif not self._delete_counted(module_id, course_id):
+                # nothing to delete
+                return True, None
+            events.publish(events.ModuleChanged(events.DELETED, {"moduleId": module_id, "courseId": course_id}))
             return True, None
         except ClientError as e:
             return False, f"Error deleting module: {str(e)}"
 
+    def _delete_counted(self, module_id, course_id):
+        # deletes the module and takes it off moduleCount, only counted when the module was
+        # really there. returns False when it wasnt, retries when another write to the course
+        # got in the way and raises anything else
+        transact_items = [
+            {
+                "Delete": {
+                    "TableName": Config.DYNAMODB_MODULES_TABLE,
+                    "Key": {"moduleId": module_id, "courseId": course_id},
+                    "ConditionExpression": "attribute_exists(moduleId)",
+                }
+            },
+            {"Update": self._module_count_update(course_id, -1)},
+        ]
+        return transact_with_retry(self.client, transact_items, self.TRANSACTION_ATTEMPTS)
+
     def add_material(self, module_id, course_id, material_url):
         try:
             module = self.get_module(module_id, course_id)
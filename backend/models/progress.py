@@ -1,103 +1,378 @@
-import boto3
-import uuid
+import threading
+import time
 from datetime import datetime
 from botocore.exceptions import ClientError
 from config import Config
+from utils import events
+from utils.dynamodb import get_dynamodb_resource, iterate_items, read_page, transact_with_retry
 
 
 class ProgressModel:
+    # progress items are keyed by studentId (hash) + "courseId#moduleId" (range), so one
+    # module is a single item and one course is a single prefix query
+    # each student also has one stats item per course under "stats#courseId" with the
+    # completedModules counter, the completedModuleIds string set and lastActivityAt, kept up
+    # to date by the progress writes
     ATTR_STUDENT_ID = ":studentId"
-    ATTR_MODULE_ID = ":moduleId"
-    ATTR_COURSE_ID = ":courseId"
+    ATTR_PREFIX = ":prefix"
+    ATTR_COMPLETED = ":completed"
+    STATS_RECORD = "stats"
+    # leaves the stats items out of the students progress list
+    NOT_STATS_FILTER = "attribute_not_exists(recordType)"
+    TRANSACTION_ATTEMPTS = 3
+    # the stats item tracks completedModuleIds. dynamodb cant store an empty set, so a stats item
+    # with no completions is tracked through completedModules = 0. items counted before the set
+    # existed have completedModules > 0 and no set, and are counted again by _ensure_stats
+    TRACKED_CONDITION = "attribute_exists(completedModuleIds) OR completedModules = :zero"
+    UNTRACKED_CONDITION = (
+        "attribute_not_exists(completedModules) OR "
+        "(completedModules <> :zero AND attribute_not_exists(completedModuleIds))"
+    )
+    # gsi defined in setup/aws_setup.py, every students progress in a course
+    COURSE_INDEX = "courseId-studentId-index"
+    # until aws_setup has copied the old progressId keyed table (marker item id below), reads also
+    # look at it, so students dont lose their old progress in the meantime. same precedence as
+    # the copy: the new row wins, unless only the old one is completed. the stats item only counts
+    # rows of the new table, the copy counts the old ones as it writes them
+    LEGACY_MIGRATION = "copy-legacy-progress"
+    LEGACY_CHECK_INTERVAL = 60  # seconds between looks at the marker while the copy runs
+    _legacy = {"done": False, "checked_at": None}
+    _legacy_lock = threading.Lock()
 
     def __init__(self):
-        if Config.AWS_ACCESS_KEY_ID and Config.AWS_SECRET_ACCESS_KEY:
-            client_kwargs = {
-                "region_name": Config.AWS_REGION,
-                "aws_access_key_id": Config.AWS_ACCESS_KEY_ID,
-                "aws_secret_access_key": Config.AWS_SECRET_ACCESS_KEY,
-            }
-            if Config.AWS_SESSION_TOKEN:
-                client_kwargs["aws_session_token"] = Config.AWS_SESSION_TOKEN
-            self.dynamodb = boto3.resource("dynamodb", **client_kwargs)
-        else:
-            self.dynamodb = boto3.resource("dynamodb", region_name=Config.AWS_REGION)
-
+        # all models share one pooled dynamodb resource per process
+        self.dynamodb = get_dynamodb_resource()
         self.table = self.dynamodb.Table(Config.DYNAMODB_PROGRESS_TABLE)
+        self.legacy_table = self.dynamodb.Table(Config.DYNAMODB_LEGACY_PROGRESS_TABLE)
+        self.migrations_table = self.dynamodb.Table(Config.DYNAMODB_MIGRATIONS_TABLE)
+        self.client = self.dynamodb.meta.client
 
-    def create_progress(self, student_id, module_id, course_id, status="in_progress"):
-        try:
-            existing = self.get_progress(student_id, module_id, course_id)
+    @staticmethod
+    def progress_key(course_id, module_id):
+        # sort key for a progress item
+        return f"{course_id}#{module_id}"
 
-            if existing:
-                progress_id = existing["progressId"]
-            else:
-                progress_id = str(uuid.uuid4())
+    @staticmethod
+    def stats_key(course_id):
+        # sort key for the stats item of a course
+        return f"stats#{course_id}"
 
+    def create_progress(self, student_id, module_id, course_id, status="in_progress"):
+        try:
+            progress_key = self.progress_key(course_id, module_id)
             current_time = datetime.utcnow().isoformat()
 
             progress_data = {
-                "progressId": progress_id,
                 "studentId": student_id,
+                "progressKey": progress_key,
+                "progressId": progress_key,
                 "moduleId": module_id,
                 "courseId": course_id,
                 "status": status,
                 "completedAt": current_time if status == "completed" else None,
+                "updatedAt": current_time,
             }
 
-            self.table.put_item(Item=progress_data)
+            stats_update = {
+                "TableName": Config.DYNAMODB_PROGRESS_TABLE,
+                "Key": {"studentId": student_id, "progressKey": self.stats_key(course_id)},
+                "UpdateExpression": "SET lastActivityAt = :now, courseId = :courseId, recordType = :recordType",
+                "ExpressionAttributeValues": {
+                    ":now": current_time,
+                    ":courseId": course_id,
+                    ":recordType": self.STATS_RECORD,
+                },
+            }
+            if status == "completed":
+                # counted with an atomic ADD, so /stats never has to recount the progress items
+                # the module id goes into the set too, so a deleted module can be left out later
+                self._ensure_stats(student_id, course_id)
+                stats_update["UpdateExpression"] += " ADD completedModules :one, completedModuleIds :moduleIds"
+                stats_update["ConditionExpression"] = self.TRACKED_CONDITION
+                stats_update["ExpressionAttributeValues"].update({":one": 1, ":zero": 0, ":moduleIds": {module_id}})
+
+            # single conditional upsert: a completed module is never overwritten, so marking it
+            # again keeps the original completedAt and in_progress can't undo a completion.
+            # the stats item is written in the same transaction, so a completion is counted once
+            transact_items = [
+                {
+                    "Put": {
+                        "TableName": Config.DYNAMODB_PROGRESS_TABLE,
+                        "Item": progress_data,
+                        "ConditionExpression": "attribute_not_exists(progressKey) OR #status <> :completed",
+                        "ExpressionAttributeNames": {"#status": "status"},
+                        "ExpressionAttributeValues": {self.ATTR_COMPLETED: "completed"},
+                    }
+                },
+                {"Update": stats_update},
+            ]
+            # two progress writes of one student and course touch the same stats item at once,
+            # so conflicts are retried
+            if not transact_with_retry(self.client, transact_items, self.TRANSACTION_ATTEMPTS):
+                # already completed, hand back what is stored
+                return True, self.get_progress(student_id, module_id, course_id)
+            # an upsert, so it is always reported as updated
+            events.publish(
+                events.ProgressChanged(
+                    events.UPDATED, {"studentId": student_id, "progressKey": progress_key}, after=progress_data
+                )
+            )
             return True, progress_data
 
         except ClientError as e:
             return False, f"Error creating progress: {str(e)}"
 
+    @staticmethod
+    def _is_tracked(item):
+        # same test as TRACKED_CONDITION, on an item that was read
+        return "completedModules" in item and ("completedModuleIds" in item or item["completedModules"] == 0)
+
+    def _ensure_stats(self, student_id, course_id):
+        # gives the stats item its completedModules counter and completedModuleIds set if it
+        # doesnt have them yet (first completion in the course, or progress written before they
+        # existed) from the completed progress items. completions only go through the transaction
+        # above, which needs the item to be tracked, so none can be written while this counts.
+        # returns the item
+        key = {"studentId": student_id, "progressKey": self.stats_key(course_id)}
+        item = self.table.get_item(Key=key, ConsistentRead=True).get("Item") or {}
+        if self._is_tracked(item):
+            return item
+
+        records = list(
+            iterate_items(
+                self.table.query,
+                KeyConditionExpression=f"studentId = {self.ATTR_STUDENT_ID} AND begins_with(progressKey, {self.ATTR_PREFIX})",
+                ExpressionAttributeValues={self.ATTR_STUDENT_ID: student_id, self.ATTR_PREFIX: f"{course_id}#"},
+                ConsistentRead=True,
+            )
+        )
+        completed_ids = {p["moduleId"] for p in records if p.get("status") == "completed" and p.get("moduleId")}
+        last_activity = max((p.get("updatedAt") or "" for p in records), default="") or None
+        update_expression = (
+            "SET completedModules = :completed, courseId = :courseId, recordType = :recordType, "
+            "lastActivityAt = if_not_exists(lastActivityAt, :lastActivity)"
+        )
+        values = {
+            ":completed": len(completed_ids),
+            ":courseId": course_id,
+            ":recordType": self.STATS_RECORD,
+            ":lastActivity": last_activity,
+            ":zero": 0,
+        }
+        if completed_ids:
+            # an empty set cant be stored, completedModules = 0 marks that case
+            update_expression += ", completedModuleIds = :completedIds"
+            values[":completedIds"] = completed_ids
+        try:
+            response = self.table.update_item(
+                Key=key,
+                UpdateExpression=update_expression,
+                ConditionExpression=self.UNTRACKED_CONDITION,
+                ExpressionAttributeValues=values,
+                ReturnValues="ALL_NEW",
+            )
+            return response["Attributes"]
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+            # another request counted first
+            return self.table.get_item(Key=key, ConsistentRead=True).get("Item") or {}
+
+    def _legacy_pending(self):
+        # true while the copy of the old table hasnt finished. done is remembered for good, not
+        # done is looked at again every LEGACY_CHECK_INTERVAL seconds
+        state = ProgressModel._legacy
+        if state["done"]:
+            return False
+        now = time.monotonic()
+        if state["checked_at"] is not None and now - state["checked_at"] < self.LEGACY_CHECK_INTERVAL:
+            return True
+        with ProgressModel._legacy_lock:
+            if state["checked_at"] is None or now - state["checked_at"] >= self.LEGACY_CHECK_INTERVAL:
+                try:
+                    marker = self.migrations_table.get_item(Key={"migrationId": self.LEGACY_MIGRATION}).get("Item")
+                    state["done"] = bool(marker and marker.get("done"))
+                except ClientError:
+                    # cant tell yet, the old table is still read and a missing one is noticed there
+                    pass
+                state["checked_at"] = now
+        return not state["done"]
+
+    def _legacy_rows(self, filter_expression, values, names=None):
+        # rows of the old table matching the filter, a slow scan (it has no usable index) that is
+        # only done while the copy runs. returns [] once the copy is done or the table is gone
+        if not self._legacy_pending():
+            return []
+        kwargs = {"ExpressionAttributeNames": names} if names else {}
+        try:
+            rows = iterate_items(
+                self.legacy_table.scan, FilterExpression=filter_expression, ExpressionAttributeValues=values, **kwargs
+            )
+            return [
+                {**row, "progressKey": self.progress_key(row["courseId"], row["moduleId"])}
+                for row in rows
+                if row.get("courseId") and row.get("moduleId")
+            ]
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "ResourceNotFoundException":
+                # no old table, nothing to copy
+                ProgressModel._legacy["done"] = True
+            return []
+
+    @staticmethod
+    def _prefer(current, legacy):
+        # the row to show for one module, same rule as copy_progress_item in aws_setup
+        if current is None or (legacy.get("status") == "completed" and current.get("status") != "completed"):
+            return legacy
+        return current
+
+    def _merge_legacy(self, records, legacy_rows, key=lambda record: record["progressKey"]):
+        # records with the old rows the new table doesnt have (yet) added in
+        if not legacy_rows:
+            return records
+        merged = {key(record): record for record in records}
+        for row in legacy_rows:
+            merged[key(row)] = self._prefer(merged.get(key(row)), row)
+        return [merged[record_key] for record_key in sorted(merged)]
+
     def get_progress(self, student_id, module_id, course_id):
         try:
-            response = self.table.scan(
-                FilterExpression=f"studentId = {self.ATTR_STUDENT_ID} AND moduleId = {self.ATTR_MODULE_ID} AND courseId = {self.ATTR_COURSE_ID}",
-                ExpressionAttributeValues={
-                    self.ATTR_STUDENT_ID: student_id,
-                    self.ATTR_MODULE_ID: module_id,
-                    self.ATTR_COURSE_ID: course_id
-                },
+            response = self.table.get_item(
+                Key={"studentId": student_id, "progressKey": self.progress_key(course_id, module_id)}
+            )
+            item = response.get("Item")
+            if item and item.get("status") == "completed":
+                return item
+            legacy_rows = self._legacy_rows(
+                "studentId = :studentId AND courseId = :courseId AND moduleId = :moduleId",
+                {":studentId": student_id, ":courseId": course_id, ":moduleId": module_id},
             )
-            items = response.get("Items", [])
-            return items[0] if items else None
+            for row in legacy_rows:
+                item = self._prefer(item, row)
+            return item
         except ClientError:
             return None
 
     def get_progress_by_student(self, student_id):
         try:
-            response = self.table.query(
-                KeyConditionExpression=f"studentId = {self.ATTR_STUDENT_ID}",
-                ExpressionAttributeValues={self.ATTR_STUDENT_ID: student_id}
+            records = list(
+                iterate_items(
+                    self.table.query,
+                    KeyConditionExpression=f"studentId = {self.ATTR_STUDENT_ID}",
+                    FilterExpression=self.NOT_STATS_FILTER,
+                    ExpressionAttributeValues={self.ATTR_STUDENT_ID: student_id},
+                )
+            )
+            return self._merge_legacy(
+                records, self._legacy_rows("studentId = :studentId", {":studentId": student_id})
             )
-            return response.get("Items", [])
         except ClientError:
             return []
 
     def get_progress_by_course(self, student_id, course_id):
         try:
-            response = self.table.scan(
-                FilterExpression=f"studentId = {self.ATTR_STUDENT_ID} AND courseId = {self.ATTR_COURSE_ID}",
-                ExpressionAttributeValues={
-                    self.ATTR_STUDENT_ID: student_id,
-                    self.ATTR_COURSE_ID: course_id
-                },
+            records = list(
+                iterate_items(
+                    self.table.query,
+                    KeyConditionExpression=f"studentId = {self.ATTR_STUDENT_ID} AND begins_with(progressKey, {self.ATTR_PREFIX})",
+                    ExpressionAttributeValues={
+                        self.ATTR_STUDENT_ID: student_id,
+                        self.ATTR_PREFIX: f"{course_id}#",
+                    },
+                )
+            )
+            return self._merge_legacy(
+                records,
+                self._legacy_rows(
+                    "studentId = :studentId AND courseId = :courseId",
+                    {":studentId": student_id, ":courseId": course_id},
+                ),
             )
-            return response.get("Items", [])
         except ClientError:
             return []
 
+    def get_course_progress(self, course_id):
+        # progress of every student in a course, only the attributes the analytics need
+        kwargs = {
+            "FilterExpression": self.NOT_STATS_FILTER,
+            "ProjectionExpression": "studentId, moduleId, #status",
+            "ExpressionAttributeNames": {"#status": "status"},
+            "ExpressionAttributeValues": {":courseId": course_id},
+        }
+        try:
+            records = list(
+                iterate_items(
+                    self.table.query, IndexName=self.COURSE_INDEX, KeyConditionExpression="courseId = :courseId", **kwargs
+                )
+            )
+        except ClientError:
+            # index still building on an older table, fall back to the slow scan
+            try:
+                kwargs["FilterExpression"] = f"courseId = :courseId AND {self.NOT_STATS_FILTER}"
+                records = list(iterate_items(self.table.scan, **kwargs))
+            except ClientError:
+                return []
+        legacy_rows = [
+            {"studentId": row["studentId"], "moduleId": row["moduleId"], "status": row.get("status")}
+            for row in self._legacy_rows("courseId = :courseId", {":courseId": course_id})
+        ]
+        return self._merge_legacy(records, legacy_rows, key=lambda record: (record["studentId"], record["moduleId"]))
+
+    def get_progress_page(self, student_id, limit=50, start_key=None, course_id=None):
+        # one page of a students progress, optionally for one course, returns (progress, last_key)
+        # while the old table is still being copied its rows cant be paged together with the new
+        # ones, so everything comes back as one last page
+        if self._legacy_pending():
+            if course_id:
+                return self.get_progress_by_course(student_id, course_id), None
+            return self.get_progress_by_student(student_id), None
+        try:
+            key_condition = f"studentId = {self.ATTR_STUDENT_ID}"
+            values = {self.ATTR_STUDENT_ID: student_id}
+            if course_id:
+                key_condition += f" AND begins_with(progressKey, {self.ATTR_PREFIX})"
+                values[self.ATTR_PREFIX] = f"{course_id}#"
+            return read_page(
+                self.table.query,
+                limit,
+                start_key,
+                KeyConditionExpression=key_condition,
+                FilterExpression=self.NOT_STATS_FILTER,
+                ExpressionAttributeValues=values,
+            )
+        except ClientError:
+            return [], None
+
     def mark_complete(self, student_id, module_id, course_id):
         return self.create_progress(student_id, module_id, course_id, status="completed")
 
-    def get_completion_stats(self, student_id, course_id):
+    def get_completion_stats(self, student_id, course_id, module_ids):
+        # one GetItem on the stats item, module_ids are the modules the course has now
+        # completions of modules that were deleted since are in the set but not counted
+        module_ids = set(module_ids)
+        total_modules = len(module_ids)
         try:
-            progress_records = self.get_progress_by_course(student_id, course_id)
-            completed = sum(1 for p in progress_records if p.get("status") == "completed")
-            total = len(progress_records)
+            response = self.table.get_item(Key={"studentId": student_id, "progressKey": self.stats_key(course_id)})
+            item = response.get("Item") or {}
+            if not self._is_tracked(item):
+                item = self._ensure_stats(student_id, course_id)
 
-            return {"completed": completed, "total": total, "percentage": (completed / total * 100) if total > 0 else 0}
+            completed_ids = set(item.get("completedModuleIds", ()))
+            # completions still only in the old table, the copy adds them to the stats item
+            completed_ids.update(
+                row["moduleId"]
+                for row in self._legacy_rows(
+                    "studentId = :studentId AND courseId = :courseId AND #status = :completed",
+                    {":studentId": student_id, ":courseId": course_id, ":completed": "completed"},
+                    {"#status": "status"},
+                )
+            )
+            completed = len(completed_ids & module_ids)
+            return {
+                "completed": completed,
+                "total": total_modules,
+                "percentage": (completed / total_modules * 100) if total_modules > 0 else 0,
+                "lastActivityAt": item.get("lastActivityAt"),
+            }
         except Exception:
-            return {"completed": 0, "total": 0, "percentage": 0}
+            return {"completed": 0, "total": total_modules, "percentage": 0, "lastActivityAt": None}
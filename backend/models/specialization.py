@@ -1,71 +1,115 @@
-import boto3
 import uuid
 from datetime import datetime
 from botocore.exceptions import ClientError
 from config import Config
+from utils import events
+from utils.cache import ALL_SPECIALIZATIONS, project, specialization_cache
+from utils.dynamodb import (
+    batch_get_items,
+    batch_write_items,
+    first_item,
+    get_dynamodb_resource,
+    iterate_items,
+    parallel_scan,
+)
 
 
 class SpecializationModel:
 
     def __init__(self):
-        if Config.AWS_ACCESS_KEY_ID and Config.AWS_SECRET_ACCESS_KEY:
-            client_kwargs = {
-                "region_name": Config.AWS_REGION,
-                "aws_access_key_id": Config.AWS_ACCESS_KEY_ID,
-                "aws_secret_access_key": Config.AWS_SECRET_ACCESS_KEY,
-            }
-            if Config.AWS_SESSION_TOKEN:
-                client_kwargs["aws_session_token"] = Config.AWS_SESSION_TOKEN
-            self.dynamodb = boto3.resource("dynamodb", **client_kwargs)
-        else:
-            self.dynamodb = boto3.resource("dynamodb", region_name=Config.AWS_REGION)
-
+        # all models share one pooled dynamodb resource per process
+        self.dynamodb = get_dynamodb_resource()
         self.table = self.dynamodb.Table(Config.DYNAMODB_SPECIALIZATIONS_TABLE)
 
+    @staticmethod
+    def build_specialization_item(name, code, description=None):
+        # builds a new specialization item with a fresh specializationId
+        return {
+            "specializationId": str(uuid.uuid4()),
+            "name": name,
+            "code": code,
+            "description": description or "",
+            "createdAt": datetime.utcnow().isoformat(),
+        }
+
+    @staticmethod
+    def _key(specialization_id):
+        return {"specializationId": specialization_id}
+
     def create_specialization(self, name, code, description=None):
         try:
             existing = self.get_specialization_by_code(code)
             if existing:
                 return False, "Specialization with this code already exists"
 
-            specialization_id = str(uuid.uuid4())
-            current_time = datetime.utcnow().isoformat()
-
-            specialization_data = {
-                "specializationId": specialization_id,
-                "name": name,
-                "code": code,
-                "description": description or "",
-                "createdAt": current_time,
-            }
+            specialization_data = self.build_specialization_item(name, code, description)
 
             self.table.put_item(Item=specialization_data)
+            events.publish(
+                events.SpecializationChanged(
+                    events.CREATED, self._key(specialization_data["specializationId"]), after=specialization_data
+                )
+            )
             return True, specialization_data
 
         except ClientError as e:
             return False, f"Error creating specialization: {str(e)}"
 
+    def put_specializations_batch(self, specialization_items):
+        # bulk write of already built specializations with BatchWriteItem
+        batch_write_items(self.table, specialization_items)
+        for spec in specialization_items:
+            events.publish(events.SpecializationChanged(events.CREATED, self._key(spec["specializationId"]), after=spec))
+
     def get_specialization(self, specialization_id):
+        # served from the catalog cache when possible
+        return specialization_cache.get_or_load(
+            specialization_id, lambda: self._load_specialization(specialization_id)
+        )
+
+    def _load_specialization(self, specialization_id):
         try:
             response = self.table.get_item(Key={"specializationId": specialization_id})
             return response.get("Item")
         except ClientError:
             return None
 
+    def get_many(self, specialization_ids, fields=None):
+        # batch get specializations by id, returns {specializationId: specialization}
+        # only the ones missing from the catalog cache are read
+        try:
+            if fields and "specializationId" not in fields:
+                fields = ["specializationId", *fields]
+            specializations = specialization_cache.get_many_or_load(
+                [spec_id for spec_id in specialization_ids if spec_id], self._load_many
+            )
+            return {spec_id: project(spec, fields) for spec_id, spec in specializations.items()}
+        except ClientError:
+            return {}
+
+    def _load_many(self, specialization_ids):
+        # full specialization items for the ids that werent cached
+        keys = [{"specializationId": spec_id} for spec_id in specialization_ids]
+        return {spec["specializationId"]: spec for spec in batch_get_items(self.table, keys)}
+
     def get_specialization_by_code(self, code):
         try:
-            response = self.table.scan(FilterExpression="code = :code", ExpressionAttributeValues={":code": code})
-            items = response.get("Items", [])
-            return items[0] if items else None
+            # stops reading pages as soon as the code is found
+            return first_item(self.table.scan, FilterExpression="code = :code", ExpressionAttributeValues={":code": code})
         except ClientError:
             return None
 
-    def list_specializations(self):
+    def list_specializations(self, parallel=False):
+        # the whole (small) table is cached as one entry
+        return specialization_cache.get_or_load(ALL_SPECIALIZATIONS, lambda: self._load_specializations(parallel)) or []
+
+    def _load_specializations(self, parallel=False):
         try:
-            response = self.table.scan()
-            return response.get("Items", [])
+            if parallel:
+                return parallel_scan(self.table)
+            return list(iterate_items(self.table.scan))
         except ClientError:
-            return []
+            return None
 
     def update_specialization(self, specialization_id, **kwargs):
         try:
@@ -88,11 +132,17 @@ class SpecializationModel:
 
             update_expression = "SET " + ", ".join(update_expression_parts)
 
-            self.table.update_item(
+            response = self.table.update_item(
                 Key={"specializationId": specialization_id},
                 UpdateExpression=update_expression,
                 ExpressionAttributeNames=expression_attribute_names,
                 ExpressionAttributeValues=expression_attribute_values,
+                ReturnValues="ALL_OLD",
+            )
+            before = response.get("Attributes")
+            after = {**(before or {}), **{key: value for key, value in kwargs.items() if value is not None}}
+            events.publish(
+                events.SpecializationChanged(events.UPDATED, self._key(specialization_id), before=before, after=after)
             )
             return True, None
 
@@ -101,7 +151,12 @@ class SpecializationModel:
 
     def delete_specialization(self, specialization_id):
         try:
-            self.table.delete_item(Key={"specializationId": specialization_id})
+            response = self.table.delete_item(Key={"specializationId": specialization_id}, ReturnValues="ALL_OLD")
+            events.publish(
+                events.SpecializationChanged(
+                    events.DELETED, self._key(specialization_id), before=response.get("Attributes")
+                )
+            )
             return True, None
         except ClientError as e:
             return False, f"Error deleting specialization: {str(e)}"
@@ -1,38 +1,78 @@
-import boto3
-import bcrypt
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from botocore.exceptions import ClientError
 from config import Config
+from utils import events, hashing, metrics
+from utils.dynamodb import (
+    batch_get_items,
+    cancellation_codes,
+    get_dynamodb_resource,
+    iterate_items,
+    parallel_scan,
+    read_page,
+    with_projection,
+)
 
 
 class UserModel:
     # handles all user stuff in dynamodb
+    EMAIL_TAKEN = "User with this email already exists"
+    # a write cancelled for any other reason (conflict, throttling), routes answer 503
+    RETRY = "User could not be saved right now, please try again"
 
     def __init__(self):
-        # setup dynamodb connection
-        if Config.AWS_ACCESS_KEY_ID and Config.AWS_SECRET_ACCESS_KEY:
-            client_kwargs = {
-                "region_name": Config.AWS_REGION,
-                "aws_access_key_id": Config.AWS_ACCESS_KEY_ID,
-                "aws_secret_access_key": Config.AWS_SECRET_ACCESS_KEY,
-            }
-            # add session token if we have it (needed for learner lab)
-            if Config.AWS_SESSION_TOKEN:
-                client_kwargs["aws_session_token"] = Config.AWS_SESSION_TOKEN
-            self.dynamodb = boto3.resource("dynamodb", **client_kwargs)
-        else:
-            self.dynamodb = boto3.resource("dynamodb", region_name=Config.AWS_REGION)
-
+        # all models share one pooled dynamodb resource per process
+        self.dynamodb = get_dynamodb_resource()
         self.table = self.dynamodb.Table(Config.DYNAMODB_USERS_TABLE)
+        # email -> userId lookup items, written in the same transaction as the user
+        self.email_table = self.dynamodb.Table(Config.DYNAMODB_USER_EMAILS_TABLE)
+        self.client = self.dynamodb.meta.client
 
     def hash_password(self, password):
-        # hash password with bcrypt
-        return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
+        # hash password with bcrypt, runs on the bounded hashing pool
+        # raises hashing.HashingBusyError when the pool is full
+        return hashing.hash_password(password)
 
     def verify_password(self, password, hashed):
-        # check if password matches the hash
-        return bcrypt.checkpw(password.encode("utf-8"), hashed.encode("utf-8"))
+        # check if password matches the hash, runs on the bounded hashing pool
+        return hashing.verify_password(password, hashed)
+
+    @staticmethod
+    def validate_new_user(role, specialization_id):
+        # returns an error message if a new user with this role cant be created, else None
+        if role == "student" and not specialization_id:
+            return "Specialization ID is required for students"
+        if role == "instructor" and not specialization_id:
+            return "Specialization ID is required for instructors"
+        # course_ids can be empty for instructors when creating them, we can add courses later
+        return None
+
+    @staticmethod
+    def build_user_item(email, hashed_password, role, name, specialization_id=None, course_ids=None):
+        # builds a new user item with a fresh userId, password must already be hashed
+        user_data = {
+            "userId": str(uuid.uuid4()),
+            "email": email,
+            "password": hashed_password,
+            "role": role,
+            "name": name,
+            "createdAt": datetime.utcnow().isoformat(),
+            "passwordChanged": False,  # track if they changed their password
+        }
+
+        # add specialization and courses for students/instructors
+        if role == "student" and specialization_id:
+            user_data["specializationId"] = specialization_id
+        elif role == "instructor" and specialization_id:
+            user_data["specializationId"] = specialization_id
+            # only add courseIds if provided
+            if course_ids:
+                user_data["courseIds"] = course_ids if isinstance(course_ids, list) else [course_ids]
+            else:
+                user_data["courseIds"] = []  # empty list, will add courses later
+
+        return user_data
 
     def create_user(self, email, password, role, name, specialization_id=None, course_ids=None):
         # creates a new user in the database
@@ -40,49 +80,87 @@ class UserModel:
             # check if user already exists
             existing_user = self.get_user_by_email(email)
             if existing_user:
-                return False, "User with this email already exists"
+                return False, self.EMAIL_TAKEN
 
             # validate role stuff
-            if role == "student" and not specialization_id:
-                return False, "Specialization ID is required for students"
-            if role == "instructor" and not specialization_id:
-                return False, "Specialization ID is required for instructors"
-            # course_ids can be empty for instructors when creating them, we can add courses later
+            error_msg = self.validate_new_user(role, specialization_id)
+            if error_msg:
+                return False, error_msg
 
             # create the user
-            user_id = str(uuid.uuid4())
-            hashed_password = self.hash_password(password)
-            current_time = datetime.utcnow().isoformat()
-
-            user_data = {
-                "userId": user_id,
-                "email": email,
-                "password": hashed_password,
-                "role": role,
-                "name": name,
-                "createdAt": current_time,
-                "passwordChanged": False,  # track if they changed their password
-            }
-
-            # add specialization and courses for students/instructors
-            if role == "student" and specialization_id:
-                user_data["specializationId"] = specialization_id
-            elif role == "instructor" and specialization_id:
-                user_data["specializationId"] = specialization_id
-                # only add courseIds if provided
-                if course_ids:
-                    user_data["courseIds"] = course_ids if isinstance(course_ids, list) else [course_ids]
-                else:
-                    user_data["courseIds"] = []  # empty list, will add courses later
-
-            self.table.put_item(Item=user_data)
+            user_data = self.build_user_item(
+                email, self.hash_password(password), role, name, specialization_id, course_ids
+            )
+            user_id = user_data["userId"]
+
+            self._put_new_user(user_data)
 
             # dont return password in response
             user_data.pop("password")
+            events.publish(events.UserChanged(events.CREATED, {"userId": user_id}, after=user_data))
             return True, user_data
 
         except ClientError as error:
-            return False, f"Error creating user: {str(error)}"
+            return False, self._write_error(error, "creating")
+
+    def _put_new_user(self, user_data):
+        # write the user and its email lookup item together, the condition on the
+        # lookup item stops two requests creating the same email at the same time
+        self.client.transact_write_items(
+            TransactItems=[
+                {
+                    "Put": {
+                        "TableName": Config.DYNAMODB_USERS_TABLE,
+                        "Item": user_data,
+                        "ConditionExpression": "attribute_not_exists(userId)",
+                    }
+                },
+                {
+                    "Put": {
+                        "TableName": Config.DYNAMODB_USER_EMAILS_TABLE,
+                        "Item": {"email": user_data["email"], "userId": user_data["userId"]},
+                        "ConditionExpression": "attribute_not_exists(email)",
+                    }
+                },
+            ]
+        )
+
+    def _write_error(self, error, action):
+        # message for a failed user write. the email lookup item is the second item of the
+        # transactions in _put_new_user and _update_user_and_email, only its condition means the
+        # email is taken. any other cancellation (conflict, throttling) is worth retrying
+        if error.response["Error"]["Code"] != "TransactionCanceledException":
+            return f"Error {action} user: {str(error)}"
+        codes = cancellation_codes(error)
+        if len(codes) > 1 and codes[1] == "ConditionalCheckFailed":
+            return self.EMAIL_TAKEN
+        return self.RETRY
+
+    def put_users_batch(self, user_items, max_workers=None):
+        # writes already built users, each in the same conditional transaction as create_user and
+        # a few at a time in parallel, so an email taken by another request or import since the
+        # caller checked it is refused instead of overwritten
+        # returns an error message per user in the same order, None for the ones created
+        def put_user(user):
+            try:
+                self._put_new_user(user)
+            except ClientError as error:
+                return self._write_error(error, "creating")
+            events.publish(events.UserChanged(events.CREATED, {"userId": user["userId"]}, after=self._public(user)))
+            return None
+
+        if len(user_items) <= 1:
+            return [put_user(user) for user in user_items]
+        max_workers = min(len(user_items), max_workers or Config.DYNAMODB_BATCH_WRITE_WORKERS)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(put_user, user_items))
+
+    @staticmethod
+    def _public(user):
+        # copy of a user item without the password hash, for events
+        if user is None:
+            return None
+        return {key: value for key, value in user.items() if key != "password"}
 
     def get_user_by_id(self, user_id):
         # get user by their id
@@ -92,15 +170,45 @@ class UserModel:
         except ClientError:
             return None
 
-    def get_user_by_email(self, email):
-        # get user by email, uses scan so might be slow if we have lots of users
+    def get_many(self, user_ids, fields=None):
+        # batch get users by id, returns {userId: user} without passwords
+        try:
+            if fields and "userId" not in fields:
+                fields = ["userId", *fields]
+            keys = [{"userId": user_id} for user_id in user_ids if user_id]
+            users = {}
+            for user in batch_get_items(self.table, keys, fields=fields):
+                user.pop("password", None)
+                users[user["userId"]] = user
+            return users
+        except ClientError:
+            return {}
+
+    def get_user_id_by_email(self, email):
+        # look up the userId for an email using the lookup table (single key read)
         try:
-            response = self.table.scan(FilterExpression="email = :email", ExpressionAttributeValues={":email": email})
-            items = response.get("Items", [])
-            return items[0] if items else None
+            response = self.email_table.get_item(Key={"email": email}, ConsistentRead=True)
+            item = response.get("Item")
+            return item["userId"] if item else None
         except ClientError:
             return None
 
+    def get_existing_emails(self, emails):
+        # which of these emails already belong to a user, one batch read on the lookup table
+        keys = [{"email": email} for email in emails]
+        return {item["email"] for item in batch_get_items(self.email_table, keys, fields=["email"])}
+
+    def get_user_by_email(self, email):
+        # get user by email, two key reads instead of scanning the users table
+        user_id = self.get_user_id_by_email(email)
+        if not user_id:
+            return None
+        user = self.get_user_by_id(user_id)
+        # ignore a stale lookup item left behind by an interrupted email change
+        if user and user.get("email") != email:
+            return None
+        return user
+
     def authenticate_user(self, email, password):
         # check if email and password are correct
         user = self.get_user_by_email(email)
@@ -110,13 +218,45 @@ class UserModel:
         if not self.verify_password(password, user["password"]):
             return False, "Invalid email or password"
 
+        # bring hashes made with an older bcrypt cost up to the current one
+        if hashing.needs_rehash(user["password"]):
+            self._rehash_password(user["userId"], user["password"], password)
+
         # remove password from response
         user.pop("password")
         return True, user
 
+    def _rehash_password(self, user_id, old_hash, password):
+        # store a new hash for a password that just verified, login still works if this fails
+        try:
+            self.table.update_item(
+                Key={"userId": user_id},
+                UpdateExpression="SET #password = :password",
+                # dont overwrite a password that was changed in the meantime
+                ConditionExpression="#password = :oldPassword",
+                ExpressionAttributeNames={"#password": "password"},
+                ExpressionAttributeValues={":password": self.hash_password(password), ":oldPassword": old_hash},
+            )
+            metrics.increment("bcrypt.rehash")
+            events.publish(events.UserChanged(events.UPDATED, {"userId": user_id}))
+        except (ClientError, hashing.HashingBusyError):
+            pass
+
     def update_user(self, user_id, **kwargs):
         # update user info, can update name, email, courseIds, etc
         try:
+            # changing email also has to move the lookup item, so check the current one first
+            old_email = None
+            current_user = None
+            if "email" in kwargs:
+                current_user = self.get_user_by_id(user_id)
+                if not current_user:
+                    return False, "User not found"
+                if current_user.get("email") != kwargs["email"]:
+                    old_email = current_user.get("email")
+                    if self.get_user_id_by_email(kwargs["email"]):
+                        return False, self.EMAIL_TAKEN
+
             # build the update expression for dynamodb
             update_expression = "SET "
             expression_attribute_values = {}
@@ -134,68 +274,140 @@ class UserModel:
             expression_attribute_names["#updatedAt"] = "updatedAt"
             expression_attribute_values[":updatedAt"] = datetime.utcnow().isoformat()
 
-            self.table.update_item(
-                Key={"userId": user_id},
-                UpdateExpression=update_expression,
-                ExpressionAttributeNames=expression_attribute_names,
-                ExpressionAttributeValues=expression_attribute_values,
-                ReturnValues="ALL_NEW",
-            )
+            if old_email is not None:
+                self._update_user_and_email(
+                    user_id,
+                    old_email,
+                    kwargs["email"],
+                    update_expression,
+                    expression_attribute_names,
+                    expression_attribute_values,
+                )
+            else:
+                response = self.table.update_item(
+                    Key={"userId": user_id},
+                    UpdateExpression=update_expression,
+                    ExpressionAttributeNames=expression_attribute_names,
+                    ExpressionAttributeValues=expression_attribute_values,
+                    ReturnValues="ALL_OLD",
+                )
+                current_user = response.get("Attributes")
 
             # get the updated user
             updated_user = self.get_user_by_id(user_id)
             if updated_user and "password" in updated_user:
                 updated_user.pop("password")
 
+            events.publish(
+                events.UserChanged(
+                    events.UPDATED, {"userId": user_id}, before=self._public(current_user), after=updated_user
+                )
+            )
             return True, updated_user
 
         except ClientError as error:
-            return False, f"Error updating user: {str(error)}"
+            return False, self._write_error(error, "updating")
+
+    def _update_user_and_email(self, user_id, old_email, new_email, update_expression, names, values):
+        # applies a user update and moves the email lookup item in one transaction
+        transact_items = [
+            {
+                "Update": {
+                    "TableName": Config.DYNAMODB_USERS_TABLE,
+                    "Key": {"userId": user_id},
+                    "UpdateExpression": update_expression,
+                    "ExpressionAttributeNames": names,
+                    "ExpressionAttributeValues": values,
+                }
+            },
+            {
+                "Put": {
+                    "TableName": Config.DYNAMODB_USER_EMAILS_TABLE,
+                    "Item": {"email": new_email, "userId": user_id},
+                    "ConditionExpression": "attribute_not_exists(email)",
+                }
+            },
+        ]
+        if old_email:
+            transact_items.append(
+                {
+                    "Delete": {
+                        "TableName": Config.DYNAMODB_USER_EMAILS_TABLE,
+                        "Key": {"email": old_email},
+                    }
+                }
+            )
+        self.client.transact_write_items(TransactItems=transact_items)
 
     def delete_user(self, user_id):
-        # delete a user
+        # delete a user and free up their email
         try:
+            user = self.get_user_by_id(user_id)
             self.table.delete_item(Key={"userId": user_id})
+            if user and user.get("email"):
+                try:
+                    self.email_table.delete_item(
+                        Key={"email": user["email"]},
+                        ConditionExpression="userId = :userId",
+                        ExpressionAttributeValues={":userId": user_id},
+                    )
+                except ClientError as error:
+                    # lookup item already points at someone else, leave it alone
+                    if error.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                        raise
+            events.publish(events.UserChanged(events.DELETED, {"userId": user_id}, before=self._public(user)))
             return True, None
         except ClientError as error:
             return False, f"Error deleting user: {str(error)}"
 
-    def list_users(self, role=None):
+    def list_users(self, role=None, parallel=False, fields=None):
         # get all users, can filter by role if needed
+        # parallel splits the scan into segments read at the same time (admin pages)
+        # fields limits the attributes read from dynamodb (ProjectionExpression)
         try:
-            if role:
-                # filter by role
-                response = self.table.scan(
-                    FilterExpression="#r = :role",
-                    ExpressionAttributeNames={"#r": "role"},
-                    ExpressionAttributeValues={":role": role},
-                )
-            else:
-                response = self.table.scan()
-
-            users = response.get("Items", [])
-
-            # handle pagination if we have lots of users
-            while "LastEvaluatedKey" in response:
-                if role:
-                    response = self.table.scan(
-                        FilterExpression="#r = :role",
-                        ExpressionAttributeNames={"#r": "role"},
-                        ExpressionAttributeValues={":role": role},
-                        ExclusiveStartKey=response["LastEvaluatedKey"],
-                    )
-                else:
-                    response = self.table.scan(ExclusiveStartKey=response["LastEvaluatedKey"])
-                users.extend(response.get("Items", []))
+            scan_kwargs = with_projection(self._role_filter(role), self._public_fields(fields))
 
-            # remove passwords from response
-            for user in users:
+            # follows LastEvaluatedKey so nothing past the first 1MB page is lost
+            items = parallel_scan(self.table, **scan_kwargs) if parallel else iterate_items(self.table.scan, **scan_kwargs)
+            users = []
+            for user in items:
+                # remove passwords from response
                 user.pop("password", None)
+                users.append(user)
 
             return users
         except ClientError:
             return []
 
+    def list_users_page(self, role=None, limit=50, start_key=None, fields=None):
+        # one page of users for cursor pagination, returns (users, last_key)
+        try:
+            scan_kwargs = with_projection(self._role_filter(role), self._public_fields(fields))
+            users, last_key = read_page(self.table.scan, limit, start_key, **scan_kwargs)
+            for user in users:
+                user.pop("password", None)
+            return users, last_key
+        except ClientError:
+            return [], None
+
+    @staticmethod
+    def _public_fields(fields):
+        # requested attributes plus the key, the password hash is never read for a listing
+        if not fields:
+            return None
+        return ["userId", *[field for field in fields if field not in ("userId", "password")]]
+
+    @staticmethod
+    def _role_filter(role):
+        # scan kwargs that keep only users with this role (none when role is empty)
+        if not role:
+            return {}
+        return {
+            "FilterExpression": "#r = :role",
+            "ExpressionAttributeNames": {"#r": "role"},
+            "ExpressionAttributeValues": {":role": role},
+        }
+
     def change_password(self, user_id, old_password, new_password):
         # user changes their own password
         try:
@@ -223,6 +435,7 @@ class UserModel:
                     ":updatedAt": datetime.utcnow().isoformat(),
                 },
             )
+            events.publish(events.UserChanged(events.UPDATED, {"userId": user_id}))
 
             return True, None
 
@@ -244,6 +457,7 @@ class UserModel:
                 ExpressionAttributeNames={"#password": "password", "#updatedAt": "updatedAt"},
                 ExpressionAttributeValues={":password": hashed_password, ":updatedAt": datetime.utcnow().isoformat()},
             )
+            events.publish(events.UserChanged(events.UPDATED, {"userId": user_id}))
 
             return True, None
 
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+# rebuilds the denormalized summary on course items (moduleCount, enrollmentCount,
+# instructorNames, specializationName) from the modules, enrollments, users and
+# specializations tables. the write paths and the event subscribers keep it up to date,
+# run this if the counters ever drift or a background refresh was lost to a restart
+# python repair_course_summaries.py [courseId ...]
+#
+# the counts are read and then written, so an enrollment made while a course is being
+# repaired can be lost from its count; run it when the site is quiet
+
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from config import Config
+from models.course import CourseModel
+from models.enrollment import EnrollmentModel
+from models.module import ModuleModel
+
+SUMMARY_FIELDS = ["moduleCount", "enrollmentCount", "instructorNames", "specializationName"]
+
+
+def repair_course_summaries(course_ids=None):
+    # returns (courses checked, courses whose summary was rewritten)
+    course_model = CourseModel()
+    module_model = ModuleModel()
+    enrollment_model = EnrollmentModel()
+
+    if course_ids:
+        courses = list(course_model.get_many(course_ids).values())
+    else:
+        courses = course_model.list_courses(parallel=True)
+
+    # work on copies so the summary currently stored can be compared with the rebuilt one
+    rebuilt = course_model.add_summary_names([dict(course) for course in courses])
+
+    def repair(course, summary_course):
+        course_id = course["courseId"]
+        summary = {
+            "moduleCount": module_model.count_modules(course_id),
+            "enrollmentCount": enrollment_model.count_enrollments(course_id),
+            "instructorNames": summary_course["instructorNames"],
+            "specializationName": summary_course["specializationName"],
+        }
+        if all(course.get(field) == summary[field] for field in SUMMARY_FIELDS):
+            return False
+        return course_model.write_summary(course_id, summary)
+
+    with ThreadPoolExecutor(max_workers=Config.DYNAMODB_SCAN_SEGMENTS) as executor:
+        results = list(executor.map(repair, courses, rebuilt))
+    return len(courses), sum(results)
+
+
+if __name__ == '__main__':
+    checked, repaired = repair_course_summaries(sys.argv[1:])
+    print(f"Checked {checked} courses, rebuilt the summary of {repaired}")
@@ -2,17 +2,28 @@
 Admin routes for managing users, specializations, and courses
 """
 
+import shutil
+import tempfile
+from functools import partial
 from flask import Blueprint, request, jsonify
+from models.import_job import ImportJobModel
 from models.user import UserModel
 from models.specialization import SpecializationModel
 from models.course import CourseModel
 from utils.auth import admin_required
-from utils.validators import validate_email, validate_password, validate_required_fields
+from utils.bulk_import import create_hash_pool, detect_format, hash_passwords, read_batches, read_rows, submit_job
+from utils.hashing import BUSY_MESSAGE, HashingBusyError
+from utils.pagination import PaginationError, cursor_scope, decode_cursor, encode_cursor, get_page_args
+from utils.cache import project
+from utils.concurrency import gather
+from utils.validators import parse_fields, sanitize_string, validate_email, validate_password, validate_required_fields
+from config import Config
 
 admin_bp = Blueprint("admin", __name__)
 user_model = UserModel()
 specialization_model = SpecializationModel()
 course_model = CourseModel()
+import_job_model = ImportJobModel()
 
 
 @admin_bp.route("/students", methods=["POST"])
@@ -54,13 +65,189 @@ def add_student():
 
         if success:
             return jsonify({"message": "Student created successfully", "user": result}), 201
+        elif result == UserModel.RETRY:
+            return jsonify({"error": result}), 503, {"Retry-After": "1"}
         else:
             return jsonify({"error": result}), 400
 
+    except HashingBusyError:
+        return jsonify({"error": BUSY_MESSAGE}), 503, {"Retry-After": "1"}
     except Exception as e:
         return jsonify({"error": f"Server error: {str(e)}"}), 500
 
 
+@admin_bp.route("/students/bulk", methods=["POST"])
+@admin_required
+def bulk_add_students():
+    """Start a background import of students from a CSV or NDJSON upload (admin only)
+
+    Columns/keys: email, password, name, specializationId. The body can be the raw file
+    (Content-Type text/csv or application/x-ndjson) or a multipart form with a "file" field.
+    Returns 202 with a jobId; GET /students/bulk/<jobId> has the progress and a result per row.
+    """
+    try:
+        upload = request.files.get("file")
+        if upload:
+            stream = upload.stream
+            file_format = detect_format(upload.mimetype, upload.filename)
+        else:
+            stream = request.stream
+            file_format = detect_format(request.mimetype)
+
+        if not file_format:
+            return jsonify({"error": "Upload must be CSV (text/csv) or NDJSON (application/x-ndjson)"}), 415
+
+        # the request stream is gone once the response is sent, so the job reads a temp copy
+        upload_file = tempfile.TemporaryFile()
+        try:
+            shutil.copyfileobj(stream, upload_file)
+            upload_file.seek(0)
+            success, job = import_job_model.create_job("students", request.current_user["user_id"], file_format)
+            if not success:
+                upload_file.close()
+                return jsonify({"error": job}), 500
+            submit_job(
+                _run_student_import,
+                job["jobId"],
+                upload_file,
+                file_format,
+                heartbeat=partial(import_job_model.heartbeat, job["jobId"]),
+            )
+        except Exception:
+            upload_file.close()
+            raise
+
+        return (
+            jsonify(
+                {
+                    "message": "Import started",
+                    "jobId": job["jobId"],
+                    "status": job["status"],
+                    "statusUrl": f"/api/admin/students/bulk/{job['jobId']}",
+                }
+            ),
+            202,
+        )
+
+    except Exception as e:
+        return jsonify({"error": f"Server error: {str(e)}"}), 500
+
+
+@admin_bp.route("/students/bulk/<job_id>", methods=["GET"])
+@admin_required
+def get_bulk_import(job_id):
+    """Status, counts and per row results of a bulk import (admin only)"""
+    try:
+        job = import_job_model.get_job(job_id)
+        if not job:
+            return jsonify({"error": "Import job not found"}), 404
+        return jsonify({"job": job}), 200
+
+    except Exception as e:
+        return jsonify({"error": f"Server error: {str(e)}"}), 500
+
+
+def _run_student_import(job_id, upload_file, file_format):
+    # runs on the import thread: reads the upload in batches and saves each batchs results on
+    # the job as it goes, so the status endpoint shows progress before the import is finished
+    try:
+        import_job_model.set_status(job_id, ImportJobModel.RUNNING)
+        seen_emails = set()
+        specialization_cache = {}
+        with upload_file, create_hash_pool() as hash_pool:
+            batches = read_batches(read_rows(upload_file, file_format), Config.BULK_IMPORT_BATCH_SIZE)
+            for index, batch in enumerate(batches, start=1):
+                results = _import_student_batch(batch, seen_emails, specialization_cache, hash_pool)
+                import_job_model.save_batch(job_id, index, results)
+        import_job_model.set_status(job_id, ImportJobModel.DONE)
+    except Exception as e:
+        print(f"⚠ Bulk import {job_id} failed: {str(e)}")
+        import_job_model.set_status(job_id, ImportJobModel.FAILED, error=f"Import failed: {str(e)}")
+
+
+def _import_student_batch(batch, seen_emails, specialization_cache, hash_pool):
+    # validates one batch of rows, hashes the valid passwords together and writes the students,
+    # one conditional transaction per user (put_users_batch) so a taken email is refused per row.
+    # returns a result dict for every row in the batch
+    results = []
+    valid_rows = []
+    required_fields = ["email", "password", "name", "specializationId"]
+
+    for row_number, row in batch:
+        if row is None:
+            results.append({"row": row_number, "status": "error", "error": "Row could not be parsed"})
+            continue
+
+        password = row.get("password")
+        row = {field: sanitize_string(row.get(field)) for field in required_fields}
+        # passwords are taken as typed, only checked for being non empty
+        row["password"] = password if isinstance(password, str) and password else None
+        email = row["email"]
+
+        is_valid, missing = validate_required_fields(row, required_fields)
+        if not is_valid:
+            error = f'Missing required fields: {", ".join(missing)}'
+        elif not validate_email(email):
+            error = "Invalid email format"
+        else:
+            error = validate_password(row["password"])[1]
+        if not error and email in seen_emails:
+            error = "Duplicate email in upload"
+
+        if error:
+            results.append({"row": row_number, "email": email, "status": "error", "error": error})
+            continue
+
+        seen_emails.add(email)
+        valid_rows.append((row_number, row))
+
+    # one batch read each for emails already taken and specializations we havent seen yet
+    # (the email check only saves hashing passwords for rows that would fail anyway, the
+    # conditional writes in put_users_batch are what keep emails unique)
+    taken_emails = user_model.get_existing_emails([row["email"] for _, row in valid_rows])
+    unknown_specs = {row["specializationId"] for _, row in valid_rows} - set(specialization_cache)
+    if unknown_specs:
+        found = specialization_model.get_many(unknown_specs, fields=["specializationId"])
+        for spec_id in unknown_specs:
+            specialization_cache[spec_id] = spec_id in found
+
+    to_create = []
+    for row_number, row in valid_rows:
+        if row["email"] in taken_emails:
+            error = "User with this email already exists"
+        elif not specialization_cache.get(row["specializationId"]):
+            error = "Specialization not found"
+        else:
+            to_create.append((row_number, row))
+            continue
+        results.append({"row": row_number, "email": row["email"], "status": "error", "error": error})
+
+    if not to_create:
+        return sorted(results, key=lambda result: result["row"])
+
+    hashes = hash_passwords(hash_pool, [row["password"] for _, row in to_create])
+    user_items = [
+        user_model.build_user_item(
+            email=row["email"],
+            hashed_password=hashed_password,
+            role="student",
+            name=row["name"],
+            specialization_id=row["specializationId"],
+        )
+        for (_, row), hashed_password in zip(to_create, hashes)
+    ]
+
+    errors = user_model.put_users_batch(user_items)
+    for (row_number, row), user, error in zip(to_create, user_items, errors):
+        if error:
+            results.append({"row": row_number, "email": row["email"], "status": "error", "error": error})
+        else:
+            results.append({"row": row_number, "email": row["email"], "status": "created", "userId": user["userId"]})
+
+    results.sort(key=lambda result: result["row"])
+    return results
+
+
 @admin_bp.route("/instructors", methods=["POST"])
 @admin_required
 def add_instructor():
@@ -98,9 +285,10 @@ def add_instructor():
         if not specialization:
             return jsonify({"error": "Specialization not found"}), 400
 
-        # Verify all courses exist and belong to specialization
+        # Verify all courses exist and belong to specialization (one batch read)
+        courses = course_model.get_many(course_ids)
         for course_id in course_ids:
-            course = course_model.get_course(course_id)
+            course = courses.get(course_id)
             if not course:
                 return jsonify({"error": f"Course {course_id} not found"}), 400
             if course.get("specializationId") != specialization_id:
@@ -123,32 +311,15 @@ def add_instructor():
             # Update instructor with new courses
             user_model.update_user(existing_instructor["userId"], courseIds=updated_course_ids)
 
-            # Also update the courses' instructorIds array to include this instructor
-            for course_id in course_ids:
-                course = course_model.get_course(course_id)
-                if course:
-                    instructor_ids = course.get("instructorIds", [])
-                    if isinstance(instructor_ids, str):
-                        instructor_ids = [instructor_ids]
-                    # Also check single instructorId for backward compatibility
-                    if not instructor_ids and course.get("instructorId"):
-                        instructor_ids = [course.get("instructorId")]
-
-                    # Add instructor if not already in list
-                    if existing_instructor["userId"] not in instructor_ids:
-                        instructor_ids.append(existing_instructor["userId"])
-
-                    # Update course with instructorIds array
-                    course_model.admin_update_course(
-                        course_id,
-                        instructorIds=instructor_ids,
-                        instructorId=instructor_ids[0] if instructor_ids else None,
-                    )
+            # Also add this instructor to the courses' instructorIds (read fresh, conditional write)
+            failures = _add_instructor_to_courses(course_ids, existing_instructor["userId"])
 
             # Get updated user
             updated_user = user_model.get_user_by_id(existing_instructor["userId"])
             updated_user.pop("password", None)
 
+            if failures:
+                return _course_failures_response("Instructor updated", updated_user, failures)
             return jsonify({"message": "Instructor updated successfully - courses added", "user": updated_user}), 200
 
         # Create new instructor
@@ -164,42 +335,52 @@ def add_instructor():
         if success:
             instructor_id = result["userId"]
 
-            # Also update the courses' instructorIds array to include this instructor
-            for course_id in course_ids:
-                course = course_model.get_course(course_id)
-                if course:
-                    instructor_ids = course.get("instructorIds", [])
-                    if isinstance(instructor_ids, str):
-                        instructor_ids = [instructor_ids]
-                    # Also check single instructorId for backward compatibility
-                    if not instructor_ids and course.get("instructorId"):
-                        instructor_ids = [course.get("instructorId")]
-
-                    # Add instructor if not already in list
-                    if instructor_id not in instructor_ids:
-                        instructor_ids.append(instructor_id)
-
-                    # Update course with instructorIds array
-                    course_model.admin_update_course(
-                        course_id,
-                        instructorIds=instructor_ids,
-                        instructorId=instructor_ids[0] if instructor_ids else None,
-                    )
+            # Also add this instructor to the courses' instructorIds (read fresh, conditional write)
+            failures = _add_instructor_to_courses(course_ids, instructor_id)
+            if failures:
+                return _course_failures_response("Instructor created", result, failures)
 
             return jsonify({"message": "Instructor created successfully", "user": result}), 201
+        elif result == UserModel.RETRY:
+            return jsonify({"error": result}), 503, {"Retry-After": "1"}
         else:
             return jsonify({"error": result}), 400
 
+    except HashingBusyError:
+        return jsonify({"error": BUSY_MESSAGE}), 503, {"Retry-After": "1"}
     except Exception as e:
         return jsonify({"error": f"Server error: {str(e)}"}), 500
 
 
+def _add_instructor_to_courses(course_ids, instructor_id):
+    # adds the instructor to every course, returns {course_id: error} for the ones that failed
+    failures = {}
+    for course_id in course_ids:
+        success, result = course_model.add_instructor(course_id, instructor_id)
+        if not success:
+            failures[course_id] = result
+    return failures
+
+
+def _course_failures_response(action, user, failures):
+    # 409 when courses were changed or deleted by another request in the meantime (same as
+    # update_course_instructor), 500 when a write failed for any other reason
+    conflict = all(error in ("Course not found", CourseModel.CONFLICT) for error in failures.values())
+    body = {
+        "error": f"{action}, but could not be added to courses: {', '.join(failures)}",
+        "failedCourseIds": list(failures),
+        "errors": failures,
+        "user": user,
+    }
+    return jsonify(body), 409 if conflict else 500
+
+
 @admin_bp.route("/specializations", methods=["GET"])
 @admin_required
 def list_specializations():
     """List all specializations (admin only)"""
     try:
-        specializations = specialization_model.list_specializations()
+        specializations = specialization_model.list_specializations(parallel=True)
         return jsonify({"specializations": specializations}), 200
     except Exception as e:
         return jsonify({"error": f"Server error: {str(e)}"}), 500
@@ -281,12 +462,12 @@ def get_courses_by_specialization(specialization_id):
         # Try to fix courses missing specializationId before querying
         from predefined_data import COURSES_BY_SPECIALIZATION
 
-        all_courses = course_model.list_courses()
+        all_courses = course_model.list_courses(parallel=True)
         courses_without_spec = [c for c in all_courses if "specializationId" not in c]
 
         if courses_without_spec:
             # Get specialization map
-            all_specs = specialization_model.list_specializations()
+            all_specs = specialization_model.list_specializations(parallel=True)
             specialization_map = {spec["code"]: spec["specializationId"] for spec in all_specs}
 
             # Build course title to specialization map
@@ -302,10 +483,11 @@ def get_courses_by_specialization(specialization_id):
                 course_title = course.get("title")
                 if course_title in course_title_to_spec:
                     spec_id = course_title_to_spec[course_title]
-                    course_model.admin_update_course(course["courseId"], specializationId=spec_id)
+                    success, _ = course_model.admin_update_course(course["courseId"], specializationId=spec_id)
+                    # patch our copy instead of scanning the table a second time
+                    if success:
+                        course["specializationId"] = spec_id
 
-        # Get all courses again after potential updates
-        all_courses = course_model.list_courses()
         courses = [c for c in all_courses if c.get("specializationId") == specialization_id]
 
         return jsonify({"courses": courses}), 200
@@ -316,48 +498,84 @@ def get_courses_by_specialization(specialization_id):
 @admin_bp.route("/users", methods=["GET"])
 @admin_required
 def list_users():
-    """List all users (admin only)"""
+    """List all users (admin only), pass limit and/or cursor to get one page at a time
+
+    fields=a,b limits the attributes returned, specializationName and courseTitles can be asked for too
+    """
     try:
         role = request.args.get("role")
-        users = user_model.list_users(role=role)
-
-        # Batch fetch all specializations and courses to avoid N+1 queries
-        all_specializations = specialization_model.list_specializations()
-        specialization_map = {spec["specializationId"]: spec["name"] for spec in all_specializations}
-
-        # Collect all unique course IDs from instructors
-        all_course_ids = set()
-        for user in users:
-            if user.get("role") == "instructor" and user.get("courseIds"):
-                course_ids = user.get("courseIds", [])
-                if isinstance(course_ids, str):
-                    course_ids = [course_ids]
-                all_course_ids.update(course_ids)
-
-        # Batch fetch all courses
-        all_courses = course_model.list_courses()
-        course_map = {course["courseId"]: course["title"] for course in all_courses}
-
-        # Enrich users with specialization names and course titles using cached maps
-        for user in users:
-            # Get specialization name if exists
-            if user.get("specializationId"):
-                user["specializationName"] = specialization_map.get(user["specializationId"], "-")
-
-            # Get course titles for instructors
-            if user.get("role") == "instructor" and user.get("courseIds"):
-                course_ids = user.get("courseIds", [])
-                if isinstance(course_ids, str):
-                    course_ids = [course_ids]
-
-                course_titles = [course_map.get(course_id) for course_id in course_ids if course_map.get(course_id)]
-                user["courseTitles"] = course_titles
-
-        return jsonify({"users": users}), 200
+        fields, error_msg = parse_fields(request.args.get("fields"))
+        if error_msg:
+            return jsonify({"error": error_msg}), 400
+        # the enrichment below needs these even when they are not returned
+        read_fields = fields and [*fields, "role", "courseIds", "specializationId"]
+
+        paginate, limit, cursor = get_page_args()
+        if paginate:
+            scope = cursor_scope("users", role)
+            start_key = decode_cursor(cursor, scope)
+            # the users and the specializations dont depend on each other, read them together
+            (users, last_key), specializations = gather(
+                lambda: user_model.list_users_page(role=role, limit=limit, start_key=start_key, fields=read_fields),
+                lambda: specialization_model.list_specializations(parallel=True),
+            )
+            users = _select_fields(_enrich_users(users, specializations), fields)
+            return jsonify({"users": users, "nextCursor": encode_cursor(last_key, scope)}), 200
+
+        users, specializations = gather(
+            lambda: user_model.list_users(role=role, parallel=True, fields=read_fields),
+            lambda: specialization_model.list_specializations(parallel=True),
+        )
+        return jsonify({"users": _select_fields(_enrich_users(users, specializations), fields)}), 200
+    except PaginationError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": f"Server error: {str(e)}"}), 500
 
 
+def _select_fields(users, fields):
+    """Trim enriched users down to the requested fields (plus userId)"""
+    if not fields:
+        return users
+    return [project(user, ["userId", *fields]) for user in users]
+
+
+def _enrich_users(users, all_specializations):
+    """Add specialization names and instructor course titles to a list of users"""
+    # Map all specializations and batch fetch courses to avoid N+1 queries
+    specialization_map = {spec["specializationId"]: spec["name"] for spec in all_specializations}
+
+    # Collect all unique course IDs from instructors
+    all_course_ids = set()
+    for user in users:
+        if user.get("role") == "instructor" and user.get("courseIds"):
+            course_ids = user.get("courseIds", [])
+            if isinstance(course_ids, str):
+                course_ids = [course_ids]
+            all_course_ids.update(course_ids)
+
+    # Batch fetch only the courses instructors are linked to, and only their titles
+    courses = course_model.get_many(all_course_ids, fields=["title"])
+    course_map = {course_id: course.get("title") for course_id, course in courses.items()}
+
+    # Enrich users with specialization names and course titles using cached maps
+    for user in users:
+        # Get specialization name if exists
+        if user.get("specializationId"):
+            user["specializationName"] = specialization_map.get(user["specializationId"], "-")
+
+        # Get course titles for instructors
+        if user.get("role") == "instructor" and user.get("courseIds"):
+            course_ids = user.get("courseIds", [])
+            if isinstance(course_ids, str):
+                course_ids = [course_ids]
+
+            course_titles = [course_map.get(course_id) for course_id in course_ids if course_map.get(course_id)]
+            user["courseTitles"] = course_titles
+
+    return users
+
+
 @admin_bp.route("/courses/<course_id>/instructor", methods=["PUT"])
 @admin_required
 def update_course_instructor(course_id):
@@ -369,33 +587,14 @@ def update_course_instructor(course_id):
         if not new_instructor_id:
             return jsonify({"error": "instructorId is required"}), 400
 
-        # Get current course
-        course = course_model.get_course(course_id)
-        if not course:
-            return jsonify({"error": "Course not found"}), 404
-
-        # Get current instructor IDs (support both formats)
-        instructor_ids = course.get("instructorIds", [])
-        if isinstance(instructor_ids, str):
-            instructor_ids = [instructor_ids]
-        # Also check single instructorId for backward compatibility
-        if not instructor_ids and course.get("instructorId"):
-            instructor_ids = [course.get("instructorId")]
-
-        # Add new instructor if not already in the list
-        if new_instructor_id not in instructor_ids:
-            instructor_ids.append(new_instructor_id)
-
-        # Update course with new instructorIds array
-        success, result = course_model.admin_update_course(
-            course_id,
-            instructorIds=instructor_ids,
-            instructorId=(
-                instructor_ids[0] if instructor_ids else None
-            ),  # Keep first as instructorId for backward compatibility
-        )
-
+        # Add the instructor, reads the course fresh and only writes if no one else changed its
+        # instructors in between (first instructor stays in instructorId for backward compatibility)
+        success, result = course_model.add_instructor(course_id, new_instructor_id)
         if not success:
+            if result == "Course not found":
+                return jsonify({"error": result}), 404
+            if result == CourseModel.CONFLICT:
+                return jsonify({"error": result}), 409
             return jsonify({"error": result}), 400
 
         # Update new instructor's courseIds (add this course if not already there)
@@ -440,7 +639,7 @@ def admin_create_course():
         # If no instructor provided, try to find one, but allow course creation without instructor
         if not instructor_id:
             # Get first instructor for this specialization
-            all_instructors = user_model.list_users(role="instructor")
+            all_instructors = user_model.list_users(role="instructor", parallel=True)
             instructors = [inst for inst in all_instructors if inst.get("specializationId") == specialization_id]
             if instructors:
                 instructor_id = instructors[0]["userId"]
@@ -519,6 +718,7 @@ def seed_courses_manual():
                     "modules_created_count": stats["modules_created"],
                     "specializations_created": stats["specializations_created"],
                     "errors": stats["errors"] if stats["errors"] else None,
+                    "timings_ms": stats["timings"],
                 }
             ),
             200,
@@ -552,5 +752,7 @@ def admin_change_user_password(user_id):
         else:
             return jsonify({"error": error}), 400
 
+    except HashingBusyError:
+        return jsonify({"error": BUSY_MESSAGE}), 503, {"Retry-After": "1"}
     except Exception as e:
         return jsonify({"error": f"Server error: {str(e)}"}), 500
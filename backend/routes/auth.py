@@ -1,6 +1,7 @@
 from flask import Blueprint, request, jsonify
 from models.user import UserModel
 from utils.auth import generate_token, token_required
+from utils.hashing import BUSY_MESSAGE, HashingBusyError
 from utils.validators import validate_password, validate_required_fields
 
 auth_bp = Blueprint("auth", __name__)
@@ -38,6 +39,9 @@ def login():
         else:
             return jsonify({"error": result}), 401
 
+    except HashingBusyError:
+        # bcrypt pool is full, tell the client to retry instead of queueing the worker
+        return jsonify({"error": BUSY_MESSAGE}), 503, {"Retry-After": "1"}
     except Exception as error:
         return jsonify({"error": f"Server error: {str(error)}"}), 500
 
@@ -73,5 +77,7 @@ def change_password():
         else:
             return jsonify({"error": error}), 400
 
+    except HashingBusyError:
+        return jsonify({"error": BUSY_MESSAGE}), 503, {"Retry-After": "1"}
     except Exception as error:
         return jsonify({"error": f"Server error: {str(error)}"}), 500
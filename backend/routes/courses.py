@@ -4,20 +4,38 @@ Course management routes
 
 from flask import Blueprint, request, jsonify
 from models.course import CourseModel
+from models.enrollment import EnrollmentModel
 from models.module import ModuleModel
+from models.progress import ProgressModel
+from models.user import UserModel
+from utils.analytics import course_analytics
 from utils.auth import token_required, instructor_required
-from utils.validators import validate_required_fields
+from utils.cache import analytics_cache, course_etag_key
+from utils.concurrency import gather
+from utils.etag import conditional_response
+from utils.pagination import PaginationError, cursor_scope, decode_cursor, encode_cursor, get_page_args
+from utils.validators import parse_fields, validate_required_fields
 
 courses_bp = Blueprint("courses", __name__)
 course_model = CourseModel()
 module_model = ModuleModel()
+user_model = UserModel()
+enrollment_model = EnrollmentModel()
+progress_model = ProgressModel()
 
 
 @courses_bp.route("", methods=["GET"])
 @token_required
 def list_courses():
-    """List courses - filtered by role and specialization"""
+    """List courses - filtered by role and specialization, pass limit and/or cursor to page
+
+    fields=courseId,title,category limits the attributes returned (and read from DynamoDB)
+    """
     try:
+        fields, error_msg = parse_fields(request.args.get("fields"))
+        if error_msg:
+            return jsonify({"error": error_msg}), 400
+
         current_user = request.current_user
         user_role = current_user.get("role")
         user_id = current_user.get("user_id")
@@ -25,9 +43,6 @@ def list_courses():
         # Get user's specialization if they are a student
         specialization_id = None
         if user_role == "student":
-            from models.user import UserModel
-
-            user_model = UserModel()
             user = user_model.get_user_by_id(user_id)
             if user and user.get("specializationId"):
                 specialization_id = user.get("specializationId")
@@ -38,18 +53,31 @@ def list_courses():
 
         # For students, filter by their specialization
         if user_role == "student" and specialization_id:
-            courses = course_model.list_courses(specialization_id=specialization_id)
+            filters = {"specialization_id": specialization_id}
         # For instructors, filter by their instructorId (unless explicitly filtered by another instructorId)
         elif user_role == "instructor":
             # If instructorId is provided in query params, use it (for admin viewing instructor's courses)
             # Otherwise, filter by the logged-in instructor's ID
             filter_instructor_id = instructor_id if instructor_id else user_id
-            courses = course_model.list_courses(instructor_id=filter_instructor_id, category=category)
+            filters = {"instructor_id": filter_instructor_id, "category": category}
         # For admins, show all courses (unless filtered by instructorId)
         else:
-            courses = course_model.list_courses(instructor_id=instructor_id, category=category)
-
+            filters = {"instructor_id": instructor_id, "category": category}
+
+        paginate, limit, cursor = get_page_args()
+        if paginate:
+            scope = cursor_scope(
+                "courses", filters.get("instructor_id"), filters.get("category"), filters.get("specialization_id")
+            )
+            courses, last_key = course_model.list_courses_page(
+                limit=limit, start_key=decode_cursor(cursor, scope), fields=fields, **filters
+            )
+            return jsonify({"courses": courses, "nextCursor": encode_cursor(last_key, scope)}), 200
+
+        courses = course_model.list_courses(fields=fields, **filters)
         return jsonify({"courses": courses}), 200
+    except PaginationError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": f"Server error: {str(e)}"}), 500
 
@@ -57,21 +85,57 @@ def list_courses():
 @courses_bp.route("/<course_id>", methods=["GET"])
 @token_required
 def get_course(course_id):
-    """Get course details with modules"""
+    """Get course details with modules, answers 304 when If-None-Match has the current ETag"""
     try:
+        return conditional_response(course_etag_key(course_id), lambda: _course_with_modules(course_id))
+    except Exception as e:
+        return jsonify({"error": f"Server error: {str(e)}"}), 500
+
+
+def _course_with_modules(course_id):
+    # (body, status) for get_course, the course and its modules are read at the same time
+    course, modules = gather(
+        lambda: course_model.get_course(course_id),
+        lambda: module_model.get_modules_by_course(course_id),
+    )
+    if not course:
+        return {"error": "Course not found"}, 404
+
+    course["modules"] = modules
+    return {"course": course}, 200
+
+
+@courses_bp.route("/<course_id>/analytics", methods=["GET"])
+@token_required
+def get_course_analytics(course_id):
+    """Module completion and drop-off analytics for a course (its instructors and admins)"""
+    try:
+        current_user = request.current_user
         course = course_model.get_course(course_id)
         if not course:
             return jsonify({"error": "Course not found"}), 404
 
-        # Get modules for this course
-        modules = module_model.get_modules_by_course(course_id)
-        course["modules"] = modules
+        is_instructor = current_user["user_id"] in CourseModel.get_instructor_ids(course)
+        if current_user["role"] != "admin" and not (current_user["role"] == "instructor" and is_instructor):
+            return jsonify({"error": "Unauthorized to view analytics for this course"}), 403
 
-        return jsonify({"course": course}), 200
+        analytics = analytics_cache.get_or_load(course_id, lambda: _build_analytics(course_id))
+        return jsonify({"analytics": analytics}), 200
     except Exception as e:
         return jsonify({"error": f"Server error: {str(e)}"}), 500
 
 
+def _build_analytics(course_id):
+    # modules, roster and every students progress are independent reads
+    modules, enrollments, progress = gather(
+        lambda: module_model.get_modules_by_course(course_id),
+        lambda: enrollment_model.get_enrollments_by_course(course_id),
+        lambda: progress_model.get_course_progress(course_id),
+    )
+    student_ids = list(dict.fromkeys(enrollment["studentId"] for enrollment in enrollments))
+    return course_analytics(course_id, modules, student_ids, progress)
+
+
 @courses_bp.route("", methods=["POST"])
 @instructor_required
 def create_course():
@@ -1,6 +1,7 @@
 from flask import Blueprint, request, jsonify
 from models.enrollment import EnrollmentModel
 from utils.auth import token_required, student_required
+from utils.pagination import PaginationError, cursor_scope, decode_cursor, encode_cursor, get_page_args
 
 enrollments_bp = Blueprint("enrollments", __name__)
 enrollment_model = EnrollmentModel()
@@ -40,13 +41,29 @@ def list_enrollments():
         course_id = request.args.get("courseId")
 
         if current_user_role == "student":
-            enrollments = enrollment_model.get_enrollments_by_student(current_user_id)
+            filters = {"student_id": current_user_id}
         elif current_user_role == "instructor" and course_id:
-            enrollments = enrollment_model.get_enrollments_by_course(course_id)
+            filters = {"course_id": course_id}
         else:
             return jsonify({"error": "Invalid request"}), 400
 
+        # limit and/or cursor return one page at a time
+        paginate, limit, cursor = get_page_args()
+        if paginate:
+            scope = cursor_scope("enrollments", filters.get("student_id"), filters.get("course_id"))
+            enrollments, last_key = enrollment_model.get_enrollments_page(
+                limit=limit, start_key=decode_cursor(cursor, scope), **filters
+            )
+            return jsonify({"enrollments": enrollments, "nextCursor": encode_cursor(last_key, scope)}), 200
+
+        if "student_id" in filters:
+            enrollments = enrollment_model.get_enrollments_by_student(current_user_id)
+        else:
+            enrollments = enrollment_model.get_enrollments_by_course(course_id)
+
         return jsonify({"enrollments": enrollments}), 200
+    except PaginationError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": f"Server error: {str(e)}"}), 500
 
@@ -1,6 +1,8 @@
 from flask import Blueprint, request, jsonify
 from models.module import ModuleModel
 from utils.auth import token_required, instructor_required
+from utils.cache import module_etag_key, modules_etag_key
+from utils.etag import conditional_response
 from utils.validators import validate_required_fields
 
 modules_bp = Blueprint("modules", __name__)
@@ -11,8 +13,9 @@ module_model = ModuleModel()
 @token_required
 def list_modules(course_id):
     try:
-        modules = module_model.get_modules_by_course(course_id)
-        return jsonify({"modules": modules}), 200
+        return conditional_response(
+            modules_etag_key(course_id), lambda: ({"modules": module_model.get_modules_by_course(course_id)}, 200)
+        )
     except Exception as e:
         return jsonify({"error": f"Server error: {str(e)}"}), 500
 
@@ -25,15 +28,19 @@ def get_module(module_id):
         if not course_id:
             return jsonify({"error": "courseId parameter required"}), 400
 
-        module = module_model.get_module(module_id, course_id)
-        if module:
-            return jsonify({"module": module}), 200
-        else:
-            return jsonify({"error": "Module not found"}), 404
+        return conditional_response(module_etag_key(module_id, course_id), lambda: _module_body(module_id, course_id))
     except Exception as e:
         return jsonify({"error": f"Server error: {str(e)}"}), 500
 
 
+def _module_body(module_id, course_id):
+    # (body, status) for get_module
+    module = module_model.get_module(module_id, course_id)
+    if module:
+        return {"module": module}, 200
+    return {"error": "Module not found"}, 404
+
+
 @modules_bp.route("/courses/<course_id>/modules", methods=["POST"])
 @instructor_required
 def create_module(course_id):
@@ -47,9 +54,14 @@ def create_module(course_id):
 
         title = data.get("title")
         description = data.get("description")
-        order = data.get("order")
         materials = data.get("materials", [])
 
+        # order is the sort key of the course index, so it has to be a number
+        try:
+            order = int(data.get("order"))
+        except (TypeError, ValueError):
+            return jsonify({"error": "order must be a number"}), 400
+
         success, result = module_model.create_module(
             course_id=course_id, title=title, description=description, order=order, materials=materials
         )
@@ -79,7 +91,10 @@ def update_module(module_id):
         if "description" in data:
             update_data["description"] = data["description"]
         if "order" in data:
-            update_data["order"] = data["order"]
+            try:
+                update_data["order"] = int(data["order"])
+            except (TypeError, ValueError):
+                return jsonify({"error": "order must be a number"}), 400
         if "materials" in data:
             update_data["materials"] = data["materials"]
 
@@ -1,9 +1,14 @@
 from flask import Blueprint, request, jsonify
+from models.course import CourseModel
+from models.module import ModuleModel
 from models.progress import ProgressModel
 from utils.auth import student_required
+from utils.pagination import PaginationError, cursor_scope, decode_cursor, encode_cursor, get_page_args
 
 progress_bp = Blueprint("progress", __name__)
 progress_model = ProgressModel()
+course_model = CourseModel()
+module_model = ModuleModel()
 
 
 @progress_bp.route("", methods=["POST"])
@@ -41,12 +46,23 @@ def get_progress():
         student_id = request.current_user["user_id"]
         course_id = request.args.get("courseId")
 
+        # limit and/or cursor return one page at a time
+        paginate, limit, cursor = get_page_args()
+        if paginate:
+            scope = cursor_scope("progress", student_id, course_id)
+            progress, last_key = progress_model.get_progress_page(
+                student_id, limit=limit, start_key=decode_cursor(cursor, scope), course_id=course_id
+            )
+            return jsonify({"progress": progress, "nextCursor": encode_cursor(last_key, scope)}), 200
+
         if course_id:
             progress = progress_model.get_progress_by_course(student_id, course_id)
         else:
             progress = progress_model.get_progress_by_student(student_id)
 
         return jsonify({"progress": progress}), 200
+    except PaginationError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": f"Server error: {str(e)}"}), 500
 
@@ -86,7 +102,14 @@ def get_stats():
         if not course_id:
             return jsonify({"error": "courseId parameter required"}), 400
 
-        stats = progress_model.get_completion_stats(student_id, course_id)
+        # the course and its modules are (usually cached) catalog reads, the completed module ids
+        # are on the stats item and only the ones still in the course count, as on the dashboard
+        course = course_model.get_course(course_id)
+        if not course:
+            return jsonify({"error": "Course not found"}), 404
+        module_ids = [module["moduleId"] for module in module_model.get_modules_by_course(course_id)]
+
+        stats = progress_model.get_completion_stats(student_id, course_id, module_ids)
         return jsonify({"stats": stats}), 200
     except Exception as e:
         return jsonify({"error": f"Server error: {str(e)}"}), 500
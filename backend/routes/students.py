@@ -0,0 +1,83 @@
+"""
+Student routes
+"""
+
+from flask import Blueprint, request, jsonify
+from models.course import CourseModel
+from models.enrollment import EnrollmentModel
+from models.module import ModuleModel
+from models.progress import ProgressModel
+from utils.auth import student_required
+from utils.concurrency import gather
+
+students_bp = Blueprint("students", __name__)
+course_model = CourseModel()
+enrollment_model = EnrollmentModel()
+module_model = ModuleModel()
+progress_model = ProgressModel()
+
+# course attributes shown on the dashboard cards
+COURSE_SUMMARY_FIELDS = ["courseId", "title", "description", "category", "specializationId"]
+
+
+@students_bp.route("/me/dashboard", methods=["GET"])
+@student_required
+def get_dashboard():
+    """Enrollments of the logged in student with course summaries and progress, in one response"""
+    try:
+        student_id = request.current_user["user_id"]
+
+        # enrollments and all of the students progress are two queries that dont depend on each other
+        enrollments, progress_records = gather(
+            lambda: enrollment_model.get_enrollments_by_student(student_id),
+            lambda: progress_model.get_progress_by_student(student_id),
+        )
+
+        course_ids = list(dict.fromkeys(enrollment["courseId"] for enrollment in enrollments))
+        # one batch read for every course (most come from the catalog cache) and the module
+        # lists of all courses at the same time
+        courses, *module_lists = gather(
+            lambda: course_model.get_many(course_ids, fields=COURSE_SUMMARY_FIELDS),
+            *[lambda course_id=course_id: module_model.get_modules_by_course(course_id) for course_id in course_ids],
+        )
+        modules_by_course = dict(zip(course_ids, module_lists))
+
+        completed_by_course = {}
+        for record in progress_records:
+            if record.get("status") == "completed":
+                completed_by_course.setdefault(record.get("courseId"), set()).add(record.get("moduleId"))
+
+        items = []
+        total_modules = 0
+        total_completed = 0
+        for enrollment in enrollments:
+            course_id = enrollment["courseId"]
+            module_ids = {module["moduleId"] for module in modules_by_course.get(course_id, [])}
+            # only count modules that still exist in the course
+            completed = len(completed_by_course.get(course_id, set()) & module_ids)
+            total = len(module_ids)
+            total_modules += total
+            total_completed += completed
+
+            items.append(
+                {
+                    **enrollment,
+                    "course": courses.get(course_id),
+                    "moduleCount": total,
+                    "progress": {
+                        "completed": completed,
+                        "total": total,
+                        "percentage": round(completed / total * 100) if total > 0 else 0,
+                    },
+                }
+            )
+
+        summary = {
+            "courses": len(items),
+            "completedModules": total_completed,
+            "totalModules": total_modules,
+            "percentage": round(total_completed / total_modules * 100) if total_modules > 0 else 0,
+        }
+        return jsonify({"enrollments": items, "summary": summary}), 200
+    except Exception as e:
+        return jsonify({"error": f"Server error: {str(e)}"}), 500
@@ -5,7 +5,9 @@ User management routes
 from flask import Blueprint, request, jsonify
 from models.user import UserModel
 from utils.auth import token_required, instructor_required
-from utils.validators import validate_email, validate_password
+from utils.hashing import BUSY_MESSAGE, HashingBusyError
+from utils.pagination import PaginationError, cursor_scope, decode_cursor, encode_cursor, get_page_args
+from utils.validators import parse_fields, validate_email, validate_password
 
 users_bp = Blueprint("users", __name__)
 user_model = UserModel()
@@ -14,11 +16,28 @@ user_model = UserModel()
 @users_bp.route("", methods=["GET"])
 @instructor_required
 def list_users():
-    """List all users (instructor only)"""
+    """List all users (instructor only), pass limit and/or cursor to get one page at a time
+
+    fields=a,b limits the attributes returned (and read from DynamoDB)
+    """
     try:
         role = request.args.get("role")
-        users = user_model.list_users(role=role)
+        fields, error_msg = parse_fields(request.args.get("fields"))
+        if error_msg:
+            return jsonify({"error": error_msg}), 400
+
+        paginate, limit, cursor = get_page_args()
+        if paginate:
+            scope = cursor_scope("users", role)
+            users, last_key = user_model.list_users_page(
+                role=role, limit=limit, start_key=decode_cursor(cursor, scope), fields=fields
+            )
+            return jsonify({"users": users, "nextCursor": encode_cursor(last_key, scope)}), 200
+
+        users = user_model.list_users(role=role, fields=fields)
         return jsonify({"users": users}), 200
+    except PaginationError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": f"Server error: {str(e)}"}), 500
 
@@ -79,9 +98,13 @@ def update_user(user_id):
 
         if success:
             return jsonify({"message": "User updated successfully", "user": result}), 200
+        elif result == UserModel.RETRY:
+            return jsonify({"error": result}), 503, {"Retry-After": "1"}
         else:
             return jsonify({"error": result}), 400
 
+    except HashingBusyError:
+        return jsonify({"error": BUSY_MESSAGE}), 503, {"Retry-After": "1"}
     except Exception as e:
         return jsonify({"error": f"Server error: {str(e)}"}), 500
 
@@ -1,8 +1,12 @@
 import boto3
+import json
 import os
+import random
 import sys
+import time
 from botocore.exceptions import ClientError
 from datetime import datetime
+from decimal import Decimal, InvalidOperation
 from dotenv import load_dotenv
 
 # load env vars from .env file
@@ -40,6 +44,18 @@ DYNAMODB_TABLES = {
         "AttributeDefinitions": [
             {"AttributeName": "moduleId", "AttributeType": "S"},
             {"AttributeName": "courseId", "AttributeType": "S"},
+            {"AttributeName": "order", "AttributeType": "N"},
+        ],
+        # a courses modules, already sorted by order
+        "GlobalSecondaryIndexes": [
+            {
+                "IndexName": "courseId-index",
+                "KeySchema": [
+                    {"AttributeName": "courseId", "KeyType": "HASH"},
+                    {"AttributeName": "order", "KeyType": "RANGE"},
+                ],
+                "Projection": {"ProjectionType": "ALL"},
+            },
         ],
         "BillingMode": "PAY_PER_REQUEST",
     },
@@ -52,18 +68,51 @@ DYNAMODB_TABLES = {
         "AttributeDefinitions": [
             {"AttributeName": "enrollmentId", "AttributeType": "S"},
             {"AttributeName": "studentId", "AttributeType": "S"},
+            {"AttributeName": "courseId", "AttributeType": "S"},
+        ],
+        # a students enrollments / a courses roster without scanning the table
+        "GlobalSecondaryIndexes": [
+            {
+                "IndexName": "studentId-courseId-index",
+                "KeySchema": [
+                    {"AttributeName": "studentId", "KeyType": "HASH"},
+                    {"AttributeName": "courseId", "KeyType": "RANGE"},
+                ],
+                "Projection": {"ProjectionType": "ALL"},
+            },
+            {
+                "IndexName": "courseId-studentId-index",
+                "KeySchema": [
+                    {"AttributeName": "courseId", "KeyType": "HASH"},
+                    {"AttributeName": "studentId", "KeyType": "RANGE"},
+                ],
+                "Projection": {"ProjectionType": "ALL"},
+            },
         ],
         "BillingMode": "PAY_PER_REQUEST",
     },
+    # one item per student per module, progressKey is "courseId#moduleId"
     "progress": {
-        "TableName": "lms-progress",
+        "TableName": "lms-progress-v2",
         "KeySchema": [
-            {"AttributeName": "progressId", "KeyType": "HASH"},
-            {"AttributeName": "studentId", "KeyType": "RANGE"},
+            {"AttributeName": "studentId", "KeyType": "HASH"},
+            {"AttributeName": "progressKey", "KeyType": "RANGE"},
         ],
         "AttributeDefinitions": [
-            {"AttributeName": "progressId", "AttributeType": "S"},
             {"AttributeName": "studentId", "AttributeType": "S"},
+            {"AttributeName": "progressKey", "AttributeType": "S"},
+            {"AttributeName": "courseId", "AttributeType": "S"},
+        ],
+        # every students progress in one course, for the course analytics
+        "GlobalSecondaryIndexes": [
+            {
+                "IndexName": "courseId-studentId-index",
+                "KeySchema": [
+                    {"AttributeName": "courseId", "KeyType": "HASH"},
+                    {"AttributeName": "studentId", "KeyType": "RANGE"},
+                ],
+                "Projection": {"ProjectionType": "ALL"},
+            },
         ],
         "BillingMode": "PAY_PER_REQUEST",
     },
@@ -73,8 +122,57 @@ DYNAMODB_TABLES = {
         "AttributeDefinitions": [{"AttributeName": "specializationId", "AttributeType": "S"}],
         "BillingMode": "PAY_PER_REQUEST",
     },
+    # email -> userId lookup, written with the user in one transaction so emails stay unique
+    "user_emails": {
+        "TableName": "lms-user-emails",
+        "KeySchema": [{"AttributeName": "email", "KeyType": "HASH"}],
+        "AttributeDefinitions": [{"AttributeName": "email", "AttributeType": "S"}],
+        "BillingMode": "PAY_PER_REQUEST",
+    },
+    # one item per (instructor, course) pair, kept in sync by CourseModel
+    "instructor_courses": {
+        "TableName": "lms-instructor-courses",
+        "KeySchema": [
+            {"AttributeName": "instructorId", "KeyType": "HASH"},
+            {"AttributeName": "courseId", "KeyType": "RANGE"},
+        ],
+        "AttributeDefinitions": [
+            {"AttributeName": "instructorId", "AttributeType": "S"},
+            {"AttributeName": "courseId", "AttributeType": "S"},
+        ],
+        "BillingMode": "PAY_PER_REQUEST",
+    },
+    # background bulk imports: a "job" item per import plus one item per batch of results
+    "import_jobs": {
+        "TableName": "lms-import-jobs",
+        "KeySchema": [
+            {"AttributeName": "jobId", "KeyType": "HASH"},
+            {"AttributeName": "part", "KeyType": "RANGE"},
+        ],
+        "AttributeDefinitions": [
+            {"AttributeName": "jobId", "AttributeType": "S"},
+            {"AttributeName": "part", "AttributeType": "S"},
+        ],
+        "BillingMode": "PAY_PER_REQUEST",
+    },
+    # one marker item per one-off data migration, with how far it got and whether it finished
+    "migrations": {
+        "TableName": "lms-migrations",
+        "KeySchema": [{"AttributeName": "migrationId", "KeyType": "HASH"}],
+        "AttributeDefinitions": [{"AttributeName": "migrationId", "AttributeType": "S"}],
+        "BillingMode": "PAY_PER_REQUEST",
+    },
 }
 
+# ids of the marker items in the migrations table
+USER_EMAILS_MIGRATION = "backfill-user-emails"
+INSTRUCTOR_COURSES_MIGRATION = "backfill-instructor-courses"
+PROGRESS_MIGRATION = "copy-legacy-progress"
+MODULE_ORDER_MIGRATION = "normalize-module-order"
+
+# progress table from before the key redesign (progressId hash + studentId range)
+LEGACY_PROGRESS_TABLE = "lms-progress"
+
 S3_BUCKET_NAME = os.getenv("S3_BUCKET_NAME", "lms-course-materials")
 
 
@@ -134,14 +232,72 @@ def table_exists(dynamodb, table_name):
             raise
 
 
-def create_dynamodb_table(dynamodb, table_config, silent=False):
-    # create table if it doesnt exist
+def ensure_global_secondary_indexes(dynamodb, table_config, silent=False, wait=False):
+    # adds any index from table_config that an existing table doesnt have yet
+    # dynamodb only allows one index to be created per update_table call, and not while
+    # another one is still building, so without wait the rest are picked up next startup
+    table_name = table_config["TableName"]
+    wanted_indexes = table_config.get("GlobalSecondaryIndexes", [])
+    if not wanted_indexes:
+        return True
+
+    for index in wanted_indexes:
+        description = dynamodb.describe_table(TableName=table_name)["Table"]
+        existing = {gsi["IndexName"] for gsi in description.get("GlobalSecondaryIndexes", [])}
+        if index["IndexName"] in existing:
+            continue
+
+        key_attributes = {key["AttributeName"] for key in index["KeySchema"]}
+        attribute_definitions = [
+            attr for attr in table_config["AttributeDefinitions"] if attr["AttributeName"] in key_attributes
+        ]
+        try:
+            if not silent:
+                print(f"Adding index '{index['IndexName']}' to '{table_name}'...")
+            dynamodb.update_table(
+                TableName=table_name,
+                AttributeDefinitions=attribute_definitions,
+                GlobalSecondaryIndexUpdates=[{"Create": index}],
+            )
+        except ClientError as error:
+            error_code = error.response["Error"]["Code"]
+            if error_code in ("ResourceInUseException", "LimitExceededException"):
+                # another worker started it or the table is busy building a previous index
+                if not silent:
+                    print(f"⚠ Index '{index['IndexName']}' on '{table_name}' will be added later: {error_code}")
+                return True
+            if not silent:
+                print(f"✗ Error adding index '{index['IndexName']}' to '{table_name}': {str(error)}")
+            return False
+
+        if not wait:
+            return True
+        wait_for_index(dynamodb, table_name, index["IndexName"])
+        if not silent:
+            print(f"✓ Index '{index['IndexName']}' on '{table_name}' is active")
+
+    return True
+
+
+def wait_for_index(dynamodb, table_name, index_name, delay=10, max_attempts=180):
+    # polls until a newly added index has finished backfilling
+    for _ in range(max_attempts):
+        description = dynamodb.describe_table(TableName=table_name)["Table"]
+        for gsi in description.get("GlobalSecondaryIndexes", []):
+            if gsi["IndexName"] == index_name and gsi.get("IndexStatus") == "ACTIVE":
+                return True
+        time.sleep(delay)
+    return False
+
+
+def create_dynamodb_table(dynamodb, table_config, silent=False, wait_for_indexes=False):
+    # create table if it doesnt exist, or add any missing indexes if it does
     table_name = table_config["TableName"]
 
     if table_exists(dynamodb, table_name):
         if not silent:
             print(f"✓ Table '{table_name}' already exists")
-        return True
+        return ensure_global_secondary_indexes(dynamodb, table_config, silent=silent, wait=wait_for_indexes)
 
     try:
         if not silent:
@@ -167,6 +323,281 @@ def create_dynamodb_table(dynamodb, table_config, silent=False):
             return False
 
 
+def get_migration(dynamodb, migration_id):
+    # marker item of a migration, empty if it has never run
+    response = dynamodb.get_item(
+        TableName=DYNAMODB_TABLES["migrations"]["TableName"],
+        Key={"migrationId": {"S": migration_id}},
+        ConsistentRead=True,
+    )
+    return response.get("Item") or {}
+
+
+def save_migration(dynamodb, migration_id, last_key=None, done=False):
+    item = {
+        "migrationId": {"S": migration_id},
+        "done": {"BOOL": done},
+        "updatedAt": {"S": datetime.utcnow().isoformat()},
+    }
+    if last_key:
+        item["lastKey"] = {"S": json.dumps(last_key)}
+    dynamodb.put_item(TableName=DYNAMODB_TABLES["migrations"]["TableName"], Item=item)
+
+
+def migration_done(dynamodb, migration_id):
+    return get_migration(dynamodb, migration_id).get("done", {}).get("BOOL", False)
+
+
+def checkpointed_scan(dynamodb, migration_id, restart=False, **scan_kwargs):
+    # yields the items of a scan page by page and records in the migrations table how far it got,
+    # so a run that is cut short (a worker killed at boot) carries on from the last finished page
+    # next time. yields nothing once the migration is marked done, unless restart is set
+    if not restart:
+        marker = get_migration(dynamodb, migration_id)
+        if marker.get("done", {}).get("BOOL"):
+            return
+        if "lastKey" in marker:
+            scan_kwargs["ExclusiveStartKey"] = json.loads(marker["lastKey"]["S"])
+
+    while True:
+        page = dynamodb.scan(**scan_kwargs)
+        yield page.get("Items", [])
+        # only reached once the caller has handled the page
+        last_key = page.get("LastEvaluatedKey")
+        if not last_key:
+            break
+        scan_kwargs["ExclusiveStartKey"] = last_key
+        save_migration(dynamodb, migration_id, last_key=last_key)
+    save_migration(dynamodb, migration_id, done=True)
+
+
+def backfill_user_emails(dynamodb, silent=False, restart=False):
+    # copies email -> userId for users created before the lookup table existed
+    users_table = DYNAMODB_TABLES["users"]["TableName"]
+    emails_table = DYNAMODB_TABLES["user_emails"]["TableName"]
+    written = 0
+    conflicts = []
+
+    pages = checkpointed_scan(
+        dynamodb,
+        USER_EMAILS_MIGRATION,
+        restart=restart,
+        TableName=users_table,
+        ProjectionExpression="userId, email",
+    )
+    for items in pages:
+        for item in items:
+            if "email" not in item:
+                continue
+            try:
+                dynamodb.put_item(
+                    TableName=emails_table,
+                    Item={"email": item["email"], "userId": item["userId"]},
+                    ConditionExpression="attribute_not_exists(email) OR userId = :userId",
+                    ExpressionAttributeValues={":userId": item["userId"]},
+                )
+                written += 1
+            except ClientError as error:
+                if error.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                    raise
+                # two users already share this email, keep the first one we saw
+                conflicts.append(item["email"]["S"])
+
+    if not silent:
+        print(f"✓ Backfilled {written} email lookup item(s) into '{emails_table}'")
+        for email in conflicts:
+            print(f"⚠ Duplicate email in '{users_table}': {email}")
+    return written, conflicts
+
+
+def backfill_instructor_courses(dynamodb, silent=False, restart=False):
+    # builds the instructor -> course mapping from the courses table, safe to run again
+    courses_table = DYNAMODB_TABLES["courses"]["TableName"]
+    mapping_table = DYNAMODB_TABLES["instructor_courses"]["TableName"]
+    written = 0
+
+    pages = checkpointed_scan(
+        dynamodb,
+        INSTRUCTOR_COURSES_MIGRATION,
+        restart=restart,
+        TableName=courses_table,
+        ProjectionExpression="courseId, instructorId, instructorIds",
+    )
+    for items in pages:
+        for item in items:
+            instructor_ids = set()
+            if "S" in item.get("instructorId", {}):
+                instructor_ids.add(item["instructorId"]["S"])
+            for value in item.get("instructorIds", {}).get("L", []):
+                if "S" in value:
+                    instructor_ids.add(value["S"])
+            for instructor_id in instructor_ids:
+                dynamodb.put_item(
+                    TableName=mapping_table,
+                    Item={"instructorId": {"S": instructor_id}, "courseId": item["courseId"]},
+                )
+                written += 1
+
+    if not silent:
+        print(f"✓ Backfilled {written} instructor/course mapping(s) into '{mapping_table}'")
+    return written
+
+
+def copy_progress_item(dynamodb, item):
+    # writes one legacy row into the new table, returns True if it was written
+    # the app keeps running while this happens, so a row the app already wrote wins, except that
+    # a legacy completion replaces a row that isnt completed (a completion is never undone)
+    progress_table = DYNAMODB_TABLES["progress"]["TableName"]
+    if item.get("status", {}).get("S") != "completed":
+        try:
+            dynamodb.put_item(
+                TableName=progress_table, Item=item, ConditionExpression="attribute_not_exists(progressKey)"
+            )
+            return True
+        except ClientError as error:
+            if error.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+            return False
+
+    # a completion also has to be counted on the students stats item for the course, if that
+    # already tracks completions (otherwise the counter and set are seeded from the rows later).
+    # both are checked in the transaction so they cant be seeded in between. the conditions are
+    # ProgressModel.TRACKED_CONDITION and UNTRACKED_CONDITION
+    put = {
+        "TableName": progress_table,
+        "Item": item,
+        "ConditionExpression": "attribute_not_exists(progressKey) OR #status <> :completed",
+        "ExpressionAttributeNames": {"#status": "status"},
+        "ExpressionAttributeValues": {":completed": {"S": "completed"}},
+    }
+    stats_key = {"studentId": item["studentId"], "progressKey": {"S": f"stats#{item['courseId']['S']}"}}
+    count = {
+        "Update": {
+            "TableName": progress_table,
+            "Key": stats_key,
+            "UpdateExpression": "ADD completedModules :one, completedModuleIds :moduleIds",
+            "ConditionExpression": "attribute_exists(completedModuleIds) OR completedModules = :zero",
+            "ExpressionAttributeValues": {
+                ":one": {"N": "1"},
+                ":zero": {"N": "0"},
+                ":moduleIds": {"SS": [item["moduleId"]["S"]]},
+            },
+        }
+    }
+    no_counter = {
+        "ConditionCheck": {
+            "TableName": progress_table,
+            "Key": stats_key,
+            "ConditionExpression": (
+                "attribute_not_exists(completedModules) OR "
+                "(completedModules <> :zero AND attribute_not_exists(completedModuleIds))"
+            ),
+            "ExpressionAttributeValues": {":zero": {"N": "0"}},
+        }
+    }
+    # tries with the counter update first, then with the check that there is no counter yet
+    for attempt in range(6):
+        try:
+            dynamodb.transact_write_items(TransactItems=[{"Put": put}, count if attempt % 2 == 0 else no_counter])
+            return True
+        except ClientError as error:
+            if error.response["Error"]["Code"] != "TransactionCanceledException":
+                raise
+            codes = [reason.get("Code") for reason in error.response.get("CancellationReasons", [])]
+            if codes and codes[0] == "ConditionalCheckFailed":
+                # already completed in the new table
+                return False
+            if attempt == 5:
+                raise
+            if "TransactionConflict" in codes:
+                # the app is writing the same student and course, back off a little
+                time.sleep(random.uniform(0, 0.05 * 2**attempt))
+
+
+def migrate_progress_table(dynamodb, silent=False, restart=False):
+    # copies rows from the old progressId keyed table into the new studentId keyed one
+    progress_table = DYNAMODB_TABLES["progress"]["TableName"]
+    if not table_exists(dynamodb, LEGACY_PROGRESS_TABLE):
+        # nothing to copy, the app can stop reading the old table
+        save_migration(dynamodb, PROGRESS_MIGRATION, done=True)
+        return 0
+
+    copied = 0
+    for items in checkpointed_scan(dynamodb, PROGRESS_MIGRATION, restart=restart, TableName=LEGACY_PROGRESS_TABLE):
+        for item in items:
+            if "courseId" not in item or "moduleId" not in item:
+                continue
+            item["progressKey"] = {"S": f"{item['courseId']['S']}#{item['moduleId']['S']}"}
+            if copy_progress_item(dynamodb, item):
+                copied += 1
+
+    if not silent:
+        print(f"✓ Copied {copied} progress record(s) from '{LEGACY_PROGRESS_TABLE}' to '{progress_table}'")
+    return copied
+
+
+def module_order_value(value):
+    # number to store as a modules order: a numeric string becomes that number (cut to a whole
+    # number like the app does), anything else None
+    if "N" in value:
+        return value["N"]
+    try:
+        number = Decimal(value.get("S", "").strip())
+    except InvalidOperation:
+        return None
+    if not number.is_finite():
+        return None
+    return str(int(number))
+
+
+def normalize_module_order(dynamodb, silent=False, restart=False):
+    # modules from before order was stored as a number can have it as a string or not at all.
+    # courseId-index is sorted by order (a number), so those modules are left out of it and the
+    # course stops listing them. converts numeric strings and gives the rest order 0 (where the
+    # old scan listing sorted them), safe to run again
+    modules_table = DYNAMODB_TABLES["modules"]["TableName"]
+    converted = 0
+    defaulted = []
+
+    pages = checkpointed_scan(
+        dynamodb,
+        MODULE_ORDER_MIGRATION,
+        restart=restart,
+        TableName=modules_table,
+        ProjectionExpression="moduleId, courseId, #order",
+        ExpressionAttributeNames={"#order": "order"},
+    )
+    for items in pages:
+        for item in items:
+            if "N" in item.get("order", {}):
+                continue
+            order = module_order_value(item.get("order", {}))
+            try:
+                # only if no one gave it a number in the meantime
+                dynamodb.update_item(
+                    TableName=modules_table,
+                    Key={"moduleId": item["moduleId"], "courseId": item["courseId"]},
+                    UpdateExpression="SET #order = :order",
+                    ConditionExpression="attribute_exists(moduleId) AND NOT attribute_type(#order, :number)",
+                    ExpressionAttributeNames={"#order": "order"},
+                    ExpressionAttributeValues={":order": {"N": order or "0"}, ":number": {"S": "N"}},
+                )
+            except ClientError as error:
+                if error.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                    raise
+                continue
+            if order is None:
+                defaulted.append(item["moduleId"]["S"])
+            else:
+                converted += 1
+
+    if not silent:
+        print(f"✓ Converted the order of {converted} module(s) in '{modules_table}' to a number")
+        for module_id in defaulted:
+            print(f"⚠ Module {module_id} had no numeric order, set to 0")
+    return converted, defaulted
+
+
 def bucket_exists(s3, bucket_name):
     # check if bucket exists
     try:
@@ -250,6 +681,18 @@ def setup_aws_resources(silent=False):
             if create_dynamodb_table(dynamodb, table_config, silent=silent):
                 tables_created += 1
 
+        # one-off data migrations run (and resume where they stopped) on every startup until
+        # their marker item says they finished
+        migrations = [
+            (USER_EMAILS_MIGRATION, backfill_user_emails),
+            (PROGRESS_MIGRATION, migrate_progress_table),
+            (INSTRUCTOR_COURSES_MIGRATION, backfill_instructor_courses),
+            (MODULE_ORDER_MIGRATION, normalize_module_order),
+        ]
+        for migration_id, migrate in migrations:
+            if not migration_done(dynamodb, migration_id):
+                migrate(dynamodb, silent=silent)
+
         # create bucket
         bucket_created = create_s3_bucket(s3, S3_BUCKET_NAME, silent=silent)
 
@@ -292,10 +735,34 @@ def main():
     print("-" * 60)
     tables_created = 0
     for table_config in DYNAMODB_TABLES.values():
-        if create_dynamodb_table(dynamodb, table_config, silent=False):
+        if create_dynamodb_table(dynamodb, table_config, silent=False, wait_for_indexes=True):
             tables_created += 1
         print()
 
+    # make sure every existing user has an email lookup item (safe to run again)
+    print("Backfilling email lookup table...")
+    print("-" * 60)
+    backfill_user_emails(dynamodb, silent=False, restart=True)
+    print()
+
+    # rebuild the instructor -> course mapping (safe to run again)
+    print("Backfilling instructor course mapping...")
+    print("-" * 60)
+    backfill_instructor_courses(dynamodb, silent=False, restart=True)
+    print()
+
+    # copy progress from the old table layout if it is still around (safe to run again)
+    print("Migrating progress records...")
+    print("-" * 60)
+    migrate_progress_table(dynamodb, silent=False, restart=True)
+    print()
+
+    # give modules without a numeric order one, so courseId-index lists them (safe to run again)
+    print("Normalizing module order...")
+    print("-" * 60)
+    normalize_module_order(dynamodb, silent=False, restart=True)
+    print()
+
     # create bucket
     print("Creating S3 bucket...")
     print("-" * 60)
@@ -1,12 +1,20 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
 from models.user import UserModel
 from models.specialization import SpecializationModel
 from models.course import CourseModel
 from models.module import ModuleModel
+from utils.bulk_import import create_hash_pool, hash_passwords
 from predefined_data import ADMIN_CONFIG, SPECIALIZATIONS_DATA, COURSES_BY_SPECIALIZATION, SAMPLE_MODULES
 
+# default password for seeded instructor accounts
+INSTRUCTOR_DEFAULT_PASSWORD = "Instructor123!"
+
 
 class DatabaseSeeder:
     # this class handles seeding the database with initial data
+    # it reads users, courses and specializations once, works out what is missing in
+    # memory, and then writes only the missing items with batched writes
 
     def __init__(self):
         self.user_model = UserModel()
@@ -20,18 +28,24 @@ class DatabaseSeeder:
             "courses_created": 0,
             "modules_created": 0,
             "errors": [],
+            "timings": {},
         }
+        # snapshot of what is already in the tables, filled by _load_snapshot
+        self.users_by_email = {}
+        self.courses = []
+        self.specializations = []
 
     def seed_all(self, silent=False):
         # seeds all the data - admin, specializations, courses, instructors, modules
         # if silent is true it wont print much stuff
         try:
-            self._seed_admin(silent)
-            specialization_map = self._seed_specializations(silent)
-            self._fix_courses_missing_specialization(specialization_map, silent)
+            self._timed("snapshot", self._load_snapshot, silent)
+            self._timed("admin", self._seed_admin, silent)
+            specialization_map = self._timed("specializations", self._seed_specializations, silent)
+            self._timed("fix_courses", self._fix_courses_missing_specialization, specialization_map, silent)
 
             if specialization_map:
-                self._seed_courses_and_instructors(specialization_map, silent)
+                self._timed("courses_and_instructors", self._seed_courses_and_instructors, specialization_map, silent)
 
             if not silent:
                 self._print_summary()
@@ -48,13 +62,35 @@ class DatabaseSeeder:
             traceback.print_exc()
             return self.stats
 
+    def _timed(self, phase, func, *args):
+        # runs one seeding phase and records how long it took in milliseconds
+        started = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            self.stats["timings"][phase] = round((time.perf_counter() - started) * 1000, 1)
+
+    def _load_snapshot(self, silent=False):
+        # read the three tables we diff against, at the same time
+        if not silent:
+            print("Loading existing users, courses and specializations...")
+
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            users_future = executor.submit(self.user_model.list_users, parallel=True)
+            courses_future = executor.submit(self.course_model.list_courses, parallel=True)
+            specs_future = executor.submit(self.specialization_model.list_specializations, parallel=True)
+            users = users_future.result()
+            self.courses = courses_future.result()
+            self.specializations = specs_future.result()
+
+        self.users_by_email = {user["email"]: user for user in users if user.get("email")}
+
     def _seed_admin(self, silent=False):
         # creates admin user if it doesnt exist
         if not silent:
             print("Checking admin user...")
 
-        admin = self.user_model.get_user_by_email(ADMIN_CONFIG["email"])
-        if admin:
+        if ADMIN_CONFIG["email"] in self.users_by_email:
             if not silent:
                 print(f"✓ Admin user already exists: {ADMIN_CONFIG['email']}")
             return
@@ -68,6 +104,7 @@ class DatabaseSeeder:
 
         if success:
             self.stats["admin_created"] = True
+            self.users_by_email[result["email"]] = result
             if not silent:
                 print(f"✓ Admin user created: {ADMIN_CONFIG['email']}")
         else:
@@ -81,37 +118,42 @@ class DatabaseSeeder:
         if not silent:
             print("Checking specializations...")
 
-        specialization_map = {}
+        specialization_map = {spec["code"]: spec["specializationId"] for spec in self.specializations}
 
+        new_specs = []
         for spec_data in SPECIALIZATIONS_DATA:
-            existing = self.specialization_model.get_specialization_by_code(spec_data["code"])
-            if existing:
-                specialization_map[spec_data["code"]] = existing["specializationId"]
-            else:
-                if not silent:
-                    print(f"  Creating specialization: {spec_data['name']}")
-
-                success, result = self.specialization_model.create_specialization(
+            if spec_data["code"] in specialization_map:
+                continue
+            if not silent:
+                print(f"  Creating specialization: {spec_data['name']}")
+            new_specs.append(
+                self.specialization_model.build_specialization_item(
                     name=spec_data["name"], code=spec_data["code"], description=spec_data["description"]
                 )
+            )
+
+        if new_specs:
+            try:
+                self.specialization_model.put_specializations_batch(new_specs)
+            except Exception as e:
+                error_msg = f"Failed to create specializations: {str(e)}"
+                self.stats["errors"].append(error_msg)
+                if not silent:
+                    print(f"  ✗ {error_msg}")
+                return specialization_map
 
-                if success:
-                    specialization_map[spec_data["code"]] = result["specializationId"]
-                    self.stats["specializations_created"] += 1
-                    if not silent:
-                        print(f"  ✓ Created specialization: {spec_data['name']}")
-                else:
-                    error_msg = f"Failed to create specialization {spec_data['name']}: {result}"
-                    self.stats["errors"].append(error_msg)
-                    if not silent:
-                        print(f"  ✗ {error_msg}")
+            for spec in new_specs:
+                specialization_map[spec["code"]] = spec["specializationId"]
+            self.specializations.extend(new_specs)
+            self.stats["specializations_created"] += len(new_specs)
+            if not silent:
+                print(f"  ✓ Created {len(new_specs)} specialization(s)")
 
         return specialization_map
 
     def _fix_courses_missing_specialization(self, specialization_map, silent=False):
         # fixes courses that dont have specializationId set
-        existing_courses = self.course_model.list_courses()
-        courses_without_spec = [c for c in existing_courses if "specializationId" not in c]
+        courses_without_spec = [c for c in self.courses if "specializationId" not in c]
 
         if not courses_without_spec:
             return
@@ -134,9 +176,12 @@ class DatabaseSeeder:
                 success, result = self.course_model.admin_update_course(
                     course["courseId"], specializationId=specialization_id
                 )
-                if success and not silent:
-                    print(f"  ✓ Updated course '{course_title}' with specializationId")
-                elif not success:
+                if success:
+                    # keep the snapshot in step so the course isnt created again below
+                    course["specializationId"] = specialization_id
+                    if not silent:
+                        print(f"  ✓ Updated course '{course_title}' with specializationId")
+                else:
                     error_msg = f"Failed to update course '{course_title}': {result}"
                     self.stats["errors"].append(error_msg)
 
@@ -145,93 +190,96 @@ class DatabaseSeeder:
         if not silent:
             print("Checking specializations and courses...")
 
+        existing_courses = {(c.get("title"), c.get("specializationId")): c for c in self.courses}
+        new_instructors = {}  # email -> user item waiting for a password hash
+        new_courses = []
+        new_modules = []
+        # instructorId -> course ids they should be linked to
+        instructor_links = {}
+
         for spec_code, courses_data in COURSES_BY_SPECIALIZATION.items():
             specialization_id = specialization_map.get(spec_code)
             if not specialization_id:
                 continue
 
             for course_data in courses_data:
-                # first make sure instructor exists
-                instructor = self.user_model.get_user_by_email(course_data["instructor_email"])
+                # first make sure instructor exists (or is queued to be created)
+                email = course_data["instructor_email"]
+                instructor = self.users_by_email.get(email) or new_instructors.get(email)
                 if not instructor:
-                    success, result = self.user_model.create_user(
-                        email=course_data["instructor_email"],
-                        password="Instructor123!",
+                    instructor = self.user_model.build_user_item(
+                        email=email,
+                        hashed_password=None,
                         role="instructor",
                         name=course_data["instructor_name"],
                         specialization_id=specialization_id,
                         course_ids=[],
                     )
-
-                    if success:
-                        instructor_id = result["userId"]
-                        self.stats["instructors_created"] += 1
-                    else:
-                        error_msg = f"Failed to create instructor {course_data['instructor_name']}: {result}"
-                        self.stats["errors"].append(error_msg)
-                        continue
-                else:
-                    instructor_id = instructor["userId"]
+                    new_instructors[email] = instructor
+                instructor_id = instructor["userId"]
 
                 # check if course already exists
-                all_courses = self.course_model.list_courses()
-                existing_course = None
-                for c in all_courses:
-                    if c.get("title") == course_data["title"] and c.get("specializationId") == specialization_id:
-                        existing_course = c
-                        break
-
+                existing_course = existing_courses.get((course_data["title"], specialization_id))
                 if existing_course:
                     course_id = existing_course["courseId"]
-
-                    # make sure instructor is linked to the course
-                    instructor_obj = self.user_model.get_user_by_id(instructor_id)
-                    if instructor_obj:
-                        existing_course_ids = instructor_obj.get("courseIds", [])
-                        if isinstance(existing_course_ids, str):
-                            existing_course_ids = [existing_course_ids]
-                        if course_id not in existing_course_ids:
-                            existing_course_ids.append(course_id)
-                            self.user_model.update_user(instructor_id, courseIds=existing_course_ids)
                 else:
-                    # create the course
-                    success, course_result = self.course_model.create_course(
+                    course = self.course_model.build_course_item(
                         instructor_id=instructor_id,
                         title=course_data["title"],
                         description=course_data["description"],
                         category="General",
                         specialization_id=specialization_id,
                     )
-
-                    if success:
-                        course_id = course_result["courseId"]
-                        self.stats["courses_created"] += 1
-
-                        # link instructor to course
-                        instructor_obj = self.user_model.get_user_by_id(instructor_id)
-                        if instructor_obj:
-                            existing_course_ids = instructor_obj.get("courseIds", [])
-                            if isinstance(existing_course_ids, str):
-                                existing_course_ids = [existing_course_ids]
-                            if course_id not in existing_course_ids:
-                                existing_course_ids.append(course_id)
-                                self.user_model.update_user(instructor_id, courseIds=existing_course_ids)
-
-                        # create modules for the course
-                        modules_created = 0
-                        for module_data in SAMPLE_MODULES:
-                            self.module_model.create_module(
+                    course_id = course["courseId"]
+                    existing_courses[(course_data["title"], specialization_id)] = course
+                    new_courses.append(course)
+
+                    # create modules for the course
+                    for module_data in SAMPLE_MODULES:
+                        new_modules.append(
+                            self.module_model.build_module_item(
                                 course_id=course_id,
                                 title=module_data["title"],
                                 description=module_data["description"],
                                 order=module_data["order"],
                             )
-                            modules_created += 1
+                        )
+
+                instructor_links.setdefault(instructor_id, []).append(course_id)
 
-                        self.stats["modules_created"] += modules_created
-                    else:
-                        error_msg = f"Failed to create course {course_data['title']}: {course_result}"
-                        self.stats["errors"].append(error_msg)
+        # new instructors get their course links before they are written
+        for instructor in new_instructors.values():
+            instructor["courseIds"] = instructor_links.pop(instructor["userId"], [])
+
+        try:
+            self.stats["instructors_created"] += self._write_new_instructors(list(new_instructors.values()))
+        except Exception as e:
+            error_msg = f"Failed to create instructors: {str(e)}"
+            self.stats["errors"].append(error_msg)
+            return
+
+        try:
+            self.course_model.put_courses_batch(new_courses)
+            self.stats["courses_created"] += len(new_courses)
+            self.module_model.put_modules_batch(new_modules)
+            self.stats["modules_created"] += len(new_modules)
+        except Exception as e:
+            error_msg = f"Failed to create courses: {str(e)}"
+            self.stats["errors"].append(error_msg)
+            return
+
+        # existing instructors that are missing a link to one of their courses
+        users_by_id = {user["userId"]: user for user in self.users_by_email.values()}
+        for instructor_id, course_ids in instructor_links.items():
+            instructor = users_by_id.get(instructor_id)
+            if not instructor:
+                continue
+            existing_course_ids = instructor.get("courseIds", [])
+            if isinstance(existing_course_ids, str):
+                existing_course_ids = [existing_course_ids]
+            missing = [course_id for course_id in course_ids if course_id not in existing_course_ids]
+            if missing:
+                self.user_model.update_user(instructor_id, courseIds=existing_course_ids + missing)
 
         if not silent:
             if self.stats["courses_created"] == 0 and self.stats["instructors_created"] == 0:
@@ -241,6 +289,22 @@ class DatabaseSeeder:
                     f"✓ Seeding completed: {self.stats['courses_created']} courses, {self.stats['instructors_created']} instructors created"
                 )
 
+    def _write_new_instructors(self, instructors):
+        # hash passwords on the bulk import process pool then batch write the users
+        # (not the request hashing pool, that one is kept small for logins)
+        # returns how many were created, an instructor whose email got taken meanwhile is an error
+        if not instructors:
+            return 0
+        with create_hash_pool() as hash_pool:
+            hashes = hash_passwords(hash_pool, [INSTRUCTOR_DEFAULT_PASSWORD] * len(instructors))
+        for instructor, hashed_password in zip(instructors, hashes):
+            instructor["password"] = hashed_password
+        errors = self.user_model.put_users_batch(instructors)
+        for instructor, error in zip(instructors, errors):
+            if error:
+                self.stats["errors"].append(f"Failed to create instructor {instructor['email']}: {error}")
+        return sum(1 for error in errors if not error)
+
     def _print_summary(self):
         # prints what was created
         print("\n" + "=" * 60)
@@ -250,6 +314,8 @@ class DatabaseSeeder:
         print(f"  Instructors created: {self.stats['instructors_created']}")
         print(f"  Courses created: {self.stats['courses_created']}")
         print(f"  Modules created: {self.stats['modules_created']}")
+        if self.stats["timings"]:
+            print("  Timings (ms): " + ", ".join(f"{k}={v}" for k, v in self.stats["timings"].items()))
         if self.stats["errors"]:
             print(f"  Errors: {len(self.stats['errors'])}")
             for error in self.stats["errors"]:
@@ -0,0 +1,106 @@
+from datetime import datetime
+import numpy as np
+
+# course analytics for instructors. a courses progress is loaded into one student x module
+# matrix of status codes and every aggregate is a numpy reduction over it, so a course with
+# thousands of students is a handful of array operations instead of python loops
+
+# status codes in the matrix
+NOT_STARTED = 0
+IN_PROGRESS = 1
+COMPLETED = 2
+STATUS_CODES = {"in_progress": IN_PROGRESS, "completed": COMPLETED}
+
+# percent edges of the per student completion histogram, the last bucket includes 100
+DISTRIBUTION_EDGES = [0, 20, 40, 60, 80, 100]
+
+
+def status_matrix(student_ids, module_ids, progress_records):
+    # int8 matrix with one row per student and one column per module, in the order given
+    # progress of students or modules that arent in the lists is left out
+    student_index = {student_id: i for i, student_id in enumerate(student_ids)}
+    module_index = {module_id: i for i, module_id in enumerate(module_ids)}
+    cells = [
+        (student_index[record["studentId"]], module_index[record["moduleId"]], STATUS_CODES.get(record.get("status"), 0))
+        for record in progress_records
+        if record.get("studentId") in student_index and record.get("moduleId") in module_index
+    ]
+
+    matrix = np.zeros((len(student_ids), len(module_ids)), dtype=np.int8)
+    if cells:
+        rows, cols, codes = np.array(cells, dtype=np.int64).T
+        # the highest status wins if a cell shows up twice
+        np.maximum.at(matrix, (rows, cols), codes.astype(np.int8))
+    return matrix
+
+
+def _percent(numerator, denominator):
+    # element wise numerator / denominator * 100, 0 where the denominator is 0
+    numerator = np.asarray(numerator, dtype=np.float64)
+    denominator = np.broadcast_to(np.asarray(denominator, dtype=np.float64), numerator.shape)
+    result = np.zeros_like(numerator)
+    np.divide(numerator, denominator, out=result, where=denominator > 0)
+    return np.round(result * 100, 1)
+
+
+def course_analytics(course_id, modules, student_ids, progress_records):
+    # modules in course order, student_ids of the enrolled students, progress items of the course
+    module_ids = [module["moduleId"] for module in modules]
+    matrix = status_matrix(student_ids, module_ids, progress_records)
+    student_count, module_count = matrix.shape
+
+    completed = matrix == COMPLETED
+    completed_per_module = completed.sum(axis=0)
+    in_progress_per_module = (matrix == IN_PROGRESS).sum(axis=0)
+    completed_per_student = completed.sum(axis=1)
+    student_percent = _percent(completed_per_student, module_count)
+
+    started = (matrix != NOT_STARTED).any(axis=1)
+    finished = completed.all(axis=1) & (module_count > 0)
+
+    # modules completed in a row from the first one: a student who started but didnt finish
+    # dropped off at the first module they havent completed
+    streak = np.where(finished, module_count, np.argmin(completed, axis=1) if module_count else 0)
+    drop_offs = np.bincount(streak[started & ~finished], minlength=module_count + 1)[:module_count]
+    # students who started and got to module i with every earlier module completed
+    reached = np.bincount(streak[started], minlength=module_count + 1)[::-1].cumsum()[::-1][:module_count]
+
+    histogram, _ = np.histogram(student_percent, bins=DISTRIBUTION_EDGES)
+
+    completion_rate = _percent(completed_per_module, student_count)
+    in_progress_rate = _percent(in_progress_per_module, student_count)
+    drop_off_rate = _percent(drop_offs, reached)
+
+    module_stats = [
+        {
+            "moduleId": module["moduleId"],
+            "title": module.get("title"),
+            "order": int(module.get("order", i)),
+            "completed": int(completed_per_module[i]),
+            "inProgress": int(in_progress_per_module[i]),
+            "completionRate": float(completion_rate[i]),
+            "inProgressRate": float(in_progress_rate[i]),
+            "dropOffs": int(drop_offs[i]),
+            "dropOffRate": float(drop_off_rate[i]),
+        }
+        for i, module in enumerate(modules)
+    ]
+
+    return {
+        "courseId": course_id,
+        "students": student_count,
+        "modules": module_count,
+        "notStarted": int((~started).sum()),
+        "inProgress": int((started & ~finished).sum()),
+        "finished": int(finished.sum()),
+        "averageCompletion": float(np.round(student_percent.mean(), 1)) if student_count else 0.0,
+        "medianCompletion": float(np.round(np.median(student_percent), 1)) if student_count else 0.0,
+        "completionDistribution": [
+            {"from": DISTRIBUTION_EDGES[i], "to": DISTRIBUTION_EDGES[i + 1], "students": int(count)}
+            for i, count in enumerate(histogram)
+        ],
+        "moduleStats": module_stats,
+        # the module where most students who left stopped
+        "biggestDropOff": module_stats[int(np.argmax(drop_offs))]["moduleId"] if drop_offs.any() else None,
+        "generatedAt": datetime.utcnow().isoformat(),
+    }
@@ -0,0 +1,126 @@
+import csv
+import io
+import json
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+import bcrypt
+from config import Config
+from utils.hashing import get_rounds
+
+_lock = threading.Lock()
+_state = {"pid": None, "executor": None, "heartbeats": None}
+
+CSV_MIMETYPES = {"text/csv", "application/csv"}
+NDJSON_MIMETYPES = {"application/x-ndjson", "application/ndjson", "application/jsonl", "application/x-jsonlines"}
+
+
+def detect_format(mimetype, filename=None):
+    # works out if an upload is csv or ndjson from its content type or file extension
+    if mimetype in CSV_MIMETYPES or (filename and filename.lower().endswith(".csv")):
+        return "csv"
+    if mimetype in NDJSON_MIMETYPES or (filename and filename.lower().endswith((".ndjson", ".jsonl"))):
+        return "ndjson"
+    return None
+
+
+def read_rows(stream, file_format):
+    # yields (row_number, row) from a binary stream one line at a time, so the whole upload
+    # is never held in memory. rows that cant be parsed come back as (row_number, None)
+    text = io.TextIOWrapper(stream, encoding="utf-8", newline="")
+    if file_format == "csv":
+        for row_number, row in enumerate(csv.DictReader(text), start=1):
+            yield row_number, row
+        return
+
+    row_number = 0
+    for line in text:
+        if not line.strip():
+            continue
+        row_number += 1
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield row_number, row if isinstance(row, dict) else None
+
+
+def read_batches(rows, batch_size):
+    # groups rows into lists of batch_size so each batch can be hashed and written together
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _hash_password(password, rounds):
+    # runs in a worker process, has to be a top level function so it can be pickled
+    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(rounds=rounds)).decode("utf-8")
+
+
+def create_hash_pool():
+    # process pool for bcrypt so hashing a cohort uses every core instead of one request thread
+    # the workers are spawned, not forked: forking a gunicorn worker copies its threads, locks
+    # and open connections into the child
+    return ProcessPoolExecutor(
+        max_workers=Config.BULK_IMPORT_HASH_WORKERS, mp_context=multiprocessing.get_context("spawn")
+    )
+
+
+def submit_job(func, *args, heartbeat=None):
+    # runs func(*args) on this processs import thread, after the request that started it has
+    # returned. heartbeat, when given, is called every BULK_IMPORT_HEARTBEAT_INTERVAL seconds
+    # from now until func has finished (queued or running). a worker that is restarted mid import
+    # takes the job with it, the beats then stop and the job can be reported as failed
+    pid = os.getpid()
+    if _state["pid"] != pid:
+        with _lock:
+            if _state["pid"] != pid:
+                _state["executor"] = ThreadPoolExecutor(
+                    max_workers=Config.BULK_IMPORT_JOB_WORKERS, thread_name_prefix="import"
+                )
+                _state["heartbeats"] = {}
+                threading.Thread(
+                    target=_send_heartbeats, args=(_state["heartbeats"],), name="import-heartbeat", daemon=True
+                ).start()
+                _state["pid"] = pid
+    future = _state["executor"].submit(func, *args)
+    if heartbeat:
+        heartbeats = _state["heartbeats"]
+        with _lock:
+            heartbeats[future] = heartbeat
+        future.add_done_callback(lambda done: _stop_heartbeat(heartbeats, done))
+    return future
+
+
+def _stop_heartbeat(heartbeats, future):
+    with _lock:
+        heartbeats.pop(future, None)
+
+
+def _send_heartbeats(heartbeats):
+    # one thread per process beats for every job it has queued or running
+    while True:
+        time.sleep(Config.BULK_IMPORT_HEARTBEAT_INTERVAL)
+        with _lock:
+            beats = list(heartbeats.values())
+        for beat in beats:
+            try:
+                beat()
+            except Exception as e:
+                print(f"⚠ Import heartbeat failed: {str(e)}")
+
+
+def hash_passwords(executor, passwords):
+    # hashes a list of passwords on the pool, results come back in the same order
+    # the cost is worked out here so the worker processes dont each calibrate it again
+    rounds = get_rounds()
+    chunksize = max(1, len(passwords) // (Config.BULK_IMPORT_HASH_WORKERS * 4))
+    return list(executor.map(partial(_hash_password, rounds=rounds), passwords, chunksize=chunksize))
@@ -0,0 +1,168 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+from config import Config
+from utils import events, metrics
+
+# small read-through caches for catalog data (courses, modules, specializations)
+# by default each gunicorn worker has its own copy, so entries expire after a ttl to
+# pick up writes made by other workers. writes in this worker invalidate straight away.
+# CATALOG_SHARED_CACHE_ENABLED switches to one cache shared by all workers on the host.
+
+
+class TTLCache:
+    # bounded lru cache where every entry also expires after ttl seconds
+    # values are deep copied in and out so callers can change what they get back
+
+    def __init__(self, name, ttl=None, max_entries=None):
+        self.name = name
+        self.ttl = ttl if ttl is not None else Config.CATALOG_CACHE_TTL
+        self.max_entries = max_entries or Config.CATALOG_CACHE_MAX_ENTRIES
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        # cached value or None, counts a hit or a miss
+        if not Config.CATALOG_CACHE_ENABLED:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                value = entry[1]
+            else:
+                if entry:
+                    del self._entries[key]
+                value = None
+        metrics.increment(f"cache.{self.name}.{'hit' if value is not None else 'miss'}")
+        return copy.deepcopy(value)
+
+    def set(self, key, value):
+        # None is never cached so a missing item is looked up again next time
+        if not Config.CATALOG_CACHE_ENABLED or value is None:
+            return
+        value = copy.deepcopy(value)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                metrics.increment(f"cache.{self.name}.evicted")
+
+    def get_many_or_load(self, keys, loader):
+        # read-through for several keys, loader gets the missing keys and returns {key: value}
+        found = {}
+        missing = []
+        for key in dict.fromkeys(keys):
+            value = self.get(key)
+            if value is None:
+                missing.append(key)
+            else:
+                found[key] = value
+        if missing:
+            loaded = loader(missing)
+            for key, value in loaded.items():
+                self.set(key, value)
+            found.update(loaded)
+        return found
+
+    def get_or_load(self, key, loader):
+        # read-through, calls loader on a miss and caches what it returns
+        value = self.get(key)
+        if value is None:
+            value = loader()
+            self.set(key, value)
+        return value
+
+    def invalidate(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def _create_cache(name, ttl=None):
+    # per-process cache by default, or the host-wide one in utils/shared_cache.py
+    if Config.CATALOG_SHARED_CACHE_ENABLED:
+        from utils.shared_cache import SharedTTLCache
+
+        return SharedTTLCache(name, ttl)
+    return TTLCache(name, ttl)
+
+
+# courseId -> course
+course_cache = _create_cache("courses")
+# courseId -> modules of that course, sorted by order
+module_cache = _create_cache("modules")
+# specializationId -> specialization, plus ALL_SPECIALIZATIONS -> the full list
+specialization_cache = _create_cache("specializations")
+ALL_SPECIALIZATIONS = "__all__"
+# resource key -> etag of the last response built for it, see utils/etag.py
+# dropped by the same model writes that drop the entities the response was built from
+etag_cache = _create_cache("etags")
+# courseId -> analytics of that course, see utils/analytics.py
+# progress writes dont invalidate it (there are too many), so it is as old as the ttl at most
+analytics_cache = _create_cache("analytics", ttl=Config.COURSE_ANALYTICS_CACHE_TTL)
+
+
+def course_etag_key(course_id):
+    # GET /api/courses/<id>, the course plus its modules
+    return f"course:{course_id}"
+
+
+def modules_etag_key(course_id):
+    # GET /api/modules/courses/<id>/modules
+    return f"modules:{course_id}"
+
+
+def module_etag_key(module_id, course_id):
+    # GET /api/modules/<id>?courseId=
+    return f"module:{course_id}:{module_id}"
+
+
+def project(item, fields):
+    # keeps only the given attributes, like a ProjectionExpression on a cached item
+    if not fields:
+        return item
+    return {field: item[field] for field in fields if field in item}
+
+
+# invalidation, driven by the model write events (see utils/events.py). these run synchronously
+# so a worker never serves its own stale copy right after a write
+
+
+def _on_course_changed(event):
+    course_id = event.key["courseId"]
+    course_cache.invalidate(course_id)
+    etag_cache.invalidate(course_etag_key(course_id))
+
+
+def _on_module_changed(event):
+    # the module list, the course (its moduleCount), the analytics and every response built from them
+    course_id, module_id = event.key["courseId"], event.key["moduleId"]
+    module_cache.invalidate(course_id)
+    course_cache.invalidate(course_id)
+    analytics_cache.invalidate(course_id)
+    etag_cache.invalidate(course_etag_key(course_id), modules_etag_key(course_id), module_etag_key(module_id, course_id))
+
+
+def _on_enrollment_changed(event):
+    # the course holds the enrollmentCount
+    course_id = event.get("courseId")
+    if course_id:
+        course_cache.invalidate(course_id)
+        etag_cache.invalidate(course_etag_key(course_id))
+
+
+def _on_specialization_changed(event):
+    specialization_cache.invalidate(event.key["specializationId"], ALL_SPECIALIZATIONS)
+
+
+events.subscribe(events.CourseChanged, _on_course_changed)
+events.subscribe(events.ModuleChanged, _on_module_changed)
+events.subscribe(events.EnrollmentChanged, _on_enrollment_changed)
+events.subscribe(events.SpecializationChanged, _on_specialization_changed)
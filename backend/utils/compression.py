@@ -0,0 +1,63 @@
+import gzip
+from flask import request
+from config import Config
+from utils import metrics
+from utils.etag import encoded_etag
+
+# brotli is optional, without it responses are gzip only
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def _encodings():
+    # encodings we can produce, best first
+    return ["br", "gzip"] if brotli is not None else ["gzip"]
+
+
+def _compress(data, encoding):
+    if encoding == "br":
+        return brotli.compress(data, quality=Config.COMPRESSION_BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=Config.COMPRESSION_GZIP_LEVEL)
+
+
+def compress_response(response):
+    # after_request hook, compresses json/text bodies over the size threshold
+    # with whatever the client prefers from Accept-Encoding
+    if (
+        response.status_code < 200
+        or response.status_code in (204, 304)
+        or response.direct_passthrough
+        or response.is_streamed
+        or "Content-Encoding" in response.headers
+        or response.mimetype not in Config.COMPRESSION_MIMETYPES
+    ):
+        return response
+
+    # the body depends on Accept-Encoding, so shared caches must key on it
+    response.vary.add("Accept-Encoding")
+
+    encoding = request.accept_encodings.best_match(_encodings())
+    if not encoding:
+        return response
+    data = response.get_data()
+    if len(data) < Config.COMPRESSION_MIN_SIZE:
+        return response
+
+    compressed = _compress(data, encoding)
+    response.set_data(compressed)
+    response.headers["Content-Encoding"] = encoding
+    # the compressed bytes are a different representation of the same resource, with its own etag
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(encoded_etag(etag, encoding), weak=weak)
+    metrics.increment(f"compression.{encoding}")
+    metrics.increment("compression.bytes_saved", len(data) - len(compressed))
+    return response
+
+
+def init_compression(app):
+    # registers the compression hook on the app if it is turned on
+    if Config.COMPRESSION_ENABLED:
+        app.after_request(compress_response)
@@ -0,0 +1,54 @@
+import contextvars
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from config import Config
+
+# runs independent reads of one request at the same time, so the request takes as long
+# as the slowest call instead of the sum of them. boto3 clients are thread safe and
+# release the gil while waiting on the network, so a thread pool is enough here.
+_lock = threading.Lock()
+_state = {"pid": None, "executor": None}
+_local = threading.local()
+
+
+def _get_executor():
+    # one pool per process, rebuilt after a gunicorn fork
+    pid = os.getpid()
+    if _state["pid"] != pid:
+        with _lock:
+            if _state["pid"] != pid:
+                _state["executor"] = ThreadPoolExecutor(
+                    max_workers=Config.REQUEST_FANOUT_WORKERS, thread_name_prefix="fanout"
+                )
+                _state["pid"] = pid
+    return _state["executor"]
+
+
+def _run_in_pool(func):
+    # marks the thread so a nested gather runs inline instead of waiting on its own pool
+    _local.in_pool = True
+    try:
+        return func()
+    finally:
+        _local.in_pool = False
+
+
+def gather(*calls):
+    # runs the zero-argument callables concurrently and returns their results in order
+    # the last call runs on the calling thread, the rest on the pool. each call gets a copy
+    # of the current context so flask's request/current_app still work inside it
+    # if a call raises, the exception is re-raised here after the others have finished
+    if len(calls) <= 1 or getattr(_local, "in_pool", False):
+        return [call() for call in calls]
+
+    executor = _get_executor()
+    futures = [
+        executor.submit(contextvars.copy_context().run, _run_in_pool, call) for call in calls[:-1]
+    ]
+    try:
+        last = calls[-1]()
+    finally:
+        # always wait so no call is still running against this request once we return
+        wait(futures)
+    return [*(future.result() for future in futures), last]
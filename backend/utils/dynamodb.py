@@ -0,0 +1,298 @@
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import boto3
+from botocore.config import Config as BotoConfig
+from botocore.exceptions import ClientError
+from config import Config
+
+# one boto3 session + dynamodb resource per process, shared by every model
+# gunicorn forks workers after the app is imported, so we remember which pid
+# built the resource and rebuild it in the child instead of sharing sockets
+_lock = threading.Lock()
+_state = {"pid": None, "session": None, "resource": None}
+
+
+def _create_session():
+    # build a boto3 session with the same credential rules the models used before
+    if Config.AWS_ACCESS_KEY_ID and Config.AWS_SECRET_ACCESS_KEY:
+        session_kwargs = {
+            "region_name": Config.AWS_REGION,
+            "aws_access_key_id": Config.AWS_ACCESS_KEY_ID,
+            "aws_secret_access_key": Config.AWS_SECRET_ACCESS_KEY,
+        }
+        # add session token if we have it (needed for learner lab)
+        if Config.AWS_SESSION_TOKEN:
+            session_kwargs["aws_session_token"] = Config.AWS_SESSION_TOKEN
+        return boto3.session.Session(**session_kwargs)
+    return boto3.session.Session(region_name=Config.AWS_REGION)
+
+
+def _client_config():
+    # connection pool, keep-alive and retry settings for the dynamodb client
+    return BotoConfig(
+        max_pool_connections=Config.DYNAMODB_MAX_POOL_CONNECTIONS,
+        tcp_keepalive=Config.DYNAMODB_TCP_KEEPALIVE,
+        connect_timeout=Config.DYNAMODB_CONNECT_TIMEOUT,
+        read_timeout=Config.DYNAMODB_READ_TIMEOUT,
+        retries={"mode": Config.DYNAMODB_RETRY_MODE, "max_attempts": Config.DYNAMODB_MAX_ATTEMPTS},
+    )
+
+
+def get_dynamodb_resource():
+    # returns the shared dynamodb resource, creating it on first use in this process
+    pid = os.getpid()
+    resource = _state["resource"]
+    if resource is not None and _state["pid"] == pid:
+        return resource
+
+    with _lock:
+        if _state["resource"] is None or _state["pid"] != pid:
+            session = _create_session()
+            _state["session"] = session
+            _state["resource"] = session.resource("dynamodb", config=_client_config())
+            _state["pid"] = pid
+        return _state["resource"]
+
+
+def get_dynamodb_client():
+    # low level client behind the shared resource, for batch and transaction calls
+    # (it still takes plain python values, the resource registers the type conversion)
+    return get_dynamodb_resource().meta.client
+
+
+def get_table(table_name):
+    # shortcut used by the models to get a table from the shared resource
+    return get_dynamodb_resource().Table(table_name)
+
+
+def reset_dynamodb_resource():
+    # drops the cached session so the next call builds a new one (e.g. after credentials rotate)
+    with _lock:
+        _state["pid"] = None
+        _state["session"] = None
+        _state["resource"] = None
+
+
+def iterate_items(operation, max_items=None, page_size=None, **kwargs):
+    # walks every page of a table.scan / table.query call and yields the items one by one
+    # only one page is held at a time, and no more pages are read once max_items are yielded
+    if page_size:
+        kwargs["Limit"] = page_size
+    yielded = 0
+    while True:
+        response = operation(**kwargs)
+        for item in response.get("Items", []):
+            yield item
+            yielded += 1
+            if max_items is not None and yielded >= max_items:
+                return
+        last_key = response.get("LastEvaluatedKey")
+        if not last_key:
+            return
+        kwargs["ExclusiveStartKey"] = last_key
+
+
+def read_page(operation, limit, start_key=None, **kwargs):
+    # one page of at most limit items and the key to continue from (None on the last page)
+    # Limit is counted before FilterExpression, so filtered reads ask again for what is still
+    # missing, and stop early once limit * PAGE_SCAN_FACTOR items were looked at so a rare
+    # filter cant turn one page into a full table read (the caller just gets a shorter page)
+    items = []
+    scanned = 0
+    if start_key:
+        kwargs["ExclusiveStartKey"] = start_key
+    while True:
+        response = operation(Limit=limit - len(items), **kwargs)
+        items.extend(response.get("Items", []))
+        scanned += response.get("ScannedCount", 0)
+        last_key = response.get("LastEvaluatedKey")
+        if not last_key or len(items) >= limit or scanned >= limit * Config.PAGE_SCAN_FACTOR:
+            return items, last_key
+        kwargs["ExclusiveStartKey"] = last_key
+
+
+def count_items(operation, **kwargs):
+    # number of items a table.scan / table.query matches, Select=COUNT so no items are sent back
+    kwargs["Select"] = "COUNT"
+    count = 0
+    while True:
+        response = operation(**kwargs)
+        count += response["Count"]
+        last_key = response.get("LastEvaluatedKey")
+        if not last_key:
+            return count
+        kwargs["ExclusiveStartKey"] = last_key
+
+
+def ensure_counter(table, key, attribute, count):
+    # makes sure the item has the number attribute that counter_update ADDs to, starting it at
+    # count() if it is missing (items written before the counter existed). call it before the
+    # write that ADDs, so that write is never both in count() and in the ADD
+    # returns False when the item doesnt exist
+    names = {f"#key{i}": name for i, name in enumerate(key)}
+    names["#counter"] = attribute
+    response = table.get_item(
+        Key=key, ProjectionExpression=", ".join(names), ExpressionAttributeNames=names, ConsistentRead=True
+    )
+    item = response.get("Item")
+    if not item:
+        return False
+    if attribute in item:
+        return True
+
+    try:
+        table.update_item(
+            Key=key,
+            UpdateExpression="SET #counter = :count",
+            ConditionExpression="attribute_exists(#key0) AND attribute_not_exists(#counter)",
+            ExpressionAttributeNames={"#key0": names["#key0"], "#counter": attribute},
+            ExpressionAttributeValues={":count": count()},
+        )
+    except ClientError as error:
+        # another request started it first (or the item was just deleted)
+        if error.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            raise
+    return True
+
+
+def counter_update(table_name, key, attribute, delta):
+    # atomic ADD to a counter started by ensure_counter, as update_item kwargs that also work
+    # as a transaction item
+    return {
+        "TableName": table_name,
+        "Key": key,
+        "UpdateExpression": "ADD #counter :delta",
+        "ConditionExpression": "attribute_exists(#counter)",
+        "ExpressionAttributeNames": {"#counter": attribute},
+        "ExpressionAttributeValues": {":delta": delta},
+    }
+
+
+def first_item(operation, **kwargs):
+    # first matching item of a scan/query or None, stops as soon as one is found
+    return next(iterate_items(operation, max_items=1, **kwargs), None)
+
+
+def parallel_scan(table, total_segments=None, **scan_kwargs):
+    # full table read split into segments that are scanned at the same time on a thread pool
+    # each segment goes through the (thread safe) low level client rather than the table object
+    total_segments = total_segments or Config.DYNAMODB_SCAN_SEGMENTS
+    scan = partial(table.meta.client.scan, TableName=table.name)
+    if total_segments <= 1:
+        return list(iterate_items(scan, **scan_kwargs))
+
+    def scan_segment(segment):
+        return list(iterate_items(scan, Segment=segment, TotalSegments=total_segments, **scan_kwargs))
+
+    with ThreadPoolExecutor(max_workers=total_segments) as executor:
+        segments = executor.map(scan_segment, range(total_segments))
+        return [item for segment_items in segments for item in segment_items]
+
+
+def projection_kwargs(fields):
+    # ProjectionExpression + names for a list of attributes, names avoid reserved words like "order"
+    if not fields:
+        return {}
+    names = {f"#p{index}": field for index, field in enumerate(fields)}
+    return {"ProjectionExpression": ", ".join(names), "ExpressionAttributeNames": names}
+
+
+def with_projection(kwargs, fields):
+    # adds a ProjectionExpression for fields to scan/query kwargs, keeping any names the filter uses
+    projection = projection_kwargs(fields)
+    if not projection:
+        return kwargs
+    return {
+        **kwargs,
+        "ProjectionExpression": projection["ProjectionExpression"],
+        "ExpressionAttributeNames": {
+            **kwargs.get("ExpressionAttributeNames", {}),
+            **projection["ExpressionAttributeNames"],
+        },
+    }
+
+
+def backoff(attempt, max_attempts, error_code, operation_name):
+    # sleeps before retry number attempt, exponential with full jitter, and raises a ClientError
+    # with error_code once max_attempts is reached
+    if attempt >= max_attempts:
+        raise ClientError(
+            {"Error": {"Code": error_code, "Message": f"Gave up after {attempt} attempts"}},
+            operation_name,
+        )
+    time.sleep(random.uniform(0, min(2.0, 0.05 * 2**attempt)))
+
+
+def cancellation_codes(error):
+    # the Code of every item of a cancelled transaction, in order ("None" for the items that were fine)
+    return [reason.get("Code") for reason in error.response.get("CancellationReasons", [])]
+
+
+def transact_with_retry(client, transact_items, attempts=3):
+    # TransactWriteItems that is retried with backoff when another write to the same items got
+    # in the way (TransactionConflict). returns True when written and False when the condition
+    # of the first item failed (the "already there" / "not there" case), raises anything else
+    for attempt in range(attempts):
+        if attempt:
+            backoff(attempt, attempts, "TransactionConflict", "TransactWriteItems")
+        try:
+            client.transact_write_items(TransactItems=transact_items)
+            return True
+        except ClientError as error:
+            if error.response["Error"]["Code"] != "TransactionCanceledException":
+                raise
+            codes = cancellation_codes(error)
+            if codes and codes[0] == "ConditionalCheckFailed":
+                return False
+            if "TransactionConflict" not in codes or attempt == attempts - 1:
+                raise
+
+
+def batch_get_items(table, keys, fields=None, max_attempts=8):
+    # BatchGetItem in chunks of 100 keys (the dynamodb limit), retrying UnprocessedKeys with
+    # exponential backoff + jitter. duplicate keys are dropped since dynamodb rejects them
+    unique_keys = list({tuple(sorted(key.items())): key for key in keys}.values())
+    resource = get_dynamodb_resource()
+    items = []
+
+    for start in range(0, len(unique_keys), 100):
+        request = {"Keys": unique_keys[start : start + 100], **projection_kwargs(fields)}
+        request_items = {table.name: request}
+        attempt = 0
+        while request_items:
+            response = resource.batch_get_item(RequestItems=request_items)
+            items.extend(response.get("Responses", {}).get(table.name, []))
+            request_items = response.get("UnprocessedKeys") or None
+            if request_items:
+                attempt += 1
+                backoff(attempt, max_attempts, "UnprocessedKeys", "BatchGetItem")
+
+    return items
+
+
+def batch_write_items(table, items, max_workers=None, max_attempts=8):
+    # BatchWriteItem puts in chunks of 25 (the dynamodb limit), with the chunks sent in
+    # parallel and UnprocessedItems retried with backoff. items must have unique keys
+    chunks = [items[start : start + 25] for start in range(0, len(items), 25)]
+    client = table.meta.client
+
+    def write_chunk(chunk):
+        request_items = {table.name: [{"PutRequest": {"Item": item}} for item in chunk]}
+        attempt = 0
+        while request_items:
+            response = client.batch_write_item(RequestItems=request_items)
+            request_items = response.get("UnprocessedItems") or None
+            if request_items:
+                attempt += 1
+                backoff(attempt, max_attempts, "UnprocessedItems", "BatchWriteItem")
+        return len(chunk)
+
+    if len(chunks) <= 1:
+        return sum(write_chunk(chunk) for chunk in chunks)
+    max_workers = min(len(chunks), max_workers or Config.DYNAMODB_BATCH_WRITE_WORKERS)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return sum(executor.map(write_chunk, chunks))
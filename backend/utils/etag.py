@@ -0,0 +1,74 @@
+import hashlib
+import json
+from flask import jsonify, make_response, request
+from utils import metrics
+from utils.cache import etag_cache
+
+# strong etags for GET endpoints the frontend polls. the etag of each resource is kept
+# in the catalog cache, so when the client already has the current version the 304 is
+# sent without reading dynamodb at all.
+# a compressed response is a different set of bytes, so it gets its own strong etag with the
+# encoding added ("<hash>-gzip", "<hash>-br") and the suffix is taken off again to compare.
+ENCODING_SUFFIXES = ("-gzip", "-br")
+
+
+def compute_etag(body):
+    # content hash of the response body, updatedAt is part of the items so edits change it
+    payload = json.dumps(body, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+
+def encoded_etag(etag, encoding):
+    # strong etag of the response body compressed with encoding
+    return f"{etag}-{encoding}"
+
+
+def strip_encoding(etag):
+    # the etag of the uncompressed body, for a tag from encoded_etag or a plain one
+    for suffix in ENCODING_SUFFIXES:
+        if etag.endswith(suffix):
+            return etag[: -len(suffix)]
+    return etag
+
+
+def _matching_tag(etag):
+    # the tag from If-None-Match that is this etag in any encoding, or None. answering with that
+    # tag keeps the 304 in the same form as the 200 the client has
+    if request.if_none_match.star_tag:
+        return etag
+    for tag in request.if_none_match.as_set(include_weak=True):
+        if strip_encoding(tag) == etag:
+            return tag
+    return None
+
+
+def _not_modified(etag):
+    response = make_response("", 304)
+    response.set_etag(etag)
+    return response
+
+
+def conditional_response(etag_key, build_body):
+    # build_body returns (body, status). only 200s get an etag, errors are returned as they are
+    built = {}
+
+    def load():
+        built["body"], built["status"] = build_body()
+        return compute_etag(built["body"]) if built["status"] == 200 else None
+
+    etag = etag_cache.get_or_load(etag_key, load)
+    matching_tag = _matching_tag(etag) if etag else None
+    if matching_tag:
+        metrics.increment("etag.not_modified")
+        return _not_modified(matching_tag)
+
+    if not built:
+        # the etag was cached but the client has an older copy (or none)
+        load()
+    response = jsonify(built["body"])
+    response.status_code = built["status"]
+    if built["status"] == 200:
+        response.set_etag(compute_etag(built["body"]))
+        # let the browser keep the copy but always check it with If-None-Match
+        response.headers["Cache-Control"] = "private, no-cache"
+    return response
@@ -0,0 +1,127 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from config import Config
+from utils import metrics
+
+# in-process publish/subscribe for model writes. every model write publishes an event
+# saying which item changed, and caches or derived data subscribe to the event types
+# they care about instead of each write path calling them directly.
+#
+# sync subscribers run inside publish, before the write returns (cache invalidation,
+# so this worker reads its own writes). background subscribers run on a small thread
+# pool after the write has returned, for slower follow-up work that shouldnt add to
+# the request. a subscriber that raises is logged and counted, it never fails the write.
+# events only reach subscribers in this process.
+
+CREATED = "created"
+UPDATED = "updated"
+DELETED = "deleted"
+
+
+class ItemChanged:
+    # base event, subscribe to it to get every change
+    # key is the primary key of the item, before/after are the item as it was and as it is
+    # now when the write path has them (None otherwise, and always None for a create/delete side)
+    entity = "item"
+
+    def __init__(self, action, key, before=None, after=None):
+        self.action = action
+        self.key = dict(key)
+        self.before = before
+        self.after = after
+
+    def get(self, attribute):
+        # attribute from the newest image that has it, falling back to the key
+        for image in (self.after, self.before, self.key):
+            if image and attribute in image:
+                return image[attribute]
+        return None
+
+    def changed(self, attribute):
+        # False only when both images are known and the attribute is the same in them
+        if self.before is None or self.after is None:
+            return True
+        return self.before.get(attribute) != self.after.get(attribute)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.action}, {self.key})"
+
+
+class CourseChanged(ItemChanged):
+    entity = "course"
+
+
+class ModuleChanged(ItemChanged):
+    entity = "module"
+
+
+class EnrollmentChanged(ItemChanged):
+    entity = "enrollment"
+
+
+class ProgressChanged(ItemChanged):
+    entity = "progress"
+
+
+class SpecializationChanged(ItemChanged):
+    entity = "specialization"
+
+
+class UserChanged(ItemChanged):
+    # before/after never include the password hash
+    entity = "user"
+
+
+class EventBus:
+    def __init__(self):
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self._state = {"pid": None, "executor": None}
+
+    def subscribe(self, event_type, handler, background=False):
+        # handler(event) is called for every published event that is an event_type
+        with self._lock:
+            self._subscribers.append((event_type, handler, background))
+        return handler
+
+    def unsubscribe(self, handler):
+        with self._lock:
+            self._subscribers = [entry for entry in self._subscribers if entry[1] is not handler]
+
+    def publish(self, event):
+        metrics.increment(f"events.{event.entity}.{event.action}")
+        for event_type, handler, background in list(self._subscribers):
+            if not isinstance(event, event_type):
+                continue
+            if background:
+                self._get_executor().submit(self._run, handler, event)
+            else:
+                self._run(handler, event)
+
+    def _get_executor(self):
+        # one pool per process, rebuilt after a gunicorn fork
+        pid = os.getpid()
+        if self._state["pid"] != pid:
+            with self._lock:
+                if self._state["pid"] != pid:
+                    self._state["executor"] = ThreadPoolExecutor(
+                        max_workers=Config.EVENT_BACKGROUND_WORKERS, thread_name_prefix="events"
+                    )
+                    self._state["pid"] = pid
+        return self._state["executor"]
+
+    @staticmethod
+    def _run(handler, event):
+        try:
+            handler(event)
+        except Exception as error:
+            metrics.increment("events.subscriber_error")
+            print(f"⚠ Event subscriber {getattr(handler, '__name__', handler)} failed on {event!r}: {str(error)}")
+
+
+# the bus every model publishes to
+bus = EventBus()
+subscribe = bus.subscribe
+unsubscribe = bus.unsubscribe
+publish = bus.publish
@@ -0,0 +1,146 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+import bcrypt
+from config import Config
+from utils import metrics
+
+# bcrypt runs on a small dedicated pool instead of inline in every request thread.
+# gunicorn runs threaded workers (gthread), so one process serves several requests at once;
+# bcrypt releases the gil, and the pool caps how many hashes a worker process runs at
+# once. when the pool and its queue are full, new work is refused straight away so a
+# login burst turns into quick 503s instead of every request thread being stuck hashing.
+BUSY_MESSAGE = "Server is busy, please try again in a moment"
+
+_lock = threading.Lock()
+_state = {"pid": None, "executor": None, "slots": None, "rounds": None}
+
+
+class HashingBusyError(Exception):
+    # raised when the hashing pool is full, routes turn it into a 503
+    pass
+
+
+def _get_pool():
+    # executor + slot counter for this process, rebuilt after a gunicorn fork
+    pid = os.getpid()
+    if _state["pid"] != pid:
+        with _lock:
+            if _state["pid"] != pid:
+                _state["executor"] = ThreadPoolExecutor(
+                    max_workers=Config.PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt"
+                )
+                _state["slots"] = threading.BoundedSemaphore(
+                    Config.PASSWORD_HASH_WORKERS + Config.PASSWORD_HASH_QUEUE_LIMIT
+                )
+                _state["pid"] = pid
+    return _state["executor"], _state["slots"]
+
+
+def _run(name, func):
+    # runs func on the pool and waits for it, or raises HashingBusyError if there is no room
+    executor, slots = _get_pool()
+    if not slots.acquire(blocking=False):
+        metrics.increment(f"{name}.rejected")
+        raise HashingBusyError(BUSY_MESSAGE)
+
+    def timed():
+        started = time.perf_counter()
+        try:
+            return func()
+        finally:
+            metrics.observe(name, time.perf_counter() - started)
+
+    try:
+        future = executor.submit(timed)
+    except Exception:
+        slots.release()
+        raise
+    future.add_done_callback(lambda _: slots.release())
+    try:
+        return future.result(timeout=Config.PASSWORD_HASH_TIMEOUT)
+    except FutureTimeoutError:
+        # queued for too long, the slot is given back once the hash finishes
+        metrics.increment(f"{name}.timed_out")
+        raise HashingBusyError(BUSY_MESSAGE)
+
+
+def _time_hash(rounds, samples=3):
+    # median seconds for one bcrypt hash at this cost
+    timings = []
+    for _ in range(samples):
+        started = time.perf_counter()
+        bcrypt.hashpw(b"calibration-password", bcrypt.gensalt(rounds=rounds))
+        timings.append(time.perf_counter() - started)
+    return sorted(timings)[len(timings) // 2]
+
+
+def calibrate_rounds(target_ms=None):
+    # highest bcrypt cost that hashes within target_ms on this cpu, clamped to the min/max in config
+    # every extra round doubles the work, so time a cheap cost and scale up from there
+    target = (target_ms or Config.PASSWORD_HASH_TARGET_MS) / 1000
+    probe_rounds = 8
+    probe_seconds = _time_hash(probe_rounds)
+    rounds = Config.PASSWORD_HASH_MIN_ROUNDS
+    while rounds < Config.PASSWORD_HASH_MAX_ROUNDS and probe_seconds * 2 ** (rounds + 1 - probe_rounds) <= target:
+        rounds += 1
+    # the estimate can be off a bit on a busy machine, check the pick once at full cost
+    if rounds > Config.PASSWORD_HASH_MIN_ROUNDS and _time_hash(rounds, samples=1) > target * 1.5:
+        rounds -= 1
+    return rounds
+
+
+def get_rounds():
+    # bcrypt cost used for new hashes: PASSWORD_HASH_ROUNDS when it is set, otherwise calibrated
+    # once for this process. a calibrated cost only lives in this worker, so other workers can
+    # end up with a different one, which is why stored hashes are only moved to a pinned cost
+    if Config.PASSWORD_HASH_ROUNDS is not None:
+        return Config.PASSWORD_HASH_ROUNDS
+    if _state["rounds"] is None:
+        with _lock:
+            if _state["rounds"] is None:
+                _state["rounds"] = calibrate_rounds()
+                print(
+                    f"⚠ PASSWORD_HASH_ROUNDS is not set, bcrypt cost calibrated to {_state['rounds']} "
+                    f"(target {Config.PASSWORD_HASH_TARGET_MS}ms) for this worker only and stored hashes "
+                    "keep their cost. Run calibrate_password_hash.py --write to pin it for all workers"
+                )
+    return _state["rounds"]
+
+
+def cost_is_pinned():
+    # true when every worker hashes at the same configured cost
+    return Config.PASSWORD_HASH_ROUNDS is not None
+
+
+def hash_rounds(hashed):
+    # cost factor stored in a bcrypt hash like $2b$12$..., None if it cant be read
+    try:
+        return int(hashed.split("$")[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+def needs_rehash(hashed):
+    # true when a stored hash cant be read, or its cost differs from the pinned one (up or down,
+    # so login cost follows PASSWORD_HASH_ROUNDS when the instance type changes). without a
+    # pinned cost workers could disagree and rewrite a hash back and forth, so nothing is moved
+    rounds = hash_rounds(hashed)
+    if rounds is None:
+        return True
+    return cost_is_pinned() and rounds != Config.PASSWORD_HASH_ROUNDS
+
+
+def hash_password(password):
+    # bcrypt hash of a password at the configured cost, done on the hashing pool
+    rounds = get_rounds()
+    return _run(
+        "bcrypt.hash",
+        lambda: bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(rounds=rounds)).decode("utf-8"),
+    )
+
+
+def verify_password(password, hashed):
+    # check a password against a bcrypt hash, done on the hashing pool
+    return _run("bcrypt.verify", lambda: bcrypt.checkpw(password.encode("utf-8"), hashed.encode("utf-8")))
@@ -0,0 +1,36 @@
+import threading
+
+# simple in-process counters and timings, exposed on /api/metrics
+# each gunicorn worker keeps its own numbers
+_lock = threading.Lock()
+_counters = {}
+_timings = {}
+
+
+def increment(name, amount=1):
+    # add to a named counter
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+
+def observe(name, seconds):
+    # record how long something took
+    with _lock:
+        timing = _timings.setdefault(name, {"count": 0, "total": 0.0, "max": 0.0})
+        timing["count"] += 1
+        timing["total"] += seconds
+        timing["max"] = max(timing["max"], seconds)
+
+
+def snapshot():
+    # copy of everything recorded so far in this process
+    with _lock:
+        timings = {
+            name: {
+                "count": timing["count"],
+                "avg_ms": round(timing["total"] / timing["count"] * 1000, 2) if timing["count"] else 0,
+                "max_ms": round(timing["max"] * 1000, 2),
+            }
+            for name, timing in _timings.items()
+        }
+        return {"counters": dict(_counters), "timings": timings}
@@ -0,0 +1,84 @@
+import base64
+import hashlib
+import hmac
+import json
+from decimal import Decimal
+from flask import request
+from config import Config
+
+# opaque cursors for paginated list endpoints. a cursor wraps the dynamodb
+# LastEvaluatedKey plus the query it belongs to, signed with SECRET_KEY, so any
+# gunicorn worker can continue a listing and clients cant forge or reuse keys.
+
+
+class PaginationError(ValueError):
+    # bad limit, or a tampered or foreign cursor, routes answer 400
+    pass
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def _sign(payload):
+    return hmac.new(Config.SECRET_KEY.encode("utf-8"), payload, hashlib.sha256).digest()
+
+
+def _json_default(value):
+    # number keys come back from dynamodb as Decimal
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else str(value)
+    raise TypeError(f"Cannot encode {type(value).__name__} in a cursor")
+
+
+def encode_cursor(last_key, scope):
+    # token for the next page, or None when there are no more pages
+    if not last_key:
+        return None
+    payload = json.dumps({"k": last_key, "s": scope}, sort_keys=True, default=_json_default).encode("utf-8")
+    return f"{_b64encode(payload)}.{_b64encode(_sign(payload))}"
+
+
+def decode_cursor(cursor, scope):
+    # the LastEvaluatedKey inside a cursor, checking the signature and that it was made for this query
+    if not cursor:
+        return None
+    try:
+        payload_part, signature_part = cursor.split(".")
+        payload = _b64decode(payload_part)
+        signature = _b64decode(signature_part)
+    except ValueError:
+        raise PaginationError("Invalid cursor")
+    if not hmac.compare_digest(signature, _sign(payload)):
+        raise PaginationError("Invalid cursor")
+    data = json.loads(payload)
+    if data.get("s") != scope:
+        raise PaginationError("Cursor does not belong to this query")
+    return data["k"]
+
+
+def cursor_scope(name, *parts):
+    # identifies one listing (endpoint + filters), a cursor only works for the scope it was made in
+    return ":".join([name, *(str(part or "") for part in parts)])
+
+
+def get_page_args():
+    # (paginate, limit, cursor) from ?limit= and ?cursor=
+    # without either one the endpoint keeps returning the full list like before
+    limit = request.args.get("limit")
+    cursor = request.args.get("cursor")
+    if limit is None and cursor is None:
+        return False, None, None
+    if limit is None:
+        return True, Config.PAGE_SIZE_DEFAULT, cursor
+    try:
+        limit = int(limit)
+    except ValueError:
+        raise PaginationError("limit must be a number")
+    if limit < 1:
+        raise PaginationError("limit must be at least 1")
+    return True, min(limit, Config.PAGE_SIZE_MAX), cursor
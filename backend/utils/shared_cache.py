@@ -0,0 +1,269 @@
+import itertools
+import json
+import os
+import sqlite3
+import stat
+import tempfile
+import threading
+import time
+from decimal import Decimal
+from config import Config
+from utils import metrics
+from utils.cache import TTLCache
+
+# catalog cache shared by every gunicorn worker on a host. entries live in one sqlite
+# file on /dev/shm (tmpfs, read through mmap), so memory stays flat as workers are
+# added and a write in one worker is seen by the others on their next read.
+#
+# each key also has a generation counter. invalidating a key bumps it, and a value
+# loaded before the bump is not stored, so a slow read cant put an old copy back
+# after another worker changed the item.
+#
+# the file sits in a directory only this user can open, and values are stored as json
+# (never pickle), so nothing another local user writes can be run by the app
+_SCHEMA_VERSION = 2
+_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS generations (
+        cache TEXT NOT NULL,
+        key TEXT NOT NULL,
+        generation INTEGER NOT NULL,
+        updated_at REAL NOT NULL,
+        PRIMARY KEY (cache, key)
+    )""",
+    """CREATE TABLE IF NOT EXISTS entries (
+        cache TEXT NOT NULL,
+        key TEXT NOT NULL,
+        generation INTEGER NOT NULL,
+        expires_at REAL NOT NULL,
+        value TEXT NOT NULL,
+        PRIMARY KEY (cache, key)
+    )""",
+    "CREATE INDEX IF NOT EXISTS entries_expires_at ON entries (cache, expires_at)",
+    "CREATE INDEX IF NOT EXISTS generations_updated_at ON generations (cache, updated_at)",
+]
+# everything that means "the shared cache isnt usable right now", treated as a miss
+CACHE_ERRORS = (sqlite3.Error, OSError, TypeError, ValueError)
+# prune once every this many sets per cache and process, not on every write
+PRUNE_INTERVAL = 64
+# generation rows are kept this long past the ttl, far longer than any load can take, so a
+# load that read a generation before an invalidation still sees it was bumped
+GENERATION_GRACE = 300
+
+_local = threading.local()
+
+
+def default_path():
+    # tmpfs when the host has it, so the file never touches disk, in a directory of its own
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(base, f"lms-catalog-cache-{os.getuid()}", "catalog.sqlite3")
+
+
+def _private_directory(path):
+    # creates the directory of path for this user only, and refuses one that someone else
+    # made or can write to (the default is in world writable /dev/shm). raises OSError
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    info = os.lstat(directory)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o022:
+        raise PermissionError(f"Shared cache directory {directory} is not private to this user")
+
+
+def _encode(value):
+    # json with dynamodb numbers kept as Decimal, values json cant hold raise TypeError
+    def default(item):
+        if isinstance(item, Decimal):
+            return {"__decimal__": str(item)}
+        raise TypeError(f"Cannot cache {type(item).__name__}")
+
+    return json.dumps(value, default=default, separators=(",", ":"))
+
+
+def _decode(text):
+    def object_hook(item):
+        if len(item) == 1 and "__decimal__" in item:
+            return Decimal(item["__decimal__"])
+        return item
+
+    return json.loads(text, object_hook=object_hook)
+
+
+def _get_connection():
+    # one connection per thread, opened again after a gunicorn fork
+    pid = os.getpid()
+    if getattr(_local, "pid", None) != pid:
+        path = Config.CATALOG_SHARED_CACHE_PATH or default_path()
+        _private_directory(path)
+        connection = sqlite3.connect(path, timeout=1, isolation_level=None)
+        try:
+            # the file only holds cached copies, losing it just means a cold cache
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=OFF")
+            connection.execute(f"PRAGMA mmap_size={Config.CATALOG_SHARED_CACHE_MMAP_MB * 1024 * 1024}")
+            _create_schema(connection)
+        except sqlite3.Error:
+            connection.close()
+            raise
+        _local.connection = connection
+        _local.pid = pid
+    return _local.connection
+
+
+def _create_schema(connection):
+    # a file left by an older version of this module is emptied and rebuilt
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        if connection.execute("PRAGMA user_version").fetchone()[0] != _SCHEMA_VERSION:
+            connection.execute("DROP TABLE IF EXISTS entries")
+            connection.execute("DROP TABLE IF EXISTS generations")
+            for statement in _SCHEMA:
+                connection.execute(statement)
+            connection.execute(f"PRAGMA user_version = {_SCHEMA_VERSION}")
+        connection.execute("COMMIT")
+    except sqlite3.Error:
+        connection.execute("ROLLBACK")
+        raise
+
+
+class SharedTTLCache(TTLCache):
+    # same interface as TTLCache, but the entries are in the shared sqlite file
+    # any sqlite or file error is counted and treated as a miss, the cache never fails a request
+
+    def __init__(self, name, ttl=None, max_entries=None):
+        super().__init__(name, ttl, max_entries)
+        self._sets = itertools.count(1)
+
+    def _generation(self, connection, key):
+        row = connection.execute(
+            "SELECT generation FROM generations WHERE cache = ? AND key = ?", (self.name, key)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def _lookup(self, key):
+        # (value, generation) where value is None on a miss
+        connection = _get_connection()
+        row = connection.execute(
+            "SELECT e.value FROM entries e LEFT JOIN generations g ON g.cache = e.cache AND g.key = e.key "
+            "WHERE e.cache = ? AND e.key = ? AND e.expires_at > ? AND e.generation = COALESCE(g.generation, 0)",
+            (self.name, key, time.time()),
+        ).fetchone()
+        if row:
+            return _decode(row[0]), None
+        return None, self._generation(connection, key)
+
+    def get(self, key):
+        value, _ = self._get_with_generation(key)
+        return value
+
+    def _get_with_generation(self, key):
+        if not Config.CATALOG_CACHE_ENABLED:
+            return None, None
+        try:
+            value, generation = self._lookup(key)
+        except CACHE_ERRORS:
+            metrics.increment(f"cache.{self.name}.error")
+            return None, None
+        metrics.increment(f"cache.{self.name}.{'hit' if value is not None else 'miss'}")
+        return value, generation
+
+    def set(self, key, value, generation=None):
+        # stores the value only if the key wasnt invalidated since generation was read
+        if not Config.CATALOG_CACHE_ENABLED or value is None:
+            return
+        try:
+            connection = _get_connection()
+            if generation is None:
+                generation = self._generation(connection, key)
+            connection.execute(
+                "INSERT OR REPLACE INTO entries (cache, key, generation, expires_at, value) "
+                "SELECT ?, ?, ?, ?, ? WHERE COALESCE("
+                "(SELECT generation FROM generations WHERE cache = ? AND key = ?), 0) = ?",
+                (
+                    self.name,
+                    key,
+                    generation,
+                    time.time() + self.ttl,
+                    _encode(value),
+                    self.name,
+                    key,
+                    generation,
+                ),
+            )
+            if next(self._sets) % PRUNE_INTERVAL == 0:
+                self._prune(connection)
+        except CACHE_ERRORS:
+            metrics.increment(f"cache.{self.name}.error")
+
+    def _prune(self, connection):
+        # drops expired entries and old generation rows, then keeps the entry count under
+        # max_entries (soonest-to-expire go first). runs every PRUNE_INTERVAL sets, so the
+        # count can go over max_entries by that much in between
+        now = time.time()
+        connection.execute("DELETE FROM entries WHERE cache = ? AND expires_at <= ?", (self.name, now))
+        connection.execute(
+            "DELETE FROM generations WHERE cache = ? AND updated_at < ?",
+            (self.name, now - self.ttl - GENERATION_GRACE),
+        )
+        count = connection.execute("SELECT COUNT(*) FROM entries WHERE cache = ?", (self.name,)).fetchone()[0]
+        if count <= self.max_entries:
+            return
+        connection.execute(
+            "DELETE FROM entries WHERE cache = ? AND key IN "
+            "(SELECT key FROM entries WHERE cache = ? ORDER BY expires_at LIMIT ?)",
+            (self.name, self.name, count - self.max_entries),
+        )
+        metrics.increment(f"cache.{self.name}.evicted", count - self.max_entries)
+
+    def get_many_or_load(self, keys, loader):
+        found = {}
+        generations = {}
+        for key in dict.fromkeys(keys):
+            value, generation = self._get_with_generation(key)
+            if value is None:
+                generations[key] = generation
+            else:
+                found[key] = value
+        if generations:
+            loaded = loader(list(generations))
+            for key, value in loaded.items():
+                self.set(key, value, generations.get(key))
+            found.update(loaded)
+        return found
+
+    def get_or_load(self, key, loader):
+        value, generation = self._get_with_generation(key)
+        if value is None:
+            value = loader()
+            self.set(key, value, generation)
+        return value
+
+    def invalidate(self, *keys):
+        # bumps the generation of each key, which hides its entry in every worker at once
+        try:
+            connection = _get_connection()
+            now = time.time()
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                for key in keys:
+                    connection.execute(
+                        "INSERT INTO generations (cache, key, generation, updated_at) VALUES (?, ?, 1, ?) "
+                        "ON CONFLICT (cache, key) DO UPDATE SET generation = generation + 1, updated_at = ?",
+                        (self.name, key, now, now),
+                    )
+                    connection.execute("DELETE FROM entries WHERE cache = ? AND key = ?", (self.name, key))
+                connection.execute("COMMIT")
+            except sqlite3.Error:
+                connection.execute("ROLLBACK")
+                raise
+        except CACHE_ERRORS:
+            metrics.increment(f"cache.{self.name}.error")
+
+    def clear(self):
+        try:
+            connection = _get_connection()
+            connection.execute(
+                "UPDATE generations SET generation = generation + 1, updated_at = ? WHERE cache = ?",
+                (time.time(), self.name),
+            )
+            connection.execute("DELETE FROM entries WHERE cache = ?", (self.name,))
+        except CACHE_ERRORS:
+            metrics.increment(f"cache.{self.name}.error")
@@ -67,3 +67,19 @@ def validate_file_extension(filename, allowed_extensions):
 def validate_file_size(file_size, max_size):
     # check if file size is within limit
     return file_size <= max_size
+
+
+def parse_fields(value, max_fields=20):
+    # ?fields=courseId,title -> (["courseId", "title"], None), (None, None) when not given
+    # attribute names only, no nested paths, so they can go straight into a ProjectionExpression
+    if value is None:
+        return None, None
+    fields = list(dict.fromkeys(field.strip() for field in value.split(",") if field.strip()))
+    if not fields:
+        return None, "fields must list at least one attribute"
+    if len(fields) > max_fields:
+        return None, f"fields can list at most {max_fields} attributes"
+    for field in fields:
+        if not re.match(r"^[A-Za-z][A-Za-z0-9_]{0,63}$", field):
+            return None, f"Invalid field name: {field}"
+    return fields, None
@@ -97,6 +97,38 @@ const CourseList = () => {
                   <p className="enrollment-card-description">
                     {course.description || 'No description available.'}
                   </p>
+                  {/* summary kept on the course item, no extra requests per card */}
+                  <div className="enrollment-card-info">
+                    <div className="enrollment-info-item">
+                      <svg width="16" height="16" viewBox="0 0 24 24" fill="none" stroke="currentColor" strokeWidth="2">
+                        <path d="M4 19.5A2.5 2.5 0 0 1 6.5 17H20"/>
+                        <path d="M6.5 2H20v20H6.5A2.5 2.5 0 0 1 4 19.5v-15A2.5 2.5 0 0 1 6.5 2z"/>
+                      </svg>
+                      <span>
+                        {Number(course.moduleCount || 0)} {Number(course.moduleCount) === 1 ? 'module' : 'modules'}
+                        {' · '}
+                        {Number(course.enrollmentCount || 0)} {Number(course.enrollmentCount) === 1 ? 'student' : 'students'}
+                      </span>
+                    </div>
+                    {course.instructorNames?.length > 0 && (
+                      <div className="enrollment-info-item">
+                        <svg width="16" height="16" viewBox="0 0 24 24" fill="none" stroke="currentColor" strokeWidth="2">
+                          <path d="M20 21v-2a4 4 0 0 0-4-4H8a4 4 0 0 0-4 4v2"/>
+                          <circle cx="12" cy="7" r="4"/>
+                        </svg>
+                        <span>{course.instructorNames.join(', ')}</span>
+                      </div>
+                    )}
+                    {course.specializationName && (
+                      <div className="enrollment-info-item">
+                        <svg width="16" height="16" viewBox="0 0 24 24" fill="none" stroke="currentColor" strokeWidth="2">
+                          <path d="M20.59 13.41l-7.17 7.17a2 2 0 0 1-2.83 0L2 12V2h10l8.59 8.59a2 2 0 0 1 0 2.82z"/>
+                          <line x1="7" y1="7" x2="7.01" y2="7"/>
+                        </svg>
+                        <span>{course.specializationName}</span>
+                      </div>
+                    )}
+                  </div>
                   <div className="enrollment-card-footer">
                     <Link
                       to={`/courses/${course.courseId}`}
@@ -1,16 +1,15 @@
-import React, { useMemo } from 'react';
+import React from 'react';
 import { Link } from 'react-router-dom';
-import { useGetEnrollmentsQuery, useGetCourseQuery, useGetProgressQuery } from '../services/apiSlice';
+import { useGetStudentDashboardQuery } from '../services/apiSlice';
 import { authService } from '../utils/auth';
 
 const StudentDashboard = () => {
   const user = authService.getUser();
-  // Force refetch on mount and include user ID to make cache user-specific
-  const { data: enrollmentsData, isLoading, error } = useGetEnrollmentsQuery(
-    { userId: user?.userId },
-    { refetchOnMountOrArgChange: true }
-  );
-  const enrollments = enrollmentsData?.enrollments || [];
+  // One request for enrollments, course summaries and progress; force refetch on mount
+  const { data: dashboardData, isLoading, error } = useGetStudentDashboardQuery(undefined, {
+    refetchOnMountOrArgChange: true,
+  });
+  const enrollments = dashboardData?.enrollments || [];
   const userName = user?.name || 'Student';
 
   if (isLoading) {
@@ -100,35 +99,9 @@ const StudentDashboard = () => {
 };
 
 const EnrollmentCard = ({ enrollment }) => {
-  const user = authService.getUser();
-  // Force refetch on mount to ensure fresh data
-  const { data: courseData, isLoading: courseLoading } = useGetCourseQuery(
-    enrollment.courseId,
-    { refetchOnMountOrArgChange: true }
-  );
-  // Include user ID and force refetch to make progress user-specific
-  const { data: progressData } = useGetProgressQuery(
-    { courseId: enrollment.courseId, userId: user?.userId },
-    { refetchOnMountOrArgChange: true }
-  );
-  
-  const course = courseData?.course;
-  
-  const progress = useMemo(() => {
-    if (!course?.modules) return { percentage: 0 };
-    const progressList = progressData?.progress || [];
-    const totalModules = course.modules.length;
-    const completedModules = progressList.filter(p => p.status === 'completed').length;
-    return {
-      completed: completedModules,
-      total: totalModules,
-      percentage: totalModules > 0 ? Math.round((completedModules / totalModules) * 100) : 0
-    };
-  }, [course, progressData?.progress]);
-
-  if (courseLoading) {
-    return <div className="card">Loading course...</div>;
-  }
+  // Course summary and progress come with the dashboard response
+  const course = enrollment.course;
+  const progress = enrollment.progress || { percentage: 0 };
 
   return (
     <div className="enrollment-card">
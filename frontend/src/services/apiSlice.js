@@ -237,6 +237,14 @@ export const apiSlice = createApi({
       providesTags: ['Progress'],
     }),
 
+    // Student dashboard: enrollments, course summaries and progress in one request
+    getStudentDashboard: builder.query({
+      query: () => '/students/me/dashboard',
+      providesTags: ['Enrollment', 'Progress'],
+      // Don't keep unused data to prevent cross-user cache issues
+      keepUnusedDataFor: 0,
+    }),
+
     // Upload endpoint
     uploadFile: builder.mutation({
       query: ({ file, folderPath = '' }) => {
@@ -363,6 +371,7 @@ export const {
   useGetProgressQuery,
   useMarkProgressCompleteMutation,
   useGetProgressStatsQuery,
+  useGetStudentDashboardQuery,
   useUploadFileMutation,
   useAddStudentMutation,
   useAddInstructorMutation,